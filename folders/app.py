@@ -1,44 +1,37 @@
 # -*- coding: utf-8 -*- # Define encoding
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 from datetime import datetime, date, timedelta
-import numpy as np
-import re
-import io
 import os
+import time
+# Only light modules at import time: pandas, plotly and the helper modules (which import
+# pandas/numpy) are imported below, when a file is uploaded / a chart is drawn, so the
+# empty page of a cold-started process renders quickly
+from session_memory import SESSION_MEMORY_BUDGET_MB, restore_session_frames, account_session_memory, mark_shared_frame
+from session_snapshot import restore_session_snapshot, save_session_snapshot, record_edited_rows, discard_session_snapshot
+from user_history import session_history_dir
 
 # --- Configuração da Página Streamlit ---
 st.set_page_config(page_title="Análise de Fatura Itaú", page_icon="📊", layout="wide")
 
+# Frames of an idle session may have been spilled to disk to respect the memory budget
+restore_session_frames()
+# A new session opened with ?snapshot=<id> resumes that saved working set (memory-mapped Arrow files)
+restore_session_snapshot()
+
 # --- Funções Auxiliares ---
-def limpar_valor(valor):
-    """Cleans currency strings and converts to float."""
-    if isinstance(valor, (int, float)):
-        return float(valor)
-    if isinstance(valor) is str:
-        # Remove currency symbols, spaces, and replace comma decimal separator
-        valor_limpo = re.sub(r'[R$\s]', '', valor).replace(',', '.')
-        try:
-            return float(valor_limpo)
-        except ValueError:
-            # Handle cases where comma might be used as thousands separator
-            valor_limpo_alt = valor.replace('.', '').replace(',', '.')
-            try:
-                return float(valor_limpo_alt)
-            except ValueError:
-                return np.nan # Return NaN if conversion fails
-    return np.nan # Return NaN for other types
+def rules_file_full_path(file_path='regras_categorizacao.xlsx'):
+    """Path of the rules file (one directory above app.py, in ANALISE-FATURA-ITAU)."""
+    base_dir = os.path.dirname(__file__) # Directory of the current script (app.py)
+    return os.path.join(base_dir, '..', file_path) # Go up one dir to ANALISE-FATURA-ITAU
 
-@st.cache_data
+@st.cache_resource
 def load_rules_from_excel(file_path='regras_categorizacao.xlsx'):
-    """Loads categorization rules from an Excel file."""
+    """
+    Loads categorization rules from an Excel file. One dict is shared (read-only) by all
+    sessions; rule edits always build a new dict instead of changing this one.
+    """
     # Adjust path if rules file is not in the same directory as app.py
-    # Assuming regras_categorizacao.xlsx is in the ANALISE-FATURA-ITAU directory
-    base_dir = os.path.dirname(__file__) # Directory of the current script (app.py)
-    rules_full_path = os.path.join(base_dir, '..', file_path) # Go up one dir to ANALISE-FATURA-ITAU
+    rules_full_path = rules_file_full_path(file_path)
 
     if not os.path.exists(rules_full_path):
         st.warning(f"Arquivo de regras '{file_path}' não encontrado em '{rules_full_path}'. Usando categorização básica.");
@@ -48,56 +41,16 @@ def load_rules_from_excel(file_path='regras_categorizacao.xlsx'):
         engine = 'openpyxl' if rules_full_path.endswith('.xlsx') else 'xlrd'
         df_rules = pd.read_excel(rules_full_path, engine=engine)
 
-        # Identify potential column names - keeping flexibility but prioritizing the requested names
-        possible_keyword_cols = ['lançamento', 'Lançamento', 'Descrição', 'Descricao', 'Estabelecimento', 'PalavraChave', 'Keyword', 'Chave']
-        possible_cat1_cols = ['CategoriaNivel1', 'CategoriaGeral', 'CatNivel1', 'Cat1']
-        possible_cat2_cols = ['CategoriaNivel2', 'CategoriaDetalhada', 'CatNivel2', 'Cat2']
-
-        col_keyword, col_cat1, col_cat2 = None, None, None
-
         # Find the actual column names in the DataFrame (case-insensitive search)
-        df_rules_cols_lower = {col.lower(): col for col in df_rules.columns}
-
-        for col in possible_keyword_cols:
-            if col.lower() in df_rules_cols_lower:
-                col_keyword = df_rules_cols_lower[col.lower()]
-                break
-        for col in possible_cat1_cols:
-            if col.lower() in df_rules_cols_lower:
-                col_cat1 = df_rules_cols_lower[col.lower()]
-                break
-        for col in possible_cat2_cols:
-            if col.lower() in df_rules_cols_lower:
-                col_cat2 = df_rules_cols_lower[col.lower()]
-                break
+        col_keyword, col_cat1, col_cat2 = find_rule_columns(df_rules)
 
         # Check if essential columns were found
         if col_keyword is None or col_cat1 is None or col_cat2 is None:
-            st.error(f"O arquivo de regras '{file_path}' deve conter colunas para Palavra-Chave, Categoria Nível 1 e Categoria Nível 2. Verifique se alguma das seguintes colunas existe: Palavra-Chave: {', '.join(possible_keyword_cols)}. Categoria Nível 1: {', '.join(possible_cat1_cols)}. Categoria Nível 2: {', '.join(possible_cat2_cols)}.")
+            st.error(f"O arquivo de regras '{file_path}' deve conter colunas para Palavra-Chave, Categoria Nível 1 e Categoria Nível 2. Verifique se alguma das seguintes colunas existe: Palavra-Chave: {', '.join(POSSIBLE_KEYWORD_COLS)}. Categoria Nível 1: {', '.join(POSSIBLE_CAT1_COLS)}. Categoria Nível 2: {', '.join(POSSIBLE_CAT2_COLS)}.")
             return {}
 
-        # Select and clean relevant columns
-        df_rules = df_rules[[col_keyword, col_cat1, col_cat2]].copy()
-        df_rules[col_keyword] = df_rules[col_keyword].astype(str).str.lower().str.strip()
-        df_rules[col_cat1] = df_rules[col_cat1].astype(str).str.strip()
-        df_rules[col_cat2] = df_rules[col_cat2].fillna('N/A').astype(str).str.strip()
-
-        # Replace empty strings with None for consistent handling
-        df_rules.replace({'N/A': None, '': None}, inplace=True)
-
-        # Filter out rows with empty keywords
-        df_rules = df_rules[df_rules[col_keyword].str.strip() != '']
-
-        # Sort by keyword length descending for better matching (longer keywords first)
-        df_rules['keyword_len'] = df_rules[col_keyword].str.len()
-        df_rules = df_rules.sort_values(by='keyword_len', ascending=False)
-
-        # Convert rules DataFrame to a dictionary for faster lookup
-        rules_dict = {}
-        for _, row in df_rules.iterrows():
-            rules_dict[row[col_keyword]] = {'Nivel1': row[col_cat1], 'Nivel2': row[col_cat2]}
-
-        return rules_dict
+        # Clean, sort by keyword length and convert to a dictionary for faster lookup
+        return build_rules_dict(df_rules, col_keyword, col_cat1, col_cat2)
     except FileNotFoundError:
          st.warning(f"Arquivo de regras '{file_path}' não encontrado. Usando categorização básica.");
          return {}
@@ -105,195 +58,25 @@ def load_rules_from_excel(file_path='regras_categorizacao.xlsx'):
         st.error(f"Erro ao ler arquivo de regras '{file_path}': {e}");
         return {}
 
-def suggest_categories_v2(description, rules_dict):
-    """Suggests categories based on description and rules."""
-    cat_nivel1 = 'Não categorizado'
-    cat_nivel2 = None # Use None for no specific Nivel 2
-
-    if not isinstance(description, str):
-        return cat_nivel1, cat_nivel2
-
-    description_lower = description.lower()
-
-    # --- Modified Parcelamento Logic ---
-    # Check for parcelamento (installment) pattern first
-    parcelamento_match = re.search(r'\b(\d{1,2}/\d{1,2})\b', description)
-    if parcelamento_match:
-        # Only set Nivel 1 to 'Parcelamento' based on regex
-        cat_nivel1 = 'Parcelamento'
-        # Do NOT set cat_nivel2 here based on regex.
-        # The Nivel 2 for Parcelamento will come from the rules_dict if a matching rule exists.
-
-    # Apply rules if available
-    if rules_dict:
-        for keyword, categories in rules_dict.items():
-            keyword_found = False
-            # Use regex for whole word match if possible, fallback to substring
-            try:
-                if re.search(r'\b' + re.escape(keyword) + r'\b', description_lower):
-                    keyword_found = True
-            except re.error:
-                 # Fallback to simple substring check if regex fails (e.g., complex characters in keyword)
-                 if keyword in description_lower:
-                     keyword_found = True
-
-            # If regex didn't find it, try simple substring check as a fallback
-            if not keyword_found and keyword in description_lower:
-                 keyword_found = True
-
-            if keyword_found:
-                cat_nivel1_regra = categories.get('Nivel1', 'Não categorizado')
-                cat_nivel2_regra = categories.get('Nivel2')
-
-                # Apply rule categories
-                cat_nivel1 = cat_nivel1_regra # Rule can override Parcelamento Nivel 1 if needed
-
-                # Apply Nivel 2 rule if it exists.
-                # This will set Nivel 2 for Parcelamento if a rule matches, or for other categories.
-                if cat_nivel2_regra is not None:
-                     cat_nivel2 = cat_nivel2_regra
-
-                # If a rule matched, we can break the loop (assuming rules are sorted by specificity/length)
-                break
-
-    # Default Nivel 2 if Nivel 1 is set but Nivel 2 is still None and not 'Não categorizado' or 'Parcelamento'
-    # This now applies if no rule set Nivel 2, including for 'Parcelamento' if no specific rule exists.
-    if cat_nivel2 is None and cat_nivel1 != 'Não categorizado':
-        cat_nivel2 = 'Geral' # Or a suitable default like 'Outros'
-
-    return cat_nivel1, cat_nivel2
+@st.cache_resource
+def load_budgets_from_excel(file_path='regras_categorizacao.xlsx'):
+    """Monthly category budgets (sheet 'Orcamentos' of the rules file), shared read-only by all sessions."""
+    try:
+        return read_budgets_file(rules_file_full_path(file_path))
+    except Exception as e:
+        st.error(f"Erro ao ler os orçamentos do arquivo de regras '{file_path}': {e}");
+        return clean_budgets(None)
 
 # Modified load_data function to handle both Excel and CSV and exclude negative values
 def load_data(uploaded_file):
     """Loads data from the uploaded Excel or CSV file with specific column names and excludes negative values."""
     if uploaded_file is not None:
         try:
-            file_name = uploaded_file.name
-            file_extension = os.path.splitext(file_name)[1].lower()
-
-            if file_extension in ['.xls', '.xlsx']:
-                engine = 'openpyxl' if file_extension == '.xlsx' else 'xlrd'
-                df = pd.read_excel(uploaded_file, engine=engine, sheet_name=0)
-            elif file_extension == '.csv':
-                # Assuming comma separator, adjust if needed
-                # Try different encodings and separators
-                try:
-                    df = pd.read_csv(uploaded_file, encoding='utf-8', errors='replace')
-                except Exception as e_utf8:
-                    try:
-                        # Reset file pointer for next read attempt
-                        uploaded_file.seek(0)
-                        df = pd.read_csv(uploaded_file, encoding='ISO-8859-1', errors='replace')
-                    except Exception as e_iso:
-                         # Reset file pointer
-                         uploaded_file.seek(0)
-                         try:
-                             df = pd.read_csv(uploaded_file, encoding='utf-8', errors='replace', sep=';')
-                         except Exception as e_utf8_semicolon:
-                             # Reset file pointer
-                             uploaded_file.seek(0)
-                             try:
-                                 df = pd.read_csv(uploaded_file, encoding='ISO-8859-1', errors='replace', sep=';')
-                             except Exception as e_iso_semicolon:
-                                 st.error(f"Não foi possível ler o arquivo CSV. Tente salvar como UTF-8 com separador ','. Erros: UTF-8({e_utf8}), ISO({e_iso}), UTF-8(semicolon)({e_utf8_semicolon}), ISO(semicolon)({e_iso_semicolon})")
-                                 return None
-
-
-                # Handle potential issues with CSV headers/footers by checking for expected columns
-                # This is a basic check; more robust parsing might be needed for complex files
-                if df.empty or len(df.columns) < 3:
-                     st.error("Não foi possível ler o arquivo CSV. Verifique o formato, codificação e separador.")
-                     return None
-
-            else:
-                st.error("Formato de arquivo não suportado. Carregue um arquivo .xls, .xlsx ou .csv.")
-                return None
-
-            # Expected columns (case-insensitive matching)
-            colunas_necessarias = {'data': 'Data', 'lançamento': 'Descricao', 'valor': 'Valor'}
-            colunas_encontradas = {}
-            colunas_faltando = []
-
-            # Find the actual column names in the DataFrame (case-insensitive search)
-            df_cols_lower = {col.lower(): col for col in df.columns}
-
-            for col_padrao, col_final in colunas_necessarias.items():
-                if col_padrao in df_cols_lower:
-                    colunas_encontradas[df_cols_lower[col_padrao]] = col_final
-                else:
-                    colunas_faltando.append(col_padrao)
-
-            # Check if all necessary columns were found
-            if colunas_faltando:
-                st.error(f"Colunas essenciais não encontradas no arquivo: {', '.join(colunas_faltando)}. Certifique-se de que o arquivo contenha as colunas 'data', 'lançamento' e 'valor'.")
-                return None
-
-            # Rename columns to standard names
-            df = df.rename(columns=colunas_encontradas)
-
-            # Select only the final required columns
-            df = df[list(colunas_necessarias.values())]
-
-            # Process 'Data' column
-            if 'Data' in df.columns:
-                try:
-                    # Attempt to convert to datetime, handling potential errors
-                    df['Data_Limpada'] = df['Data'].astype(str).str.strip()
-                    # Try multiple date formats
-                    date_formats = ['%d/%m/%Y', '%Y-%m-%d', '%m/%d/%Y', '%d-%m-%Y'] # Added %d-%m-%Y
-                    for fmt in date_formats:
-                         df['Data_Convertida'] = pd.to_datetime(df['Data_Limpada'], format=fmt, errors='coerce')
-                         if not df['Data_Convertida'].isnull().all():
-                             break # Stop if at least some dates are converted
-
-                    # Check if conversion failed for all rows
-                    nan_count = df['Data_Convertida'].isnull().sum()
-                    if nan_count == len(df) and len(df) > 0: # Check if ALL rows failed
-                        # Corrected the unterminated string literal here
-                        st.error("Falha ao converter TODAS as datas. Verifique se a coluna 'data' está em um formato reconhecido (ex: DD/MM/YYYY, YYYY-MM-DD, DD-MM-YYYY).")
-
-                        return None
-
-                    df['Data'] = df['Data_Convertida']
-                    df.drop(columns=['Data_Limpada', 'Data_Convertida'], inplace=True, errors='ignore')
-
-                except Exception as e:
-                    st.error(f"Erro CRÍTICO durante a conversão da coluna 'data': {e}. Verifique o formato.");
-                    return None
-            else:
-                 st.error("Coluna 'Data' não encontrada após renomear. Verifique se a coluna 'data' existe no arquivo.")
-                 return None
-
-
-            # Process 'Valor' column
-            df['Valor'] = df['Valor'].apply(limpar_valor)
-
-            # --- Exclude rows with negative 'Valor' ---
-            df = df[df['Valor'] >= 0].copy() # Keep only non-negative values
-
-            # Process 'Descricao' column
-            df['Descricao'] = df['Descricao'].astype(str)
-
-            # Filter out rows with empty or NaN descriptions (after excluding negative values)
-            df = df[df['Descricao'].str.strip() != ''][df['Descricao'].str.lower() != 'nan']
-
-            # Initialize category columns
-            df['Categoria Nível 1'] = 'Não categorizado'
-            df['Categoria Nível 2'] = None
-
-            # Add 'MesAno' column
-            if 'Data' in df.columns and pd.api.types.is_datetime64_any_dtype(df['Data']) and not df['Data'].isnull().all():
-                df['MesAno'] = df['Data'].dt.to_period('M').astype(str)
-            else:
-                df['MesAno'] = 'N/A'
-
-            # Sort by date if data is valid
-            if 'Data' in df.columns and pd.api.types.is_datetime64_any_dtype(df['Data']) and not df['Data'].isnull().all():
-                 return df.sort_values(by='Data').reset_index(drop=True)
-            else:
-                 return df.reset_index(drop=True) # Return without sorting if data is invalid
-
-
+            # Parsing lives in statement_loader.py (also used by the local categorization service)
+            return parse_statement(uploaded_file, uploaded_file.name)
+        except StatementError as e:
+            st.error(str(e))
+            return None
         except FileNotFoundError:
             st.error("Arquivo não encontrado.")
             return None
@@ -303,17 +86,34 @@ def load_data(uploaded_file):
     return None
 
 
+@st.cache_resource(max_entries=8, show_spinner=False)
+def load_categorized_statement(statement_id, rules_key, _uploaded_file, _rules_dict):
+    """
+    Parses and categorizes a statement once per (file content, ruleset) for the whole process:
+    sessions loading the same file with the same rules share the frame and its rule index.
+    Both are read-only; a session copies them before editing (ensure_private_data).
+    """
+    df_loaded = load_data(_uploaded_file)
+    if df_loaded is None:
+        return None, None
+    df_loaded['Descricao'] = df_loaded['Descricao'].astype(str) # Ensure description is string
+    # Rules are evaluated once per unique description; the index built here lets rule
+    # edits re-categorize only the affected rows later
+    rule_index = categorize_dataframe(df_loaded, _rules_dict)
+    # Held by this cache for every session: counted once and never spilled (session_memory.py)
+    return mark_shared_frame(df_loaded), rule_index
+
+
 # Removed calculate_days_remaining function
 
-# --- CARREGA AS REGRAS DO ARQUIVO EXCEL ---
+# --- ARQUIVO DE REGRAS (lido no primeiro upload, não na importação da página) ---
 RULES_FILE_PATH = 'regras_categorizacao.xlsx'
-loaded_rules = load_rules_from_excel(RULES_FILE_PATH)
 
 # --- Inicialização do Estado da Sessão ---
 if 'df_fatura' not in st.session_state:
     st.session_state.df_fatura = None
 if 'df_for_plot' not in st.session_state:
-    st.session_state.df_for_plot = pd.DataFrame()
+    st.session_state.df_for_plot = None
 if 'categorias_mapeadas' not in st.session_state:
     st.session_state.categorias_mapeadas = {}
 if 'uploaded_file_name' not in st.session_state:
@@ -324,6 +124,46 @@ if 'selected_cat_nv1' not in st.session_state:
     st.session_state.selected_cat_nv1 = []
 if 'selected_cat_nv2' not in st.session_state:
     st.session_state.selected_cat_nv2 = []
+if 'data_version' not in st.session_state:
+    st.session_state.data_version = 0 # Bumped whenever df_fatura changes
+if 'export_cache' not in st.session_state:
+    st.session_state.export_cache = {} # Generated export files, keyed by data version
+if 'table_order_key' not in st.session_state:
+    st.session_state.table_order_key = None
+    st.session_state.table_order = None
+if 'active_rules' not in st.session_state:
+    st.session_state.active_rules = None # Rules currently applied to df_fatura (may be edited in the session); loaded on the first upload
+if 'rules_version' not in st.session_state:
+    st.session_state.rules_version = 0 # Bumped on rule changes (resets the rules editor)
+    st.session_state.rules_feedback = None
+if 'statement_id' not in st.session_state:
+    st.session_state.statement_id = None # Hash of the uploaded file (key of this statement in the history)
+if 'history_version' not in st.session_state:
+    st.session_state.history_version = None # data_version last written to the history
+    st.session_state.monthly_aggregates = None
+if 'rule_index' not in st.session_state:
+    st.session_state.rule_index = None # keyword -> descriptions / description -> rule / description -> RowIds
+if 'active_budgets' not in st.session_state:
+    st.session_state.active_budgets = None # Monthly budgets per category (loaded with the rules, on the first upload)
+    st.session_state.budgets_version = 0 # Bumped when the budgets are saved (resets the budgets editor)
+if 'budget_cumulative_version' not in st.session_state:
+    st.session_state.budget_cumulative_version = None # data_version of budget_cumulative
+    st.session_state.budget_cumulative = None # Per-category, per-day cumulative spending (budgets.py)
+if 'df_fatura_shared' not in st.session_state:
+    st.session_state.df_fatura_shared = False # df_fatura is also referenced by the load cache or by df_for_plot
+    st.session_state.rule_index_shared = False # rule_index is the one in the load cache
+if 'snapshot_restored' not in st.session_state:
+    st.session_state.snapshot_restored = False # df_fatura came from a session snapshot, not from the uploader
+
+
+def ensure_private_data():
+    """Copy-on-write: copies df_fatura / rule_index if they are shared, before editing them in place."""
+    if st.session_state.df_fatura_shared:
+        st.session_state.df_fatura = st.session_state.df_fatura.copy()
+        st.session_state.df_fatura_shared = False
+    if st.session_state.rule_index_shared and st.session_state.rule_index is not None:
+        st.session_state.rule_index = copy_rule_index(st.session_state.rule_index)
+    st.session_state.rule_index_shared = False
 
 
 # --- Interface Streamlit ---
@@ -337,15 +177,54 @@ with st.sidebar:
     # Corrected page link for the main page to be relative to the 'folders' directory
     st.page_link("app.py", label="Visão Geral", icon="📊")
     st.page_link("pages/parcelamentos_analysis.py", label="Análise de Parcelamentos", icon="💳")
+    st.page_link("pages/recorrencias_analysis.py", label="Cobranças Recorrentes", icon="🔁")
+    st.page_link("pages/regras_analysis.py", label="Perfil das Regras", icon="🧪")
     st.divider()
 
     # Updated file uploader to accept csv
     uploaded_file = st.file_uploader("1. Carregue seu arquivo Excel ou CSV (colunas: data, lançamento, valor):", type=["xls", "xlsx", "csv"])
     # Removed closing day input
 
+    st.divider()
+    nivel_grafico = st.radio("Nível Categoria Gráficos:", ('Nível 1 (Geral)', 'Nível 2 (Detalhada)'), key='nivel_grafico_radio')
+
+
+# --- File Upload Processing ---
+# A restored snapshot is shown without the file until another one is uploaded
+if uploaded_file is not None or st.session_state.snapshot_restored:
+    # Deferred heavy imports (cached in sys.modules after the first upload of the process)
+    import pandas as pd
+    from chart_downsampling import (
+        MAX_CHART_POINTS, RESOLUTION_FREQS, RESOLUTION_LABELS,
+        choose_resolution, aggregate_evolution, downsample_evolution
+    )
+    from categorization import (
+        POSSIBLE_KEYWORD_COLS, POSSIBLE_CAT1_COLS, POSSIBLE_CAT2_COLS, RULES_FILE_COLUMNS,
+        find_rule_columns, build_rules_dict, rules_dict_to_frame, save_rules_to_excel,
+        rules_signature, categorize_dataframe, build_rule_index, copy_rule_index, apply_rule_changes
+    )
+    from statement_loader import StatementError, parse_statement
+    from history import statement_id_for, update_monthly_aggregates, update_installment_ledger
+    from trends import ROLLING_WINDOWS, monthly_category_matrix, category_trends
+    from export import EXPORT_FORMATS, EXPORT_DATASETS, make_export_builder
+    from budgets import (
+        ALL_NIVEL2, STATUS_OVER, STATUS_PROJECTED_OVER, clean_budgets, read_budgets_file, save_budgets_to_excel,
+        category_cumulative_spending, evaluate_budgets, budget_breach_points
+    )
+    from table_paging import (
+        ROW_ID_COL, PAGE_SIZE_OPTIONS, DEFAULT_PAGE_SIZE,
+        compute_row_order, get_page, diff_page_edits
+    )
+
+    # --- CARREGA AS REGRAS DO ARQUIVO EXCEL ---
+    if st.session_state.active_rules is None:
+        st.session_state.active_rules = load_rules_from_excel(RULES_FILE_PATH)
+    if st.session_state.active_budgets is None:
+        st.session_state.active_budgets = load_budgets_from_excel(RULES_FILE_PATH)
+
     # Get categories from loaded rules and base lists
-    categorias_nv1_arquivo = sorted(list(set(rule['Nivel1'] for rule in loaded_rules.values() if rule.get('Nivel1'))))
-    categorias_nv2_arquivo = sorted(list(set(rule['Nivel2'] for rule in loaded_rules.values() if rule.get('Nivel2'))))
+    categorias_nv1_arquivo = sorted(list(set(rule['Nivel1'] for rule in st.session_state.active_rules.values() if rule.get('Nivel1'))))
+    categorias_nv2_arquivo = sorted(list(set(rule['Nivel2'] for rule in st.session_state.active_rules.values() if rule.get('Nivel2'))))
 
     lista_categorias_base_nv1 = ['Não categorizado', 'Alimentação', 'Transporte', 'Moradia', 'Lazer', 'Assinaturas', 'Compras Online', 'Vestuário/Compras', 'Saúde', 'Educação', 'Mercado', 'Pet', 'Serviços', 'Viagem', 'Presentes', 'Parcelamento', 'Outros']
     lista_categorias_base_nv2 = ['Geral', 'Não Aplicável', 'Compra Parcelada']
@@ -354,57 +233,58 @@ with st.sidebar:
     # Ensure None is included in Nivel 2 options for the selectbox
     lista_categorias_final_nv2 = sorted(list(set(lista_categorias_base_nv2 + [cat for cat in categorias_nv2_arquivo if cat is not None])))
 
-    st.divider()
-    nivel_grafico = st.radio("Nível Categoria Gráficos:", ('Nível 1 (Geral)', 'Nível 2 (Detalhada)'), key='nivel_grafico_radio')
-
-
-# --- File Upload Processing ---
-if uploaded_file is not None:
     # Check if a new file has been uploaded
-    if st.session_state.uploaded_file_name != uploaded_file.name:
+    if uploaded_file is not None and st.session_state.uploaded_file_name != uploaded_file.name:
         st.info(f"Carregando: {uploaded_file.name}")
         # Reset session state when a new file is uploaded
         st.session_state.df_fatura = None
         st.session_state.categorias_mapeadas = {} # Clear previous mappings
         st.session_state.uploaded_file_name = uploaded_file.name
         st.session_state.show_charts = False # Hide charts until updated
-        st.session_state.df_for_plot = pd.DataFrame() # Clear plot data
+        st.session_state.df_for_plot = None # Clear plot data
         st.session_state.selected_cat_nv1 = [] # Reset filters
         st.session_state.selected_cat_nv2 = [] # Reset filters
+        st.session_state.table_page = 1 # Back to the first page of the table
+        st.session_state.snapshot_restored = False
+        st.session_state.statement_id = statement_id_for(uploaded_file.getvalue())
         # st.rerun() # Rerun to clear the state and show loading message
 
+    if uploaded_file is None:
+        col_sessao, col_descartar = st.columns([5, 1])
+        with col_sessao:
+            st.info(f"Sessão restaurada: {st.session_state.uploaded_file_name}. Carregue um arquivo para substituí-la.")
+        with col_descartar:
+            if st.button("🗑️ Descartar sessão", key='discard_snapshot_button'):
+                discard_session_snapshot()
+                st.rerun()
+
     # Load and process the data if it's not already in session state
     if st.session_state.df_fatura is None:
-        df_loaded = load_data(uploaded_file)
+        # Apply initial categorization based on rules (shared with other sessions that load the same file)
+        df_loaded, rule_index = load_categorized_statement(
+            st.session_state.statement_id, rules_signature(st.session_state.active_rules),
+            uploaded_file, st.session_state.active_rules
+        )
 
         if df_loaded is not None:
-            # Apply initial categorization based on rules
-            df_temp = df_loaded.copy()
-            df_temp['Descricao'] = df_temp['Descricao'].astype(str) # Ensure description is string
-
-            for index, row in df_temp.iterrows():
-                 # Apply rules first
-                 sug_cat1, sug_cat2 = suggest_categories_v2(row['Descricao'], loaded_rules)
-                 df_temp.loc[index, 'Categoria Nível 1'] = sug_cat1
-                 df_temp.loc[index, 'Categoria Nível 2'] = sug_cat2
-
-                 # Check if there's a manual mapping for this description from a previous session
-                 # This part might be tricky with file upload as mappings are tied to descriptions,
-                 # but descriptions might repeat across files. For simplicity, we'll apply rules
-                 # and then allow manual editing which updates mappings for the current dataset.
-                 # If you need persistent mappings across different files, a more complex
-                 # mapping management system would be needed.
-
-            st.session_state.df_fatura = df_temp
-            st.session_state.df_for_plot = df_temp.copy() # Initialize plot data
+            # Manual mappings are tied to descriptions of the current dataset. If you need persistent
+            # mappings across different files, a more complex mapping management system would be needed.
+
+            st.session_state.df_fatura = df_loaded
+            st.session_state.rule_index = rule_index
+            st.session_state.df_fatura_shared = True
+            st.session_state.rule_index_shared = True
+            # Plot data is a reference, not a copy: edits copy df_fatura first (ensure_private_data)
+            st.session_state.df_for_plot = df_loaded
             st.session_state.show_charts = True # Show charts after initial load
             st.session_state.selected_cat_nv1 = [] # Reset filters
             st.session_state.selected_cat_nv2 = [] # Reset filters
+            st.session_state.data_version += 1
             st.rerun() # Rerun to display the loaded data and charts
 
     # --- Display Processed Data and Allow Category Editing ---
     if st.session_state.df_fatura is not None and not st.session_state.df_fatura.empty:
-        df = st.session_state.df_fatura.copy() # Use a copy to avoid modifying session state directly during editing
+        df = st.session_state.df_fatura # Read-only here; edits are applied by RowId below
 
         # Indicadores Chave
         st.subheader("Resumo")
@@ -418,6 +298,36 @@ if uploaded_file is not None:
         with col2:
              st.write("") # Placeholder for alignment
 
+        # --- Orçamentos por Categoria ---
+        if st.session_state.budget_cumulative_version != st.session_state.data_version:
+            # One groupby + cumsum per data version; every budget is evaluated against this table
+            st.session_state.budget_cumulative = category_cumulative_spending(df)
+            st.session_state.budget_cumulative_version = st.session_state.data_version
+        avaliacao_orcamentos = evaluate_budgets(st.session_state.budget_cumulative, st.session_state.active_budgets)
+
+        if not avaliacao_orcamentos.empty:
+            st.subheader("Orçamentos por Categoria")
+            n_estourados = int((avaliacao_orcamentos['Status'] == STATUS_OVER).sum())
+            n_projecao_acima = int((avaliacao_orcamentos['Status'] == STATUS_PROJECTED_OVER).sum())
+            if n_estourados:
+                st.error(f"🚨 {n_estourados} orçamento(s) estourado(s).")
+            if n_projecao_acima:
+                st.warning(f"⚠️ {n_projecao_acima} orçamento(s) com projeção acima do limite até o fim do mês.")
+            st.dataframe(
+                avaliacao_orcamentos,
+                column_config={
+                    "Categoria Nível 1": st.column_config.TextColumn("Cat. Nv1"),
+                    "Categoria Nível 2": st.column_config.TextColumn("Cat. Nv2"),
+                    "Orçamento": st.column_config.NumberColumn("Orçamento (R$)", format="R$ %.2f"),
+                    "Gasto": st.column_config.NumberColumn("Gasto (R$)", format="R$ %.2f"),
+                    "Uso (%)": st.column_config.ProgressColumn("Uso (%)", format="%.0f%%", min_value=0, max_value=100),
+                    "Projeção": st.column_config.NumberColumn("Projeção do Mês (R$)", format="R$ %.2f"),
+                    "Data do Estouro": st.column_config.DateColumn("Estourou em", format="DD/MM/YYYY"),
+                },
+                use_container_width=True,
+                hide_index=True
+            )
+
         # Table to display processed data and allow category editing
         st.subheader("Lançamentos e Categorização (Nível 1 / Nível 2)")
         st.markdown("Revise as categorias sugeridas e edite se necessário. Use 'Atualizar Gráficos' para refletir as mudanças.")
@@ -450,8 +360,42 @@ if uploaded_file is not None:
             "MesAno": None # Hide this internal column
         }
 
-        # Prepare DataFrame for display editor
-        df_display_editor = df.copy()
+        # --- Busca, Ordenação e Paginação (server-side: only the visible page is sent to the browser) ---
+        col_search, col_sort, col_order, col_page_size = st.columns([3, 2, 1, 1])
+        with col_search:
+            search_text = st.text_input("Buscar na descrição:", key='table_search')
+        with col_sort:
+            sort_options = ['Data', 'Descricao', 'Valor', 'Categoria Nível 1', 'Categoria Nível 2']
+            sort_col = st.selectbox("Ordenar por:", options=sort_options, key='table_sort_col')
+        with col_order:
+            sort_ascending = st.radio("Ordem:", ('Crescente', 'Decrescente'), key='table_sort_order') == 'Crescente'
+        with col_page_size:
+            page_size = st.selectbox("Linhas/página:", options=PAGE_SIZE_OPTIONS, index=PAGE_SIZE_OPTIONS.index(DEFAULT_PAGE_SIZE), key='table_page_size')
+
+        # Row order is cached per data version, so changing page does not re-filter/re-sort the full frame
+        view_key = (search_text, sort_col, sort_ascending, page_size)
+        order_key = (st.session_state.data_version,) + view_key
+        if st.session_state.table_order_key != order_key:
+            if st.session_state.table_order_key is None or st.session_state.table_order_key[1:] != view_key:
+                st.session_state.table_page = 1 # New search/sort: back to the first page
+            st.session_state.table_order = compute_row_order(df, search_text, sort_col, sort_ascending)
+            st.session_state.table_order_key = order_key
+        row_order = st.session_state.table_order
+
+        total_pages = max(1, -(-len(row_order) // page_size))
+        if st.session_state.get('table_page', 1) > total_pages:
+            st.session_state.table_page = total_pages
+        col_page, col_page_info = st.columns([1, 3])
+        with col_page:
+            page = st.number_input(f"Página (de {total_pages}):", min_value=1, max_value=total_pages, step=1, key='table_page')
+        with col_page_info:
+            st.write("")
+            st.caption(f"{len(row_order)} de {len(df)} lançamentos")
+
+        df_page, page, total_pages = get_page(df, row_order, page, page_size)
+
+        # Prepare the page for the display editor
+        df_display_editor = df_page.copy()
         # Ensure 'Data' is in a format compatible with st.data_editor DateColumn for display
         df_display_editor['Data'] = pd.to_datetime(df_display_editor['Data'], errors='coerce').dt.date # Convert to date objects
         # Convert None in Nivel 2 to empty string for the editor display
@@ -461,42 +405,120 @@ if uploaded_file is not None:
             df_display_editor,
             column_config=column_config_display,
             use_container_width=True,
-            hide_index=True,
+            hide_index=True, # Index is the RowId
             num_rows="fixed", # Use fixed rows as editing is for existing data
-            key="data_editor_display_" + uploaded_file.name # Use file name in key to reset on new upload
+            # File name, view and data version in the key: a new upload, a new page or an applied edit
+            # (which can change the rows of the page) starts with a clean editor, whose positional
+            # edits are never applied to the wrong rows
+            key=f"data_editor_display_{st.session_state.uploaded_file_name}_{st.session_state.data_version}_{search_text}_{sort_col}_{sort_ascending}_{page_size}_{page}"
         )
 
-        # Check if the display editor was edited
-        # Compare with the current state of df_fatura (after initial processing)
-        # Need to prepare df_fatura for comparison (convert Data to date, fillna for Nivel 2)
-        df_fatura_for_comparison = st.session_state.df_fatura.copy()
-        df_fatura_for_comparison['Data'] = pd.to_datetime(df_fatura_for_comparison['Data'], errors='coerce').dt.date
-        df_fatura_for_comparison['Categoria Nível 2'] = df_fatura_for_comparison['Categoria Nível 2'].fillna("")
-
-
-        if not edited_df_display.equals(df_fatura_for_comparison):
-            # Update session state df_fatura with edits from the display editor
-            edited_df_display['Data'] = pd.to_datetime(edited_df_display['Data'], errors='coerce') # Convert back to datetime
-            edited_df_display['Categoria Nível 2'] = edited_df_display['Categoria Nível 2'].replace({"": None}) # Convert empty back to None
-            edited_df_display['Valor'] = pd.to_numeric(edited_df_display['Valor'], errors='coerce') # Ensure Valor is numeric
-
-            # Re-add MesAno column as it might be lost in editing
-            if 'Data' in edited_df_display.columns and pd.api.types.is_datetime64_any_dtype(edited_df_display['Data']) and not edited_df_display['Data'].isnull().all():
-                 edited_df_display['MesAno'] = edited_df_display['Data'].dt.to_period('M').astype(str)
-            else:
-                 edited_df_display['MesAno'] = 'N/A'
-
-            st.session_state.df_fatura = edited_df_display.sort_values(by='Data').reset_index(drop=True)
-
-            # Update manual mappings based on edits (for the current file)
-            st.session_state.categorias_mapeadas = {} # Clear existing mappings for this file
-            for index, row in st.session_state.df_fatura.iterrows():
+        # Check which cells of the visible page were edited and write them back by RowId
+        page_changes = diff_page_edits(df_display_editor, edited_df_display, ['Data', 'Descricao', 'Valor', 'Categoria Nível 1', 'Categoria Nível 2'])
+
+        if page_changes:
+            ensure_private_data()
+            df_fatura_edit = st.session_state.df_fatura # Index == RowId, updated in place
+            edited_row_ids = set()
+            for col, new_values in page_changes.items():
+                if col == 'Data':
+                    new_values = pd.to_datetime(new_values, errors='coerce') # Convert back to datetime
+                    df_fatura_edit.loc[new_values.index, 'MesAno'] = new_values.dt.to_period('M').astype(str).where(new_values.notna(), 'N/A')
+                elif col == 'Valor':
+                    new_values = pd.to_numeric(new_values, errors='coerce') # Ensure Valor is numeric
+                elif col == 'Descricao':
+                    st.session_state.rule_index = None # Description -> rows changed: rebuilt when rules change
+                elif col == 'Categoria Nível 2':
+                    new_values = new_values.replace({"": None}) # Convert empty back to None
+                df_fatura_edit.loc[new_values.index, col] = new_values
+                edited_row_ids.update(new_values.index)
+
+            # Remember the manual categories of the edited descriptions (kept on re-categorization)
+            for _, row in df_fatura_edit.loc[sorted(edited_row_ids)].iterrows():
                  st.session_state.categorias_mapeadas[str(row['Descricao'])] = {'Nivel1': row['Categoria Nível 1'], 'Nivel2': row['Categoria Nível 2']}
 
-
+            st.session_state.data_version += 1
+            record_edited_rows(st.session_state, edited_row_ids) # Saved as a delta of the session snapshot
             st.info("Categorias editadas. Clique em 'Atualizar Gráficos'.")
             # st.rerun() # Rerunning here might be too aggressive
 
+        # --- Edição de Regras (re-categoriza apenas os lançamentos afetados) ---
+        with st.expander("⚙️ Editar Regras de Categorização"):
+            st.markdown("Edite, adicione ou remova regras. Apenas os lançamentos cuja descrição contém uma palavra-chave alterada são recategorizados; categorias editadas manualmente são mantidas.")
+            edited_rules = st.data_editor(
+                rules_dict_to_frame(st.session_state.active_rules),
+                num_rows="dynamic",
+                use_container_width=True,
+                hide_index=True,
+                key=f"rules_editor_{st.session_state.rules_version}" # New key after each apply resets the editor
+            )
+            col_rules1, col_rules2 = st.columns(2)
+            with col_rules1:
+                apply_rules_pressed = st.button("💾 Aplicar e Salvar Regras", key='apply_rules_button')
+            with col_rules2:
+                reload_rules_pressed = st.button("🔄 Recarregar Regras do Arquivo", key='reload_rules_button')
+
+            new_rules = None
+            if apply_rules_pressed:
+                new_rules = build_rules_dict(edited_rules, *RULES_FILE_COLUMNS)
+            elif reload_rules_pressed:
+                load_rules_from_excel.clear()
+                new_rules = load_rules_from_excel(RULES_FILE_PATH)
+
+            if new_rules is not None:
+                ensure_private_data()
+                if st.session_state.rule_index is None:
+                    st.session_state.rule_index = build_rule_index(st.session_state.df_fatura, st.session_state.active_rules)
+                inicio = time.perf_counter()
+                n_descricoes, n_linhas = apply_rule_changes(
+                    st.session_state.df_fatura, st.session_state.rule_index,
+                    st.session_state.active_rules, new_rules, st.session_state.categorias_mapeadas
+                )
+                duracao_ms = (time.perf_counter() - inicio) * 1000
+                st.session_state.active_rules = new_rules
+
+                if apply_rules_pressed:
+                    try:
+                        save_rules_to_excel(new_rules, rules_file_full_path(RULES_FILE_PATH))
+                        load_rules_from_excel.clear() # Next sessions read the saved file
+                    except Exception as e:
+                        st.error(f"Erro ao salvar arquivo de regras '{RULES_FILE_PATH}': {e}");
+
+                if n_linhas:
+                    st.session_state.data_version += 1
+                st.session_state.rules_version += 1
+                st.session_state.rules_feedback = f"Regras aplicadas: {n_descricoes} descrições afetadas, {n_linhas} lançamentos recategorizados em {duracao_ms:.1f} ms."
+                st.rerun()
+
+            if st.session_state.rules_feedback:
+                st.success(st.session_state.rules_feedback)
+                st.session_state.rules_feedback = None
+
+        # --- Orçamentos Mensais (salvos na aba 'Orcamentos' do arquivo de regras) ---
+        with st.expander("💰 Orçamentos Mensais por Categoria"):
+            st.markdown("Defina um orçamento mensal por Categoria Nível 1 (Nível 2 vazio) ou por par Nível 1 / Nível 2. Os orçamentos são salvos no arquivo de regras, na aba 'Orcamentos'.")
+            edited_budgets = st.data_editor(
+                st.session_state.active_budgets.replace({'CategoriaNivel2': {ALL_NIVEL2: None}}),
+                column_config={
+                    "CategoriaNivel1": st.column_config.SelectboxColumn("Cat. Nível 1", options=all_possible_cats_nv1, required=True),
+                    "CategoriaNivel2": st.column_config.SelectboxColumn("Cat. Nível 2", options=all_possible_cats_nv2),
+                    "OrcamentoMensal": st.column_config.NumberColumn("Orçamento Mensal (R$)", min_value=0.0, format="R$ %.2f", required=True),
+                },
+                num_rows="dynamic",
+                use_container_width=True,
+                hide_index=True,
+                key=f"budgets_editor_{st.session_state.budgets_version}" # New key after each save resets the editor
+            )
+            if st.button("💾 Salvar Orçamentos", key='save_budgets_button'):
+                st.session_state.active_budgets = clean_budgets(edited_budgets)
+                try:
+                    save_budgets_to_excel(st.session_state.active_budgets, rules_file_full_path(RULES_FILE_PATH))
+                    load_budgets_from_excel.clear() # Next sessions read the saved file
+                    st.session_state.budgets_version += 1
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Erro ao salvar os orçamentos no arquivo de regras '{RULES_FILE_PATH}': {e}");
+
 
         st.divider()
 
@@ -519,9 +541,18 @@ if uploaded_file is not None:
             st.write("")
             update_button_pressed = st.button("🔄 Atualizar Gráficos", key='update_charts_button')
 
+        if update_button_pressed:
+            # The charts now reference the current data; the next edit copies df_fatura first
+            st.session_state.df_for_plot = st.session_state.df_fatura
+            st.session_state.df_fatura_shared = True
+            st.session_state.show_charts = True
+
         # --- Visualizações Gráficas ---
         # Trigger chart update when button is pressed or if data is initially loaded/edited
-        if st.session_state.show_charts and not st.session_state.df_for_plot.empty:
+        if st.session_state.show_charts and st.session_state.df_for_plot is not None and not st.session_state.df_for_plot.empty:
+             import plotly.express as px
+             import plotly.graph_objects as go
+             from plotly.subplots import make_subplots
 
              df_plot_filtered = st.session_state.df_for_plot.copy()
 
@@ -630,7 +661,7 @@ if uploaded_file is not None:
                  df_plot_filtered['Data'] = pd.to_datetime(df_plot_filtered['Data'], errors='coerce')
                  df_plot_line_base = df_plot_filtered.dropna(subset=['Data']).sort_values(by='Data')
 
-                 col_date1, col_date2, col_limit = st.columns([1, 1, 1])
+                 col_date1, col_date2, col_limit, col_resolucao = st.columns([1, 1, 1, 1])
                  with col_date1:
                      # Set default start date to the minimum date in the filtered data or 30 days ago
                      default_start_date = df_plot_line_base['Data'].min().date() if not df_plot_line_base.empty else date.today() - timedelta(days=30)
@@ -641,6 +672,8 @@ if uploaded_file is not None:
                      end_date = st.date_input("Data Fim:", value=default_end_date, key='end_date_evol_flex') # No min/max to allow flexible input
                  with col_limit:
                      gasto_limite = st.number_input("Limite Saldo Acumulado (R$):", min_value=0.0, value=0.0, step=100.0, format="%.2f", help="Valor > 0 plota linha limite.")
+                 with col_resolucao:
+                     resolucao = st.selectbox("Resolução:", options=['Automática'] + list(RESOLUTION_FREQS.keys()), key='resolucao_evol', help="Automática agrupa por semana ou mês em períodos longos.")
 
                  # Filter data based on selected date range
                  if start_date and end_date and start_date <= end_date:
@@ -653,19 +686,19 @@ if uploaded_file is not None:
 
                  # The evolution chart now uses all non-negative values
                  if not df_plot_line.empty:
-                     # Group by date and calculate daily total and cumulative sum
-                     gastos_por_dia = df_plot_line.groupby(df_plot_line['Data'].dt.date)['Valor'].sum().reset_index()
-                     gastos_por_dia['Data'] = pd.to_datetime(gastos_por_dia['Data']) # Convert date objects back to datetime for plotting
-                     gastos_por_dia = gastos_por_dia.sort_values(by='Data')
-                     # Cumulative sum of all non-negative values
-                     gastos_por_dia['Saldo Acumulado'] = gastos_por_dia['Valor'].cumsum()
+                     # Group by day/week/month (coarser for long ranges) and calculate total and cumulative sum
+                     freq = choose_resolution(start_date, end_date) if resolucao == 'Automática' else RESOLUTION_FREQS[resolucao]
+                     label_periodo = RESOLUTION_LABELS[freq]
+                     gastos_por_periodo = aggregate_evolution(df_plot_line, freq)
+                     # Cap the points per trace (LTTB keeps the shape, the peak and the limit crossing)
+                     gastos_por_dia, idx_cruzamento = downsample_evolution(gastos_por_periodo, gasto_limite, MAX_CHART_POINTS)
 
                      fig_evol = make_subplots(specs=[[{"secondary_y": True}]])
 
                      # --- INVERSÃO AQUI ---
-                     # Add LINE for daily value (Primary Y-axis)
+                     # Add LINE for daily value (Primary Y-axis), WebGL-rendered
                      fig_evol.add_trace(
-                         go.Scatter(x=gastos_por_dia['Data'], y=gastos_por_dia['Valor'], name="Valor Diário", mode='lines+markers', line=dict(color='royalblue', width=2)),
+                         go.Scattergl(x=gastos_por_dia['Data'], y=gastos_por_dia['Valor'], name=f"Valor {label_periodo}", mode='lines+markers', line=dict(color='royalblue', width=2)),
                          secondary_y=False,
                      )
                      # Add BARS for cumulative balance (Secondary Y-axis)
@@ -691,16 +724,38 @@ if uploaded_file is not None:
                              showarrow=False, yshift=10, xanchor="right",
                              font=dict(color="red", size=10)
                          )
+                         # Mark the period where the cumulative balance reaches the limit
+                         if idx_cruzamento is not None:
+                             fig_evol.add_trace(
+                                 go.Scattergl(x=[gastos_por_dia['Data'].iloc[idx_cruzamento]], y=[gastos_por_dia['Saldo Acumulado'].iloc[idx_cruzamento]], name="Limite atingido", mode='markers', marker=dict(color='red', size=10, symbol='x')),
+                                 secondary_y=True,
+                             )
+
+                     # Mark the days on which a category budget of the plotted categories was exceeded
+                     estouros = budget_breach_points(avaliacao_orcamentos, df_plot_line)
+                     if not estouros.empty and not gastos_por_dia.empty:
+                         estouros = estouros[(estouros['Data do Estouro'] >= start_dt) & (estouros['Data do Estouro'] <= end_dt)]
+                         # Height: cumulative balance of the period containing the breach day
+                         posicoes = gastos_por_dia['Data'].searchsorted(estouros['Data do Estouro'], side='right') - 1
+                         posicoes = posicoes.clip(0, len(gastos_por_dia) - 1)
+                         rotulos = [
+                             f"Orçamento estourado: {n1}{' / ' + n2 if isinstance(n2, str) else ''} (R$ {gasto:.2f} de R$ {orcamento:.2f})"
+                             for n1, n2, gasto, orcamento in zip(estouros['Categoria Nível 1'], estouros['Categoria Nível 2'], estouros['Gasto'], estouros['Orçamento'])
+                         ]
+                         fig_evol.add_trace(
+                             go.Scatter(x=estouros['Data do Estouro'], y=gastos_por_dia['Saldo Acumulado'].to_numpy()[posicoes], name="Orçamento estourado", mode='markers', marker=dict(color='darkred', size=11, symbol='triangle-up'), hovertext=rotulos, hoverinfo='text'),
+                             secondary_y=True,
+                         )
 
 
                      fig_evol.update_layout(
-                         title_text="Valor Diário e Saldo Acumulado",
+                         title_text=f"Valor {label_periodo} e Saldo Acumulado",
                          xaxis_title="Data",
                          legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
                          hovermode='x unified' # Improve hover experience
                      )
                      # Adjust axis colors to match the traces (optional, but good practice)
-                     fig_evol.update_yaxes(title_text="Valor Diário (R$)", secondary_y=False, title_font_color='royalblue', tickfont_color='royalblue')
+                     fig_evol.update_yaxes(title_text=f"Valor {label_periodo} (R$)", secondary_y=False, title_font_color='royalblue', tickfont_color='royalblue')
                      fig_evol.update_yaxes(title_text="Saldo Acumulado (R$)", secondary_y=True, title_font_color='lightsalmon', tickfont_color='lightsalmon')
 
                      st.plotly_chart(fig_evol, use_container_width=True)
@@ -712,15 +767,85 @@ if uploaded_file is not None:
         else:
              st.info("Clique em 'Atualizar Gráficos' para exibir as visualizações.")
 
+        # --- Tendências Mensais por Categoria (histórico de faturas) ---
+        # The aggregates, transactions and installment lines of this statement are replaced in the history only when its data changes
+        if st.session_state.history_version != st.session_state.data_version:
+            try:
+                history_dir = session_history_dir(create=True) # This user's history (user_history.py)
+                # Also stores the statement's transactions (the months it touches are regrouped from them)
+                st.session_state.monthly_aggregates = update_monthly_aggregates(st.session_state.statement_id, st.session_state.df_fatura, history_dir=history_dir)
+                update_installment_ledger(st.session_state.statement_id, st.session_state.df_fatura, history_dir=history_dir)
+            except Exception as e:
+                st.warning(f"Não foi possível atualizar o histórico de faturas: {e}")
+            st.session_state.history_version = st.session_state.data_version
+
+        st.markdown("---")
+        st.subheader(f"Tendências Mensais por Categoria ({nivel_grafico})")
+        coluna_tendencia = 'Categoria Nível 1' if nivel_grafico == 'Nível 1 (Geral)' else 'Categoria Nível 2'
+        matriz_mensal = monthly_category_matrix(st.session_state.monthly_aggregates, coluna_tendencia) if st.session_state.monthly_aggregates is not None else pd.DataFrame()
+
+        if len(matriz_mensal) < 2:
+            st.info("Carregue faturas de meses diferentes para ver as tendências (o histórico é acumulado a cada upload).")
+        else:
+            import plotly.express as px
+            import plotly.graph_objects as go
+
+            df_tendencias = category_trends(matriz_mensal)
+            # Default: the 5 categories with the highest total in the history
+            categorias_top = matriz_mensal.sum().sort_values(ascending=False).index.tolist()
+            col_trend1, col_trend2 = st.columns([3, 1])
+            with col_trend1:
+                categorias_tendencia = st.multiselect("Categorias:", options=categorias_top, default=categorias_top[:5], key='categorias_tendencia')
+            with col_trend2:
+                janela_media = st.selectbox("Média móvel:", options=ROLLING_WINDOWS, format_func=lambda w: f"{w} meses", key='janela_media_tendencia')
+
+            df_tendencias_sel = df_tendencias[df_tendencias['Categoria'].isin(categorias_tendencia)]
+            if not df_tendencias_sel.empty:
+                col_t1, col_t2 = st.columns(2)
+                with col_t1:
+                    st.markdown("##### Total Mensal e Média Móvel")
+                    fig_trend = px.line(df_tendencias_sel, x='MesAno', y='Valor', color='Categoria', markers=True, labels={'Valor': 'Total (R$)', 'MesAno': 'Mês'})
+                    # Dashed rolling average with the same color per category
+                    for trace in list(fig_trend.data):
+                        dados_cat = df_tendencias_sel[df_tendencias_sel['Categoria'] == trace.name]
+                        fig_trend.add_trace(go.Scatter(x=dados_cat['MesAno'], y=dados_cat[f'Média {janela_media}m'], name=f"{trace.name} (média {janela_media}m)", mode='lines', line=dict(color=trace.line.color, dash='dash'), showlegend=False))
+                    fig_trend.update_layout(yaxis_title="Total (R$)", hovermode='x unified')
+                    st.plotly_chart(fig_trend, use_container_width=True)
+                with col_t2:
+                    ultimo_mes = df_tendencias_sel['MesAno'].max()
+                    st.markdown(f"##### Variação em {ultimo_mes.strftime('%m/%Y')}")
+                    df_ultimo = df_tendencias_sel[df_tendencias_sel['MesAno'] == ultimo_mes].melt(id_vars='Categoria', value_vars=['Variação MoM', 'Variação YoY'], var_name='Comparação', value_name='Variação (R$)')
+                    fig_delta = px.bar(df_ultimo, x='Categoria', y='Variação (R$)', color='Comparação', barmode='group', text_auto='.2f', color_discrete_sequence=px.colors.qualitative.Pastel)
+                    fig_delta.update_layout(xaxis_tickangle=-45)
+                    st.plotly_chart(fig_delta, use_container_width=True)
+
+                st.dataframe(
+                    df_tendencias_sel.sort_values(by=['MesAno', 'Valor'], ascending=[False, False]),
+                    column_config={
+                        "MesAno": st.column_config.DateColumn("Mês", format="MM/YYYY"),
+                        "Valor": st.column_config.NumberColumn("Total (R$)", format="R$ %.2f"),
+                        "Variação MoM": st.column_config.NumberColumn("Var. Mês (R$)", format="R$ %.2f"),
+                        "Variação MoM (%)": st.column_config.NumberColumn("Var. Mês (%)", format="%.1f%%"),
+                        "Média 3m": st.column_config.NumberColumn("Média 3m", format="R$ %.2f"),
+                        "Média 6m": st.column_config.NumberColumn("Média 6m", format="R$ %.2f"),
+                        "Média 12m": st.column_config.NumberColumn("Média 12m", format="R$ %.2f"),
+                        "Valor Ano Anterior": st.column_config.NumberColumn("Ano Anterior (R$)", format="R$ %.2f"),
+                        "Variação YoY": st.column_config.NumberColumn("Var. Ano (R$)", format="R$ %.2f"),
+                    },
+                    use_container_width=True,
+                    hide_index=True,
+                    height=300
+                )
+
         # --- Outras Análises ---
         st.subheader("Outras Análises")
         st.markdown("**Maiores Valores (Top 5)**") # Changed title
         # Use the current state of df_fatura for this analysis
         if st.session_state.df_fatura is not None and not st.session_state.df_fatura.empty:
-            df_analysis = st.session_state.df_fatura.copy()
-            df_analysis['Valor'] = pd.to_numeric(df_analysis['Valor'], errors='coerce')
-            # Find largest values (which are now non-negative)
-            maiores_valores = df_analysis.nlargest(5, 'Valor')
+            df_analysis = st.session_state.df_fatura
+            # Find largest values (which are now non-negative); only these 5 rows are copied and sent to the browser
+            maiores_idx = pd.to_numeric(df_analysis['Valor'], errors='coerce').nlargest(5).index
+            maiores_valores = df_analysis.loc[maiores_idx]
 
             if not maiores_valores.empty:
                 st.dataframe(
@@ -740,6 +865,27 @@ if uploaded_file is not None:
         else:
             st.info("Carregue dados para ver os maiores valores.")
 
+        # --- Exportar Dados ---
+        st.subheader("Exportar Dados")
+        col_export1, col_export2, col_export3 = st.columns([2, 1, 1])
+        with col_export1:
+            export_dataset = st.selectbox("Dados:", options=list(EXPORT_DATASETS.keys()), key='export_dataset')
+        with col_export2:
+            export_format = st.selectbox("Formato:", options=list(EXPORT_FORMATS.keys()), key='export_format')
+        with col_export3:
+            st.write("") # Add some vertical space
+            st.write("")
+            export_extension, export_mime = EXPORT_FORMATS[export_format]
+            # The file is only built when clicked (and reused until df_fatura changes)
+            st.download_button(
+                "⬇️ Exportar",
+                data=make_export_builder(st.session_state.df_fatura, st.session_state.data_version, export_dataset, export_format, st.session_state.export_cache),
+                file_name=f"{EXPORT_DATASETS[export_dataset][0]}.{export_extension}",
+                mime=export_mime,
+                on_click='ignore',
+                key='export_download_button'
+            )
+
     elif uploaded_file is not None and st.session_state.df_fatura is None:
          st.warning("Não foi possível processar o arquivo. Verifique se ele contém as colunas 'data', 'lançamento' e 'valor' e se o formato da data é DD/MM/YYYY.")
 
@@ -750,3 +896,8 @@ else:
 # --- Rodapé ---
 st.markdown("---")
 st.caption(f"Análise de Fatura | v2.17 (Corrected Page Links Relative to Entrypoint) | {datetime.now().year}")
+# Snapshot of the working set (only the edited rows when the last change was a table edit)
+save_session_snapshot()
+# Memory accounting of this session; over the budget, idle sessions are spilled to disk
+memoria_sessao, memoria_total = account_session_memory(st.session_state.data_version)
+st.caption(f"Memória: sessão {memoria_sessao / 1024 ** 2:.1f} MB | todas as sessões {memoria_total / 1024 ** 2:.1f} MB de {SESSION_MEMORY_BUDGET_MB:.0f} MB")
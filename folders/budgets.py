@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Monthly budgets per Categoria Nível 1 (or per Nível 1 / Nível 2 pair), stored in the
+BUDGETS_SHEET sheet of the rules workbook.
+
+The statement is reduced once per data version to per-category, per-day cumulative sums
+(category_cumulative_spending: one groupby + one cumsum for both levels). All budgets are
+then evaluated together with one merge against that table, instead of filtering the
+statement for each budget.
+"""
+import numpy as np
+import pandas as pd
+
+from categorization import read_workbook_sheets, update_workbook_sheets
+
+BUDGETS_SHEET = 'Orcamentos'
+BUDGET_FILE_COLUMNS = ['CategoriaNivel1', 'CategoriaNivel2', 'OrcamentoMensal']
+ALL_NIVEL2 = '' # CategoriaNivel2 of a budget that covers the whole Nível 1 category
+
+STATUS_OVER = 'Estourado'
+STATUS_PROJECTED_OVER = 'Projeção acima'
+STATUS_OK = 'Dentro do orçamento'
+STATUS_ORDER = {STATUS_OVER: 0, STATUS_PROJECTED_OVER: 1, STATUS_OK: 2}
+
+
+def clean_budgets(df_budgets):
+    """
+    Keeps the valid budget rows (Nível 1 and a positive amount); an empty Nível 2 means the
+    budget covers the whole Nível 1 category. Repeated categories keep the last row.
+    """
+    if df_budgets is None or df_budgets.empty or not set(BUDGET_FILE_COLUMNS) <= set(df_budgets.columns):
+        return pd.DataFrame(columns=BUDGET_FILE_COLUMNS)
+    df_budgets = df_budgets[BUDGET_FILE_COLUMNS].copy()
+    df_budgets['CategoriaNivel1'] = df_budgets['CategoriaNivel1'].fillna('').astype(str).str.strip()
+    df_budgets['CategoriaNivel2'] = df_budgets['CategoriaNivel2'].fillna('').astype(str).str.strip()
+    df_budgets['OrcamentoMensal'] = pd.to_numeric(df_budgets['OrcamentoMensal'], errors='coerce')
+    df_budgets = df_budgets[(df_budgets['CategoriaNivel1'] != '') & (df_budgets['OrcamentoMensal'] > 0)]
+    return df_budgets.drop_duplicates(subset=['CategoriaNivel1', 'CategoriaNivel2'], keep='last').reset_index(drop=True)
+
+
+def read_budgets_file(rules_full_path):
+    """Budgets of the rules workbook (empty frame when the file or the sheet does not exist)."""
+    return clean_budgets(read_workbook_sheets(rules_full_path).get(BUDGETS_SHEET))
+
+
+def save_budgets_to_excel(df_budgets, rules_full_path):
+    """
+    Writes the budgets sheet of the rules workbook (the rules sheet is kept as it is), through
+    the same locked, atomic update_workbook_sheets as save_rules_to_excel.
+    """
+    df_budgets = clean_budgets(df_budgets)
+    def update(sheets):
+        sheets[BUDGETS_SHEET] = df_budgets
+    update_workbook_sheets(rules_full_path, update)
+
+
+def category_cumulative_spending(df_fatura):
+    """
+    Spending per category, month and day with the cumulative sum inside each month, for
+    Nível 1 categories (CategoriaNivel2 == ALL_NIVEL2) and Nível 1 / Nível 2 pairs.
+
+    Returns:
+        pd.DataFrame: 'CategoriaNivel1', 'CategoriaNivel2', 'MesAno', 'Dia', 'Valor' and
+        'Acumulado', sorted by category, month and day.
+    """
+    valores = pd.to_numeric(df_fatura['Valor'], errors='coerce')
+    valid = df_fatura['Data'].notna() & valores.notna() & (df_fatura['MesAno'] != 'N/A')
+    df = df_fatura[valid]
+    if df.empty:
+        return pd.DataFrame(columns=['CategoriaNivel1', 'CategoriaNivel2', 'MesAno', 'Dia', 'Valor', 'Acumulado'])
+
+    nivel1 = df['Categoria Nível 1'].astype(str).to_numpy()
+    nivel2 = df['Categoria Nível 2']
+    com_nivel2 = nivel2.notna().to_numpy()
+    dias = df['Data'].dt.normalize().to_numpy()
+    meses = df['MesAno'].to_numpy()
+    valores = valores[valid].to_numpy(dtype=float)
+    # Each row counts for its Nível 1 budget and, when it has a Nível 2, for the pair budget
+    rows = pd.DataFrame({
+        'CategoriaNivel1': np.concatenate([nivel1, nivel1[com_nivel2]]),
+        'CategoriaNivel2': np.concatenate([np.full(len(df), ALL_NIVEL2, dtype=object), nivel2.to_numpy()[com_nivel2].astype(str)]),
+        'MesAno': np.concatenate([meses, meses[com_nivel2]]),
+        'Dia': np.concatenate([dias, dias[com_nivel2]]),
+        'Valor': np.concatenate([valores, valores[com_nivel2]]),
+    })
+    keys = ['CategoriaNivel1', 'CategoriaNivel2', 'MesAno']
+    daily = rows.groupby(keys + ['Dia'], sort=True)['Valor'].sum().reset_index()
+    daily['Acumulado'] = daily.groupby(keys, sort=False)['Valor'].cumsum()
+    return daily
+
+
+def evaluate_budgets(cumulative, df_budgets, reference_date=None):
+    """
+    Spending of every budget in every month of the statement, the day the budget was
+    exceeded and the projection for the month (spending so far / elapsed days * days in
+    the month; months before the reference date are complete).
+
+    Args:
+        cumulative (pd.DataFrame): Output of category_cumulative_spending.
+        df_budgets (pd.DataFrame): Output of clean_budgets.
+        reference_date (pd.Timestamp): "Today" of the projection (defaults to the last day with spending).
+
+    Returns:
+        pd.DataFrame: One row per budget and month with 'Orçamento', 'Gasto', 'Uso (%)',
+        'Projeção', 'Data do Estouro' and 'Status', the most critical first.
+    """
+    if cumulative.empty or df_budgets.empty:
+        return pd.DataFrame()
+    keys = ['CategoriaNivel1', 'CategoriaNivel2', 'MesAno']
+    merged = cumulative.merge(df_budgets, on=['CategoriaNivel1', 'CategoriaNivel2'])
+    if merged.empty:
+        return pd.DataFrame()
+
+    # Rows are sorted by day inside each category/month: the last one holds the month total
+    over = merged[merged['Acumulado'] > merged['OrcamentoMensal']]
+    result = merged.groupby(keys, sort=False).agg(Orcamento=('OrcamentoMensal', 'first'), Gasto=('Acumulado', 'last'))
+    result['Data do Estouro'] = over.groupby(keys, sort=False)['Dia'].min()
+    result = result.reset_index()
+
+    reference_date = pd.Timestamp(reference_date).normalize() if reference_date is not None else cumulative['Dia'].max()
+    meses = pd.PeriodIndex(result['MesAno'], freq='M')
+    inicio = meses.start_time
+    dias_no_mes = meses.days_in_month.to_numpy()
+    dias_decorridos = np.clip((reference_date - inicio).days.to_numpy() + 1, 1, dias_no_mes)
+    result['Projeção'] = result['Gasto'] / dias_decorridos * dias_no_mes
+    result['Uso (%)'] = result['Gasto'] / result['Orcamento'] * 100
+    result['Status'] = np.select(
+        [result['Gasto'] > result['Orcamento'], result['Projeção'] > result['Orcamento']],
+        [STATUS_OVER, STATUS_PROJECTED_OVER], default=STATUS_OK
+    )
+
+    result = result.rename(columns={
+        'CategoriaNivel1': 'Categoria Nível 1',
+        'CategoriaNivel2': 'Categoria Nível 2',
+        'MesAno': 'Mês',
+        'Orcamento': 'Orçamento',
+    })
+    result['Categoria Nível 2'] = result['Categoria Nível 2'].replace({ALL_NIVEL2: None})
+    result = result.assign(_ordem=result['Status'].map(STATUS_ORDER)).sort_values(by=['_ordem', 'Uso (%)'], ascending=[True, False])
+    columns = ['Status', 'Mês', 'Categoria Nível 1', 'Categoria Nível 2', 'Orçamento', 'Gasto', 'Uso (%)', 'Projeção', 'Data do Estouro']
+    return result[columns].reset_index(drop=True)
+
+
+def budget_breach_points(evaluation, df_plot):
+    """
+    Budgets exceeded by categories present in df_plot (the filtered chart data), with the
+    day of the breach, for the markers on the evolution chart.
+    """
+    if evaluation.empty:
+        return evaluation
+    breaches = evaluation[evaluation['Data do Estouro'].notna()]
+    presentes_nv1 = set(df_plot['Categoria Nível 1'].dropna())
+    presentes_pares = set(zip(df_plot['Categoria Nível 1'], df_plot['Categoria Nível 2']))
+    nivel2 = breaches['Categoria Nível 2']
+    keep = np.where(
+        nivel2.isna(),
+        breaches['Categoria Nível 1'].isin(presentes_nv1),
+        [pair in presentes_pares for pair in zip(breaches['Categoria Nível 1'], nivel2)]
+    )
+    return breaches[keep.astype(bool)]
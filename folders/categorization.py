@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Categorization engine: rule cleaning, suggest_categories_v2 and the reverse indexes used to
+re-categorize only the rows affected by a rule change.
+
+A rule (keyword) matches a description when the lowercased keyword occurs in the lowercased
+description (the word-boundary regex in suggest_categories_v2 falls back to a substring
+check, so a substring hit is what decides). The winning rule is the first matching keyword
+in rules_dict order (longest keywords first).
+"""
+import hashlib
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from file_locks import file_lock, write_atomic
+
+PARCELAMENTO_REGEX = r'\b(\d{1,2}/\d{1,2})\b'
+
+# Possible column names in the rules file - keeping flexibility but prioritizing the requested names
+POSSIBLE_KEYWORD_COLS = ['lançamento', 'Lançamento', 'Descrição', 'Descricao', 'Estabelecimento', 'PalavraChave', 'Keyword', 'Chave']
+POSSIBLE_CAT1_COLS = ['CategoriaNivel1', 'CategoriaGeral', 'CatNivel1', 'Cat1']
+POSSIBLE_CAT2_COLS = ['CategoriaNivel2', 'CategoriaDetalhada', 'CatNivel2', 'Cat2']
+
+# Column names used when the rules are written back to the Excel file
+RULES_FILE_COLUMNS = ['PalavraChave', 'CategoriaNivel1', 'CategoriaNivel2']
+
+
+def find_rule_columns(df_rules):
+    """Finds the keyword / Nivel 1 / Nivel 2 columns (case-insensitive). Missing ones are None."""
+    df_rules_cols_lower = {str(col).lower(): col for col in df_rules.columns}
+    found = []
+    for possible_cols in (POSSIBLE_KEYWORD_COLS, POSSIBLE_CAT1_COLS, POSSIBLE_CAT2_COLS):
+        found.append(next((df_rules_cols_lower[col.lower()] for col in possible_cols if col.lower() in df_rules_cols_lower), None))
+    return tuple(found)
+
+
+def build_rules_dict(df_rules, col_keyword, col_cat1, col_cat2):
+    """
+    Cleans a rules table and converts it to {keyword: {'Nivel1': ..., 'Nivel2': ...}},
+    sorted by keyword length descending (longer keywords first).
+    """
+    # Select and clean relevant columns
+    df_rules = df_rules[[col_keyword, col_cat1, col_cat2]].copy()
+    # Empty cells (NaN from the file, None from rows added in the rules editor) become '', not 'nan' / 'none'
+    df_rules[col_keyword] = df_rules[col_keyword].fillna('').astype(str).str.lower().str.strip()
+    df_rules[col_cat1] = df_rules[col_cat1].fillna('').astype(str).str.strip()
+    df_rules[col_cat2] = df_rules[col_cat2].fillna('').astype(str).str.strip()
+
+    # Filter out rows without a keyword or a Nivel 1 category
+    df_rules = df_rules[(df_rules[col_keyword] != '') & (df_rules[col_cat1] != '')]
+
+    # Replace empty strings with None for consistent handling
+    df_rules = df_rules.replace({'N/A': None, '': None})
+
+    # Sort by keyword length descending for better matching (longer keywords first)
+    df_rules['keyword_len'] = df_rules[col_keyword].str.len()
+    df_rules = df_rules.sort_values(by='keyword_len', ascending=False)
+
+    # Convert rules DataFrame to a dictionary for faster lookup
+    rules_dict = {}
+    for keyword, cat1, cat2 in zip(df_rules[col_keyword], df_rules[col_cat1], df_rules[col_cat2]):
+        rules_dict[keyword] = {'Nivel1': cat1, 'Nivel2': cat2}
+    return rules_dict
+
+
+def rules_signature(rules_dict):
+    """Content hash of a rules dict (order included): the same rules map to the same cached results."""
+    return hashlib.sha1(repr(list(rules_dict.items())).encode('utf-8')).hexdigest()[:16]
+
+
+def rules_dict_to_frame(rules_dict):
+    """Converts rules_dict back to a table with RULES_FILE_COLUMNS (for editing and saving)."""
+    return pd.DataFrame(
+        [(keyword, categories.get('Nivel1'), categories.get('Nivel2')) for keyword, categories in rules_dict.items()],
+        columns=RULES_FILE_COLUMNS
+    )
+
+
+def read_rules_file(rules_full_path):
+    """
+    Reads and cleans the Excel rules file without Streamlit (for the categorization service).
+
+    Raises:
+        ValueError: The keyword / Nivel 1 / Nivel 2 columns were not found.
+    """
+    engine = 'openpyxl' if rules_full_path.endswith('.xlsx') else 'xlrd'
+    df_rules = pd.read_excel(rules_full_path, engine=engine)
+    col_keyword, col_cat1, col_cat2 = find_rule_columns(df_rules)
+    if col_keyword is None or col_cat1 is None or col_cat2 is None:
+        raise ValueError(f"Rules file '{rules_full_path}' needs keyword, Nivel 1 and Nivel 2 columns.")
+    return build_rules_dict(df_rules, col_keyword, col_cat1, col_cat2)
+
+
+def read_workbook_sheets(rules_full_path):
+    """All sheets of the rules workbook as {name: frame}, in workbook order (empty if there is no file)."""
+    if not os.path.exists(rules_full_path):
+        return {}
+    engine = 'openpyxl' if rules_full_path.endswith('.xlsx') else 'xlrd'
+    return pd.read_excel(rules_full_path, sheet_name=None, engine=engine)
+
+
+def write_workbook_sheets(rules_full_path, sheets):
+    """
+    Writes {name: frame} to the rules workbook (the first sheet is the rules table) through a
+    temporary file renamed over it, so a crash mid-write never leaves a truncated workbook.
+    """
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as tmp_file, pd.ExcelWriter(tmp_file, engine='openpyxl') as writer: # Handle: the .tmp name has no .xlsx extension
+            for sheet_name, df in sheets.items():
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+    write_atomic(rules_full_path, write)
+
+
+def update_workbook_sheets(rules_full_path, update):
+    """
+    Read-modify-write of the rules workbook shared by all sessions: reads the sheets, calls
+    update(sheets) to change them in place and writes them back, all under file_lock, so a
+    rules save and a budgets save (or two sessions) never undo each other's changes.
+    """
+    with file_lock(rules_full_path):
+        sheets = read_workbook_sheets(rules_full_path)
+        update(sheets)
+        write_workbook_sheets(rules_full_path, sheets)
+
+
+def save_rules_to_excel(rules_dict, rules_full_path):
+    """
+    Writes the rules to the Excel rules file (first sheet, RULES_FILE_COLUMNS). The other
+    sheets of the workbook (e.g. the category budgets) are kept.
+    """
+    def update(sheets):
+        rules_sheet = next(iter(sheets), 'Sheet1')
+        sheets[rules_sheet] = rules_dict_to_frame(rules_dict) # Same position and name as before
+    update_workbook_sheets(rules_full_path, update)
+
+
+def suggest_categories_v2(description, rules_dict):
+    """Suggests categories based on description and rules."""
+    cat_nivel1 = 'Não categorizado'
+    cat_nivel2 = None # Use None for no specific Nivel 2
+
+    if not isinstance(description, str):
+        return cat_nivel1, cat_nivel2
+
+    description_lower = description.lower()
+
+    # --- Modified Parcelamento Logic ---
+    # Check for parcelamento (installment) pattern first
+    parcelamento_match = re.search(PARCELAMENTO_REGEX, description)
+    if parcelamento_match:
+        # Only set Nivel 1 to 'Parcelamento' based on regex
+        cat_nivel1 = 'Parcelamento'
+        # Do NOT set cat_nivel2 here based on regex.
+        # The Nivel 2 for Parcelamento will come from the rules_dict if a matching rule exists.
+
+    # Apply rules if available
+    if rules_dict:
+        for keyword, categories in rules_dict.items():
+            keyword_found = False
+            # Use regex for whole word match if possible, fallback to substring
+            try:
+                if re.search(r'\b' + re.escape(keyword) + r'\b', description_lower):
+                    keyword_found = True
+            except re.error:
+                 # Fallback to simple substring check if regex fails (e.g., complex characters in keyword)
+                 if keyword in description_lower:
+                     keyword_found = True
+
+            # If regex didn't find it, try simple substring check as a fallback
+            if not keyword_found and keyword in description_lower:
+                 keyword_found = True
+
+            if keyword_found:
+                return categories_for_rule(description, keyword, rules_dict)
+
+    return categories_for_rule(description, None, rules_dict)
+
+
+def categories_for_rule(description, keyword, rules_dict):
+    """
+    Categories of a description given its winning rule (None when no rule matches).
+    Same outcome as suggest_categories_v2, without searching for the rule.
+    """
+    cat_nivel1 = 'Parcelamento' if re.search(PARCELAMENTO_REGEX, description) else 'Não categorizado'
+    cat_nivel2 = None
+
+    if keyword is not None:
+        categories = rules_dict[keyword]
+        # Rule can override Parcelamento Nivel 1 if needed
+        cat_nivel1 = categories.get('Nivel1', 'Não categorizado')
+        # Apply Nivel 2 rule if it exists (also sets Nivel 2 for Parcelamento)
+        if categories.get('Nivel2') is not None:
+            cat_nivel2 = categories.get('Nivel2')
+
+    # Default Nivel 2 if Nivel 1 is set but Nivel 2 is still None and not 'Não categorizado'
+    if cat_nivel2 is None and cat_nivel1 != 'Não categorizado':
+        cat_nivel2 = 'Geral' # Or a suitable default like 'Outros'
+
+    return cat_nivel1, cat_nivel2
+
+
+def winning_rule(description_lower, rules_dict):
+    """First keyword (in rules_dict order) contained in the lowercased description, or None."""
+    return next((keyword for keyword in rules_dict if keyword in description_lower), None)
+
+
+def _winning_rule_positions(descriptions_lower, rules_dict):
+    """
+    Position (in rules_dict order) of the winning rule of each lowercased description, -1
+    when none matches: one vectorized substring scan per keyword, first hit wins.
+
+    Returns:
+        tuple: (np.ndarray of positions, {keyword: boolean hit mask} for keywords with hits)
+    """
+    winner = np.full(len(descriptions_lower), -1)
+    keyword_hits = {}
+    for rule_position, keyword in enumerate(rules_dict):
+        hits = descriptions_lower.str.contains(keyword, regex=False).to_numpy()
+        if hits.any():
+            keyword_hits[keyword] = hits
+            winner[hits & (winner < 0)] = rule_position
+    return winner, keyword_hits
+
+
+def categorize_descriptions(descriptions, rules_dict):
+    """
+    Categories of a list of descriptions, same outcome as suggest_categories_v2 on each one
+    but with the rules evaluated once per unique description (used for request batches).
+
+    Returns:
+        list: (Nivel 1, Nivel 2) per description, in the input order.
+    """
+    descriptions = pd.Series(descriptions, dtype=object)
+    if descriptions.empty:
+        return []
+    codes, uniques = pd.factorize(descriptions, use_na_sentinel=False)
+    is_text = np.array([isinstance(desc, str) for desc in uniques], dtype=bool)
+    uniques_lower = pd.Series([desc.lower() if text else '' for desc, text in zip(uniques, is_text)])
+    winner, _ = _winning_rule_positions(uniques_lower, rules_dict)
+    keywords = list(rules_dict)
+    categories = [
+        categories_for_rule(desc, keywords[pos] if pos >= 0 else None, rules_dict) if text else ('Não categorizado', None)
+        for desc, pos, text in zip(uniques, winner, is_text)
+    ]
+    return [categories[code] for code in codes]
+
+
+def build_rule_index(df_fatura, rules_dict):
+    """
+    Builds the reverse indexes over the unique descriptions of df_fatura.
+
+    Returns:
+        dict: {
+            'keyword_descriptions': {keyword: set of descriptions containing it},
+            'description_rule': {description: winning keyword or None},
+            'description_rows': {description: np.ndarray of RowIds (df_fatura index)},
+        }
+    """
+    descriptions = df_fatura['Descricao'].astype(str)
+    codes, uniques = pd.factorize(descriptions)
+    uniques_lower = pd.Series(uniques).str.lower()
+
+    # description -> rows, from one stable argsort of the factorized codes
+    order = np.argsort(codes, kind='stable')
+    bounds = np.cumsum(np.bincount(codes, minlength=len(uniques)))
+    row_ids = df_fatura.index.to_numpy()[order]
+    description_rows = {desc: rows for desc, rows in zip(uniques, np.split(row_ids, bounds[:-1]))}
+
+    winner, keyword_hits = _winning_rule_positions(uniques_lower, rules_dict)
+    keyword_descriptions = {keyword: set(uniques[hits]) for keyword, hits in keyword_hits.items()}
+    keywords = list(rules_dict)
+    description_rule = {desc: (keywords[pos] if pos >= 0 else None) for desc, pos in zip(uniques, winner)}
+
+    return {
+        'keyword_descriptions': keyword_descriptions,
+        'description_rule': description_rule,
+        'description_rows': description_rows,
+    }
+
+
+def copy_rule_index(index):
+    """
+    Copy of a rule index that apply_rule_changes can update without touching the original
+    (it only replaces entries of the top-level dicts, so their values can stay shared).
+    """
+    return {name: dict(mapping) for name, mapping in index.items()}
+
+
+def _assign_categories(df_fatura, index, descriptions, rules_dict):
+    """Writes the categories of the given descriptions into df_fatura, one .loc per category pair."""
+    rows_by_categories = {}
+    for desc in descriptions:
+        categories = categories_for_rule(desc, index['description_rule'][desc], rules_dict)
+        rows_by_categories.setdefault(categories, []).append(index['description_rows'][desc])
+    updated = 0
+    for (cat1, cat2), rows in rows_by_categories.items():
+        rows = np.concatenate(rows)
+        df_fatura.loc[rows, 'Categoria Nível 1'] = cat1
+        df_fatura.loc[rows, 'Categoria Nível 2'] = cat2
+        updated += len(rows)
+    return updated
+
+
+def categorize_dataframe(df_fatura, rules_dict):
+    """
+    Initial categorization of every row (equivalent to suggest_categories_v2 row by row,
+    but evaluated once per unique description). Updates df_fatura in place.
+
+    Returns:
+        dict: The rule index (see build_rule_index).
+    """
+    index = build_rule_index(df_fatura, rules_dict)
+    _assign_categories(df_fatura, index, index['description_rows'].keys(), rules_dict)
+    return index
+
+
+def changed_keywords(old_rules, new_rules):
+    """Keywords added, removed or with different categories between two rule dicts."""
+    changed = set(old_rules.keys() ^ new_rules.keys())
+    changed.update(keyword for keyword in old_rules.keys() & new_rules.keys() if old_rules[keyword] != new_rules[keyword])
+    return changed
+
+
+def apply_rule_changes(df_fatura, index, old_rules, new_rules, overrides=None):
+    """
+    Re-categorizes only the rows whose description contains a changed keyword.
+
+    Args:
+        df_fatura (pd.DataFrame): Categorized frame (index == RowId), updated in place.
+        index (dict): Rule index built for old_rules (updated in place to new_rules).
+        old_rules (dict): Rules currently applied.
+        new_rules (dict): Rules to apply.
+        overrides (dict): Manual categories {description: {...}}; these rows are kept as they are.
+
+    Returns:
+        tuple: (number of affected descriptions, number of rows updated)
+    """
+    overrides = overrides or {}
+    affected = set()
+    for keyword in changed_keywords(old_rules, new_rules):
+        if keyword in new_rules and keyword not in old_rules:
+            # New keyword: one scan over the unique descriptions to find where it occurs
+            hits = {desc for desc in index['description_rows'] if keyword in desc.lower()}
+            if hits:
+                index['keyword_descriptions'][keyword] = hits
+        elif keyword not in new_rules:
+            hits = index['keyword_descriptions'].pop(keyword, set())
+        else:
+            hits = index['keyword_descriptions'].get(keyword, set())
+        affected.update(hits)
+
+    # Only the affected descriptions look for their winning rule again
+    for desc in affected:
+        index['description_rule'][desc] = winning_rule(desc.lower(), new_rules)
+
+    to_update = [desc for desc in affected if desc not in overrides]
+    return len(affected), _assign_categories(df_fatura, index, to_update, new_rules)
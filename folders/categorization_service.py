@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Local HTTP service over the same categorization engine as the app (fully offline, stdlib
+http.server; binds to 127.0.0.1 by default).
+
+Endpoints (JSON in / JSON out):
+    GET  /health
+    POST /categorize            {"descriptions": ["UBER *TRIP", ...]}
+                                -> {"categories": [{"Categoria Nível 1": ..., "Categoria Nível 2": ...}, ...]}
+    POST /parse-statement       raw file bytes; file name in the 'X-File-Name' header or ?file_name=
+                                -> {"transactions": [...]} (parsed and categorized, as in the app)
+    POST /project-installments  {"transactions": [{"Data", "Descricao", "Valor"}, ...], "start_month": "2025-01"}
+                                -> {"projection": [{"Mês": ..., "Valor Projetado": ...}, ...]}
+
+/categorize requests that arrive together are micro-batched: they wait up to
+BATCH_MAX_WAIT_MS (or until BATCH_MAX_DESCRIPTIONS are queued) and go to a worker process
+as one categorize_descriptions call. Workers load the rules file once, when they start.
+
+Usage:
+    python folders/categorization_service.py --port 8765 --workers 4
+"""
+import argparse
+import io
+import json
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from categorization import categorize_descriptions, categorize_dataframe, read_rules_file
+from installments import add_installment_columns, project_installments
+from statement_loader import StatementError, parse_statement
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'regras_categorizacao.xlsx')
+
+BATCH_MAX_DESCRIPTIONS = 5000 # A batch is sent as soon as this many descriptions are queued
+BATCH_MAX_WAIT_MS = 5 # ... or when the first request of the batch waited this long
+REQUEST_TIMEOUT_SECONDS = 60
+MAX_BODY_BYTES = 50 * 1024 ** 2
+
+# --- Worker process side (rules loaded once per worker) ---
+_worker_rules = None
+
+
+def _init_worker(rules_file):
+    global _worker_rules
+    _worker_rules = read_rules_file(rules_file) if os.path.exists(rules_file) else {}
+
+
+def _categorize_batch(descriptions):
+    return categorize_descriptions(descriptions, _worker_rules)
+
+
+def _parse_statement_job(file_bytes, file_name):
+    """Parses and categorizes a statement; returns (records JSON, error message)."""
+    try:
+        df = parse_statement(io.BytesIO(file_bytes), file_name)
+    except StatementError as e:
+        return None, str(e)
+    categorize_dataframe(df, _worker_rules)
+    return df.drop(columns=['RowId']).to_json(orient='records', date_format='iso', force_ascii=False), None
+
+
+def _project_installments_job(transactions, start_month):
+    df = pd.DataFrame(transactions, columns=['Data', 'Descricao', 'Valor'])
+    df['Data'] = pd.to_datetime(df['Data'], errors='coerce')
+    df['Valor'] = pd.to_numeric(df['Valor'], errors='coerce')
+    df_parcelamentos = add_installment_columns(df.dropna(subset=['Data', 'Valor']))
+    if df_parcelamentos.empty:
+        return '[]'
+    start = pd.Period(start_month, freq='M').to_timestamp() if start_month else None
+    projection = project_installments(df_parcelamentos, start).rename_axis('Mês').reset_index()
+    return projection.to_json(orient='records', date_format='iso', force_ascii=False)
+
+
+# --- Server side ---
+class MicroBatcher:
+    """
+    Collects concurrent categorize requests and submits them to the pool as one call.
+    The batching thread does not wait for results, so several batches run in parallel
+    on the workers.
+    """
+
+    def __init__(self, executor, max_descriptions=BATCH_MAX_DESCRIPTIONS, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.executor = executor
+        self.max_descriptions = max_descriptions
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name='micro-batcher', daemon=True).start()
+
+    def submit(self, descriptions):
+        """Returns a Future with the categories of these descriptions."""
+        future = Future()
+        self._queue.put((list(descriptions), future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_descriptions:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            descriptions = [desc for item_descriptions, _ in batch for desc in item_descriptions]
+            try:
+                result = self.executor.submit(_categorize_batch, descriptions)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            result.add_done_callback(lambda done, batch=batch: self._distribute(done, batch))
+
+    @staticmethod
+    def _distribute(done, batch):
+        if done.exception() is not None:
+            for _, future in batch:
+                future.set_exception(done.exception())
+            return
+        categories = done.result()
+        start = 0
+        for item_descriptions, future in batch:
+            future.set_result(categories[start:start + len(item_descriptions)])
+            start += len(item_descriptions)
+
+
+class CategorizationHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive: clients reuse the connection
+    disable_nagle_algorithm = True # Headers and body are separate writes; don't wait for delayed ACKs
+    server_version = 'AnaliseFaturaService/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload):
+        body = payload.encode('utf-8') if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError(f"Body larger than {MAX_BODY_BYTES} bytes")
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self._send_json(200, {'status': 'ok', 'workers': self.server.workers})
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        routes = {
+            '/categorize': self._categorize,
+            '/parse-statement': self._parse_statement,
+            '/project-installments': self._project_installments,
+        }
+        if url.path not in routes:
+            self._send_json(404, {'error': 'Not found'})
+            return
+        try:
+            status, payload = routes[url.path](url)
+        except (ValueError, TypeError, KeyError) as e:
+            status, payload = 400, {'error': str(e)}
+        except Exception as e:
+            status, payload = 500, {'error': str(e)}
+        self._send_json(status, payload)
+
+    def _json_body(self):
+        data = json.loads(self._read_body() or b'{}')
+        if not isinstance(data, dict):
+            raise ValueError('Body must be a JSON object')
+        return data
+
+    def _categorize(self, url):
+        descriptions = self._json_body().get('descriptions')
+        if not isinstance(descriptions, list):
+            raise ValueError("'descriptions' must be a list")
+        categories = self.server.batcher.submit(descriptions).result(timeout=REQUEST_TIMEOUT_SECONDS)
+        return 200, {'categories': [{'Categoria Nível 1': cat1, 'Categoria Nível 2': cat2} for cat1, cat2 in categories]}
+
+    def _parse_statement(self, url):
+        file_name = self.headers.get('X-File-Name') or parse_qs(url.query).get('file_name', [''])[0]
+        if not file_name:
+            raise ValueError("File name missing ('X-File-Name' header or ?file_name=)")
+        records, error = self.server.executor.submit(_parse_statement_job, self._read_body(), file_name).result(timeout=REQUEST_TIMEOUT_SECONDS)
+        if error is not None:
+            return 422, {'error': error}
+        return 200, '{"transactions": ' + records + '}'
+
+    def _project_installments(self, url):
+        data = self._json_body()
+        transactions = data.get('transactions')
+        if not isinstance(transactions, list):
+            raise ValueError("'transactions' must be a list")
+        records = self.server.executor.submit(_project_installments_job, transactions, data.get('start_month')).result(timeout=REQUEST_TIMEOUT_SECONDS)
+        return 200, '{"projection": ' + records + '}'
+
+
+class CategorizationServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 # Many clients connecting at once (the default backlog of 5 drops SYNs)
+
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, rules_file=DEFAULT_RULES_FILE,
+                max_batch=BATCH_MAX_DESCRIPTIONS, max_wait_ms=BATCH_MAX_WAIT_MS, verbose=False):
+    """Creates the HTTP server with its worker pool and micro-batcher (call serve_forever)."""
+    workers = workers or os.cpu_count() or 1
+    server = CategorizationServer((host, port), CategorizationHandler)
+    server.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(rules_file,))
+    server.batcher = MicroBatcher(server.executor, max_batch, max_wait_ms)
+    server.workers = workers
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local categorization service (offline).")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--rules', default=DEFAULT_RULES_FILE, help="Excel rules file")
+    parser.add_argument('--max-batch', type=int, default=BATCH_MAX_DESCRIPTIONS, help="Descriptions per batch")
+    parser.add_argument('--max-wait-ms', type=float, default=BATCH_MAX_WAIT_MS, help="Max wait to fill a batch")
+    parser.add_argument('--verbose', action='store_true', help="Log every request")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.workers, args.rules, args.max_batch, args.max_wait_ms, args.verbose)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt # Same clean shutdown (workers included) as Ctrl+C
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f"Serviço de categorização em http://{args.host}:{args.port} ({server.workers} workers, regras: {args.rules})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown(cancel_futures=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Adaptive resolution for the 'Evolução Diária e Acumulada' chart.
+
+Long periods are aggregated to week/month and the remaining series is reduced with
+LTTB (Largest-Triangle-Three-Buckets), always keeping the peak and the point where
+the cumulative balance crosses 'gasto_limite', so each trace has at most
+MAX_CHART_POINTS points regardless of the size of the history.
+"""
+import numpy as np
+import pandas as pd
+
+MAX_CHART_POINTS = 1000 # Cap of points per trace sent to the browser
+
+# Period label -> pandas period frequency
+RESOLUTION_FREQS = {'Diária': 'D', 'Semanal': 'W', 'Mensal': 'M'}
+RESOLUTION_LABELS = {'D': 'Diário', 'W': 'Semanal', 'M': 'Mensal'}
+
+# Above these spans (in days) the automatic mode switches to a coarser resolution
+AUTO_DAILY_MAX_DAYS = 180
+AUTO_WEEKLY_MAX_DAYS = 3 * 365
+
+
+def choose_resolution(start_date, end_date):
+    """Picks 'D', 'W' or 'M' from the length of the selected date range."""
+    span_days = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days
+    if span_days <= AUTO_DAILY_MAX_DAYS:
+        return 'D'
+    if span_days <= AUTO_WEEKLY_MAX_DAYS:
+        return 'W'
+    return 'M'
+
+
+def aggregate_evolution(df_plot_line, freq):
+    """
+    Groups the transactions by period and computes the cumulative balance.
+
+    Args:
+        df_plot_line (pd.DataFrame): Rows with datetime 'Data' and numeric 'Valor'.
+        freq (str): 'D', 'W' or 'M'.
+
+    Returns:
+        pd.DataFrame: Columns 'Data' (period start), 'Valor' and 'Saldo Acumulado', sorted by date.
+    """
+    periodo = df_plot_line['Data'].dt.to_period(freq).dt.start_time
+    gastos = df_plot_line.groupby(periodo)['Valor'].sum().sort_index().reset_index()
+    gastos.columns = ['Data', 'Valor']
+    gastos['Saldo Acumulado'] = gastos['Valor'].cumsum()
+    return gastos
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Args:
+        x (np.ndarray): Increasing numeric x values.
+        y (np.ndarray): Values to preserve visually.
+        n_out (int): Number of points to keep (first and last are always kept).
+
+    Returns:
+        np.ndarray: Sorted indices of the selected points.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # n - 2 inner points split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point for the final bucket)
+        next_start, next_end = end, (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Triangle area between the previous selected point, each candidate and the next average
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+
+def limit_crossing_index(saldo_acumulado, gasto_limite):
+    """Returns the first position where the cumulative balance reaches the limit, or None."""
+    if not gasto_limite or gasto_limite <= 0:
+        return None
+    crossed = np.asarray(saldo_acumulado, dtype=float) >= gasto_limite
+    if not crossed.any():
+        return None
+    return int(np.argmax(crossed))
+
+
+def downsample_evolution(gastos, gasto_limite=0.0, max_points=MAX_CHART_POINTS):
+    """
+    Chooses which rows of the aggregated evolution frame are plotted.
+
+    The daily line is reduced with LTTB; the maximum value and the limit crossing are
+    added back if LTTB dropped them.
+
+    Returns:
+        tuple: (downsampled frame, position of the limit crossing in that frame or None)
+    """
+    crossing = limit_crossing_index(gastos['Saldo Acumulado'], gasto_limite)
+    if len(gastos) <= max_points:
+        return gastos, crossing
+
+    x = gastos['Data'].to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(float)
+    keep = [0, int(np.argmax(gastos['Valor'].to_numpy()))]
+    if crossing is not None:
+        keep.append(crossing)
+    # Leave room for the forced points so the cap holds
+    idx = lttb_indices(x, gastos['Valor'].to_numpy(), max_points - len(keep))
+    idx = np.union1d(idx, keep)
+
+    gastos_plot = gastos.iloc[idx].reset_index(drop=True)
+    if crossing is not None:
+        crossing = int(np.searchsorted(idx, crossing))
+    return gastos_plot, crossing
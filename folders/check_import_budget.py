@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Cold-start check for the Streamlit pages: each page runs in a fresh interpreter, in bare
+mode (no upload, i.e. the empty page right after a scale-to-zero restart), and the time
+from interpreter start-up to the end of the script is compared with a budget. The heavy
+modules that the empty page must not import are checked too.
+
+Exits with status 1 when a page is over budget or imported a deferred module.
+
+Usage:
+    python folders/check_import_budget.py
+    python folders/check_import_budget.py --budget-ms 800 --runs 5
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# The main page and every page under pages/ (a new page cannot skip the budget)
+PAGES = ['app.py'] + sorted(os.path.relpath(path, BASE_DIR) for path in glob.glob(os.path.join(BASE_DIR, 'pages', '*.py')))
+DEFAULT_BUDGET_MS = 1000 # Per page, including `import streamlit` (~250 ms on a laptop)
+# Imported only after an upload / when a chart is drawn (streamlit itself loads plotly.graph_objects)
+DEFERRED_MODULES = ['pandas', 'numpy', 'plotly.express', 'openpyxl', 'xlrd', 'pyarrow']
+
+# Runs inside the child interpreter: times the page script and reports the loaded modules
+_CHILD = """
+import json, runpy, sys, time
+start = time.perf_counter()
+runpy.run_path(sys.argv[1], run_name='__main__')
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed_ms': elapsed * 1000, 'modules': [m for m in sys.argv[2:] if m in sys.modules]}))
+"""
+
+
+def measure_page(page, deferred_modules=DEFERRED_MODULES):
+    """Runs the page once in a new interpreter. Returns (milliseconds, deferred modules loaded)."""
+    result = subprocess.run(
+        [sys.executable, '-c', _CHILD, page] + list(deferred_modules),
+        cwd=BASE_DIR, capture_output=True, text=True, check=True # Bare-mode warnings go to stderr
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    return report['elapsed_ms'], report['modules']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start time budget of the Streamlit pages (empty state).")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help="Max median cold start per page")
+    parser.add_argument('--runs', type=int, default=3, help="Fresh interpreters per page (the median is used)")
+    args = parser.parse_args()
+
+    failed = False
+    for page in PAGES:
+        timings, loaded = [], set()
+        for _ in range(args.runs):
+            elapsed_ms, modules = measure_page(page)
+            timings.append(elapsed_ms)
+            loaded.update(modules)
+        median_ms = statistics.median(timings)
+        over_budget = median_ms > args.budget_ms
+        failed = failed or over_budget or bool(loaded)
+        status = 'FALHOU' if over_budget or loaded else 'ok'
+        print(f"{page}: {median_ms:.0f} ms (orçamento {args.budget_ms:.0f} ms) {status}")
+        if loaded:
+            print(f"  módulos pesados importados no estado vazio: {', '.join(sorted(loaded))}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
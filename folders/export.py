@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Bulk export of the categorized data (transactions, category aggregates and installment
+projection) to Parquet, CSV and XLSX.
+
+Every writer works in chunks of EXPORT_CHUNK_ROWS rows straight into the output buffer,
+so exporting a large frame does not build several full in-memory copies of it.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+
+from installments import add_installment_columns, project_installments
+
+EXPORT_CHUNK_ROWS = 100_000
+XLSX_MAX_ROWS_PER_SHEET = 1_048_575 # Excel limit (1,048,576) minus the header row
+
+# Format label -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'CSV': ('csv', 'text/csv'),
+    'XLSX': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+TRANSACTION_EXPORT_COLUMNS = ['Data', 'Descricao', 'Valor', 'Categoria Nível 1', 'Categoria Nível 2', 'MesAno']
+
+
+def transactions_for_export(df_fatura):
+    """Selects the exported columns (a column selection, not a deep copy of the data)."""
+    return df_fatura[[col for col in TRANSACTION_EXPORT_COLUMNS if col in df_fatura.columns]]
+
+
+def category_aggregates(df_fatura):
+    """Total, count and mean per MesAno / Categoria Nível 1 / Categoria Nível 2."""
+    valores = pd.to_numeric(df_fatura['Valor'], errors='coerce')
+    keys = [df_fatura['MesAno'], df_fatura['Categoria Nível 1'], df_fatura['Categoria Nível 2'].fillna('N/A ou Geral')]
+    agregados = valores.groupby(keys).agg(['sum', 'count', 'mean']).reset_index()
+    agregados.columns = ['MesAno', 'Categoria Nível 1', 'Categoria Nível 2', 'Total', 'Quantidade', 'Média']
+    return agregados
+
+
+def installment_projection(df_fatura):
+    """Full monthly projection of the remaining installments (no start month filter)."""
+    df_parcelamentos = df_fatura[df_fatura['Categoria Nível 1'] == 'Parcelamento']
+    if df_parcelamentos.empty:
+        return pd.DataFrame(columns=['Mês', 'Valor Projetado'])
+    df_parcelamentos = add_installment_columns(df_parcelamentos)
+    if df_parcelamentos.empty:
+        return pd.DataFrame(columns=['Mês', 'Valor Projetado'])
+    projection = project_installments(df_parcelamentos)
+    return projection.rename_axis('Mês').reset_index()
+
+
+def _iter_chunks(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def write_csv(df, buffer):
+    """Writes CSV (UTF-8 with BOM so Excel detects the encoding) chunk by chunk."""
+    text = io.TextIOWrapper(buffer, encoding='utf-8-sig', newline='')
+    df.to_csv(text, index=False, chunksize=EXPORT_CHUNK_ROWS, date_format='%Y-%m-%d')
+    text.flush()
+    text.detach() # Leave the underlying buffer open for the caller
+
+
+def write_parquet(df, buffer):
+    """Writes Parquet one row group per chunk, converting only one chunk to Arrow at a time."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Schema from the first chunk; all-None object columns (e.g. Nível 2) are typed as string
+    schema = pa.Schema.from_pandas(df.iloc[:EXPORT_CHUNK_ROWS], preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, pa.field(field.name, pa.string()))
+    with pq.ParquetWriter(buffer, schema) as writer:
+        for chunk in _iter_chunks(df):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def _xlsx_sheet_rows(df):
+    """
+    Yields (sheet number, row number, values) with plain Python values, header first on
+    every sheet. Values are converted column-wise per chunk, and a new sheet is started
+    when the Excel row limit is reached.
+    """
+    header = [str(col) for col in df.columns]
+    sheet_number, row_number = 1, 0
+    yield sheet_number, row_number, header
+    for chunk in _iter_chunks(df):
+        columns = [chunk[col].astype(object).where(chunk[col].notna(), None).tolist() for col in chunk.columns]
+        for values in zip(*columns):
+            if row_number >= XLSX_MAX_ROWS_PER_SHEET:
+                sheet_number, row_number = sheet_number + 1, 0
+                yield sheet_number, row_number, header
+            row_number += 1
+            yield sheet_number, row_number, values
+
+
+def write_xlsx(df, buffer, sheet_name='Dados'):
+    """
+    Writes XLSX in streaming mode: XlsxWriter 'constant_memory' when installed, otherwise
+    openpyxl write-only. Rows are flushed as they are produced instead of keeping the
+    whole worksheet in memory. Frames larger than the Excel row limit continue on extra sheets.
+    """
+    def nome_aba(sheet_number):
+        return sheet_name if sheet_number == 1 else f"{sheet_name}_{sheet_number}"
+
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+
+    if xlsxwriter is not None:
+        workbook = xlsxwriter.Workbook(buffer, {'constant_memory': True, 'default_date_format': 'dd/mm/yyyy'})
+        worksheet, current_sheet = None, None
+        for sheet_number, row_number, values in _xlsx_sheet_rows(df):
+            if sheet_number != current_sheet:
+                worksheet, current_sheet = workbook.add_worksheet(nome_aba(sheet_number)), sheet_number
+            worksheet.write_row(row_number, 0, values)
+        workbook.close()
+    else:
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        worksheet, current_sheet = None, None
+        for sheet_number, row_number, values in _xlsx_sheet_rows(df):
+            if sheet_number != current_sheet:
+                worksheet, current_sheet = workbook.create_sheet(nome_aba(sheet_number)), sheet_number
+            worksheet.append(values)
+        workbook.save(buffer)
+
+
+EXPORT_WRITERS = {'Parquet': write_parquet, 'CSV': write_csv, 'XLSX': write_xlsx}
+
+# Dataset label -> (base file name, builder from df_fatura)
+EXPORT_DATASETS = {
+    'Lançamentos categorizados': ('lancamentos_categorizados', transactions_for_export),
+    'Agregados por categoria': ('agregados_categorias', category_aggregates),
+    'Projeção de parcelamentos': ('projecao_parcelamentos', installment_projection),
+}
+
+
+def export_bytes(df, formato):
+    """
+    Serializes the frame in the given format ('Parquet', 'CSV' or 'XLSX').
+
+    Returns:
+        bytes: File content.
+    """
+    if formato not in EXPORT_WRITERS:
+        raise ValueError(f"Formato de exportação não suportado: {formato}")
+    buffer = io.BytesIO()
+    EXPORT_WRITERS[formato](df, buffer)
+    return buffer.getvalue()
+
+
+def make_export_builder(df_fatura, data_version, dataset, formato, cache):
+    """
+    Returns a zero-argument callable for st.download_button: the file is only generated
+    when the user clicks, and reused while the data version does not change.
+
+    Args:
+        df_fatura (pd.DataFrame): Categorized transactions.
+        data_version (int): Version of df_fatura (bumped on every change).
+        dataset (str): Key of EXPORT_DATASETS.
+        formato (str): Key of EXPORT_FORMATS.
+        cache (dict): Per-session cache {(data_version, dataset, formato): bytes}.
+    """
+    def build():
+        key = (data_version, dataset, formato)
+        if key not in cache:
+            # Files of older data versions are stale: drop them before building a new one
+            for old_key in [k for k in cache if k[0] != data_version]:
+                cache.pop(old_key, None)
+            cache[key] = export_bytes(EXPORT_DATASETS[dataset][1](df_fatura), formato)
+        return cache[key]
+    return build
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Safe writes of files shared by all sessions (the history parquet files, the rules workbook).
+
+Streamlit sessions are threads of one process, so a lock per path serializes their
+read-modify-write; where available, a file lock also serializes other processes. Files are
+written to a unique temporary file in the same directory and renamed over the target, so a
+reader (or a crash mid-write) never leaves half a file.
+"""
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl # File locks between processes (POSIX only; threads are always serialized)
+except ImportError:
+    fcntl = None
+
+_file_locks = {} # Path -> threading.Lock
+_file_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path):
+    """Serializes the read-modify-write of a shared file (threads of this process and, where available, other processes)."""
+    path = os.path.abspath(path)
+    with _file_locks_guard:
+        lock = _file_locks.setdefault(path, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        with open(f"{path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_atomic(path, write):
+    """
+    Calls write(tmp_path) on a temporary file unique per call, in the directory of path, and
+    renames it over path. The temporary file is removed if writing fails.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=f"{name}.", suffix='.tmp', delete=False) as tmp_file:
+        tmp_path = tmp_file.name
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
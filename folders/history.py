@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Local history of the loaded statements, used by the analyses that look across months.
+
+Each statement is identified by a hash of its file content. Its categorized transactions
+are kept in their own file under TRANSACTIONS_DIR, and its installment lines are stored in
+the installment ledger (replaced per statement). The per-month category aggregates are
+keyed by month, not by statement: a new or re-edited statement only regroups the months it
+touches, from the transactions of every statement counted once (deduplicate_transactions),
+so a re-exported or overlapping statement does not double those months.
+
+Every function takes a history_dir: the app passes the directory of the current user
+(user_history.session_history_dir), so the statements of one user are not mixed with, or
+shown to, another one.
+"""
+import hashlib
+import os
+
+import pandas as pd
+
+from file_locks import file_lock, write_atomic
+from installments import OBSERVATION_COLUMNS, installment_observations, merge_installment_observations
+
+HISTORY_DIR = os.path.join(os.path.dirname(__file__), '..', 'historico')
+MONTHLY_AGGREGATES_FILE = 'agregados_mensais.parquet'
+TRANSACTIONS_DIR = 'lancamentos' # One parquet file per statement
+INSTALLMENT_LEDGER_FILE = 'livro_parcelas.parquet' # Installment lines of all statements, with their purchase key
+
+HISTORY_TRANSACTION_COLUMNS = ['RowId', 'Data', 'Descricao', 'Valor', 'Categoria Nível 1', 'Categoria Nível 2']
+# A transaction of the history: the n-th line with the same date, description and value in its
+# statement ('Ocorrência'). The same statement saved under two ids (a re-export) or overlapping
+# statements share these keys; identical charges of one statement (two equal rides) do not.
+TRANSACTION_KEYS = ['Data', 'Descricao', 'Valor', 'Ocorrência']
+
+AGGREGATE_KEYS = ['MesAno', 'Categoria Nível 1', 'Categoria Nível 2']
+SEM_NIVEL2 = 'N/A ou Geral' # Label used for rows without Nivel 2 (same as the charts)
+
+
+def history_path(file_name, history_dir=HISTORY_DIR):
+    """Full path of a file in the history directory (created if needed)."""
+    os.makedirs(history_dir, exist_ok=True)
+    return os.path.join(history_dir, file_name)
+
+
+def statement_id_for(file_bytes):
+    """Stable id of a statement: the same file uploaded again maps to the same history entry."""
+    return hashlib.sha1(file_bytes).hexdigest()[:16]
+
+
+def write_parquet_atomic(df, path):
+    """Writes through a unique temporary file renamed over path (file_locks.write_atomic)."""
+    write_atomic(path, lambda tmp_path: df.to_parquet(tmp_path, index=False))
+
+
+def _same_rows(old, new, keys):
+    """True if two frames hold the same rows (in any order)."""
+    if len(old) != len(new):
+        return False
+    columns = list(new.columns)
+    old = old[columns].sort_values(by=keys, kind='stable').reset_index(drop=True)
+    new = new.sort_values(by=keys, kind='stable').reset_index(drop=True)
+    return old.astype(object).equals(new.astype(object))
+
+
+def month_of(datas):
+    """MesAno ('YYYY-MM', 'N/A' without a date) of each date, as statement_loader sets it."""
+    datas = pd.to_datetime(datas, errors='coerce')
+    return datas.dt.to_period('M').astype(str).where(datas.notna(), 'N/A')
+
+
+def monthly_aggregate(transactions):
+    """Total and count per MesAno / Categoria Nível 1 / Categoria Nível 2 (rows without a date are left out)."""
+    valores = pd.to_numeric(transactions['Valor'], errors='coerce')
+    keys = [month_of(transactions['Data']), transactions['Categoria Nível 1'], transactions['Categoria Nível 2'].fillna(SEM_NIVEL2)]
+    agregado = valores.groupby(keys).agg(['sum', 'count']).reset_index()
+    agregado.columns = AGGREGATE_KEYS + ['Valor', 'Quantidade']
+    return agregado[agregado['MesAno'] != 'N/A'].reset_index(drop=True)
+
+
+def load_monthly_aggregates(history_dir=HISTORY_DIR):
+    """All stored monthly aggregates (empty frame if there is no history yet)."""
+    path = history_path(MONTHLY_AGGREGATES_FILE, history_dir)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=AGGREGATE_KEYS + ['Valor', 'Quantidade'])
+    return pd.read_parquet(path)
+
+
+def update_monthly_aggregates(statement_id, df_fatura, history_dir=HISTORY_DIR):
+    """
+    Stores the transactions of one statement (save_statement_transactions) and regroups the
+    months they touch, before and after the change, from the deduplicated transactions of
+    every statement; the other months are kept as they are. Everything runs under file_lock
+    (no lost updates between sessions), and nothing is written when the transactions of this
+    statement did not change.
+
+    Args:
+        statement_id (str): Id of the statement (statement_id_for).
+        df_fatura (pd.DataFrame): Current categorized rows of that statement.
+
+    Returns:
+        pd.DataFrame: Updated aggregates of all months.
+    """
+    novas = df_fatura[HISTORY_TRANSACTION_COLUMNS].reset_index(drop=True)
+    path = history_path(MONTHLY_AGGREGATES_FILE, history_dir)
+    with file_lock(path):
+        aggregates = load_monthly_aggregates(history_dir)
+        # Aggregates saved per statement by older versions (or missing) are rebuilt from all transactions
+        rebuild = not os.path.exists(path) or list(aggregates.columns) != AGGREGATE_KEYS + ['Valor', 'Quantidade']
+        statement_path = _statement_path(statement_id, history_dir)
+        antigas = pd.read_parquet(statement_path) if os.path.exists(statement_path) else None
+        if antigas is not None and not rebuild and _same_rows(antigas, novas, ['RowId']):
+            return aggregates
+        save_statement_transactions(statement_id, df_fatura, history_dir)
+        if rebuild:
+            aggregates = monthly_aggregate(load_history_transactions(history_dir))
+        else:
+            meses = set(month_of(novas['Data'])) | (set(month_of(antigas['Data'])) if antigas is not None else set())
+            novos = monthly_aggregate(load_history_transactions(history_dir, months=meses))
+            outros = aggregates[~aggregates['MesAno'].isin(meses)]
+            aggregates = novos if outros.empty else pd.concat([outros, novos], ignore_index=True)
+        write_parquet_atomic(aggregates, path)
+    return aggregates
+
+
+def load_installment_observations(history_dir=HISTORY_DIR):
+    """All stored installment lines (empty frame if there is no history yet)."""
+    path = history_path(INSTALLMENT_LEDGER_FILE, history_dir)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=OBSERVATION_COLUMNS)
+    return pd.read_parquet(path)
+
+
+def update_installment_ledger(statement_id, df_fatura, history_dir=HISTORY_DIR):
+    """
+    Replaces the installment lines of one statement in the ledger and saves it (under
+    file_lock, only when they changed); the other statements are not parsed again.
+
+    Returns:
+        pd.DataFrame: Updated installment lines of all statements (summarize_installment_ledger).
+    """
+    novas = installment_observations(df_fatura, statement_id).reset_index(drop=True)
+    path = history_path(INSTALLMENT_LEDGER_FILE, history_dir)
+    with file_lock(path):
+        observations = load_installment_observations(history_dir)
+        atuais = observations['statement_id'] == statement_id
+        if os.path.exists(path) and _same_rows(observations[atuais], novas, ['Parcela', 'Data', 'Descricao', 'Ocorrência']):
+            return observations
+        observations = merge_installment_observations(observations, statement_id, novas)
+        write_parquet_atomic(observations, path)
+    return observations
+
+
+def ledger_signature(history_dir=HISTORY_DIR):
+    """(mtime, size) of the installment ledger file (cache key; None when there is no ledger yet)."""
+    path = history_path(INSTALLMENT_LEDGER_FILE, history_dir)
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _statement_path(statement_id, history_dir):
+    os.makedirs(history_path(TRANSACTIONS_DIR, history_dir), exist_ok=True)
+    return history_path(os.path.join(TRANSACTIONS_DIR, f"{statement_id}.parquet"), history_dir)
+
+
+def save_statement_transactions(statement_id, df_fatura, history_dir=HISTORY_DIR):
+    """Stores (or replaces) the categorized transactions of one statement (the app does it through update_monthly_aggregates)."""
+    write_parquet_atomic(df_fatura[HISTORY_TRANSACTION_COLUMNS], _statement_path(statement_id, history_dir))
+
+
+def history_signature(history_dir=HISTORY_DIR):
+    """(file, mtime, size) of every stored statement: changes whenever the history changes (cache key)."""
+    transactions_dir = history_path(TRANSACTIONS_DIR, history_dir)
+    if not os.path.isdir(transactions_dir):
+        return ()
+    entries = []
+    for entry in sorted(os.scandir(transactions_dir), key=lambda e: e.name):
+        if entry.name.endswith('.parquet'):
+            stat = entry.stat()
+            entries.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(entries)
+
+
+def deduplicate_transactions(history):
+    """
+    Keeps one row per TRANSACTION_KEYS: a transaction stored by more than one statement counts
+    once (the copy of the statement saved last, with its latest categories), while identical
+    charges on the same day of one statement (two equal rides or coffees) are genuine and kept.
+
+    Args:
+        history (pd.DataFrame): Transactions with a 'statement_id' column, in saving order.
+    """
+    ocorrencia = history.groupby(['statement_id', 'Data', 'Descricao', 'Valor'], sort=False, dropna=False).cumcount()
+    history = history.assign(**{'Ocorrência': ocorrencia})
+    history = history.drop_duplicates(subset=TRANSACTION_KEYS, keep='last')
+    return history.drop(columns='Ocorrência').reset_index(drop=True)
+
+
+def load_history_transactions(history_dir=HISTORY_DIR, months=None):
+    """
+    All stored transactions, with a 'statement_id' column, each counted once (deduplicate_transactions).
+
+    Args:
+        months (set): Only the transactions of these MesAno values are read (None reads all).
+    """
+    transactions_dir = history_path(TRANSACTIONS_DIR, history_dir)
+    filters = None
+    meses = sorted(mes for mes in months if mes != 'N/A') if months is not None else None
+    if meses is not None:
+        if not meses:
+            return pd.DataFrame(columns=HISTORY_TRANSACTION_COLUMNS + ['statement_id'])
+        # Only the row groups of the months' range are read; the key includes Data, so deduplicating them alone is exact
+        inicio, fim = pd.Period(meses[0], freq='M'), pd.Period(meses[-1], freq='M') + 1
+        filters = [('Data', '>=', inicio.to_timestamp()), ('Data', '<', fim.to_timestamp())]
+    frames = []
+    for name, _, _ in sorted(history_signature(history_dir), key=lambda entry: entry[1]): # Saving order
+        df = pd.read_parquet(os.path.join(transactions_dir, name), filters=filters)
+        if meses is not None:
+            df = df[month_of(df['Data']).isin(meses)]
+        df['statement_id'] = name[:-len('.parquet')]
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=HISTORY_TRANSACTION_COLUMNS + ['statement_id'])
+    return deduplicate_transactions(pd.concat(frames, ignore_index=True))
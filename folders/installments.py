@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Installment (parcelamento) parsing and projection shared by the pages and the exports,
+and the installment ledger that links the parcels of the same purchase across statements.
+
+The date of an installment line is taken as the month it was billed in: parcel k of a
+purchase made in month M is billed in month M + k - 1.
+"""
+import numpy as np
+import pandas as pd
+
+from recurring import normalize_merchants
+
+PARCELAMENTO_PATTERN = r'\b(\d{1,2})/(\d{1,2})\b'
+PARCELAMENTO_CATEGORY = 'Parcelamento'
+
+# A purchase in the ledger: same merchant, number of parcels, parcel value and purchase month.
+# 'Ocorrência' tells apart identical purchases (e.g. two equal items bought in the same month).
+# Parcel values close to each other are the same purchase: issuers put the rounding leftover
+# on the first or the last parcel (100.01 / 3 = 33.35 + 33.33 + 33.33), which is less than one
+# cent per parcel, so values within Total Parcelas - 1 cents (at least CENTS_TOLERANCE) match.
+LEDGER_KEYS = ['Estabelecimento', 'Total Parcelas', 'Centavos', 'Mês da Compra', 'Ocorrência']
+CENTS_TOLERANCE = 1
+OBSERVATION_COLUMNS = ['statement_id'] + LEDGER_KEYS + ['Parcela', 'Data', 'Descricao']
+
+
+def add_installment_columns(df_parcelamentos):
+    """
+    Parses the 'XX/YY' installment pattern of the descriptions (e.g. 'COMPRA PARCELADA 05/10')
+    of a frame of parcelamentos.
+
+    Adds 'Parcela Atual', 'Total Parcelas', 'Parcelas Restantes', 'Valor por Parcela' and
+    'Valor Restante', dropping rows without a valid 'XX/YY' pattern.
+    """
+    parsed = df_parcelamentos['Descricao'].astype(str).str.extract(PARCELAMENTO_PATTERN).astype(float)
+    df_parcelamentos = df_parcelamentos.assign(**{'Parcela Atual': parsed[0], 'Total Parcelas': parsed[1]})
+
+    # Basic validation: 1 <= current <= total
+    valid = (df_parcelamentos['Parcela Atual'] >= 1) & (df_parcelamentos['Parcela Atual'] <= df_parcelamentos['Total Parcelas'])
+    df_parcelamentos = df_parcelamentos[valid].copy()
+
+    # Ensure installment columns are integers
+    df_parcelamentos['Parcela Atual'] = df_parcelamentos['Parcela Atual'].astype(int)
+    df_parcelamentos['Total Parcelas'] = df_parcelamentos['Total Parcelas'].astype(int)
+
+    # Calculate remaining installments and remaining value for each transaction
+    df_parcelamentos['Parcelas Restantes'] = df_parcelamentos['Total Parcelas'] - df_parcelamentos['Parcela Atual']
+    # The statement line is one installment (equal installments assumed for the remaining ones)
+    df_parcelamentos['Valor por Parcela'] = df_parcelamentos['Valor']
+    df_parcelamentos['Valor Restante'] = df_parcelamentos['Parcelas Restantes'] * df_parcelamentos['Valor por Parcela']
+    return df_parcelamentos
+
+
+def project_installments(df_parcelamentos, start_month=None):
+    """
+    Projects the remaining installments per month.
+
+    The i-th remaining installment (i from 0) of a transaction falls in the month of the
+    transaction + 1 + i (the transaction itself is the current installment).
+
+    Args:
+        df_parcelamentos (pd.DataFrame): Output of add_installment_columns (rows without a date are skipped).
+        start_month (date): Only months on or after this one are kept (None keeps all).
+
+    Returns:
+        pd.DataFrame: 'Valor Projetado' indexed by month start (DatetimeIndex), sorted.
+    """
+    # Rows without a valid date have no month to project from (NaT would become a garbage month)
+    df_parcelamentos = df_parcelamentos[df_parcelamentos['Data'].notna()]
+    restantes = df_parcelamentos['Parcelas Restantes'].to_numpy(dtype=np.int64)
+    if restantes.sum() == 0:
+        return pd.DataFrame(columns=['Valor Projetado'], index=pd.DatetimeIndex([]))
+
+    # One row per future installment: repeat each transaction by its remaining count
+    base_month = df_parcelamentos['Data'].to_numpy(dtype='datetime64[ns]').astype('datetime64[M]').astype(np.int64)
+    first_month = base_month + 1
+    offsets = np.arange(restantes.sum()) - np.repeat(np.cumsum(restantes) - restantes, restantes)
+    months = np.repeat(first_month, restantes) + offsets
+    values = np.repeat(df_parcelamentos['Valor por Parcela'].to_numpy(dtype=float), restantes)
+
+    projection = pd.Series(values).groupby(months).sum()
+    projection.index = projection.index.to_numpy().astype('datetime64[M]').astype('datetime64[ns]')
+    if start_month is not None:
+        projection = projection[projection.index >= pd.Timestamp(start_month)]
+    return projection.sort_index().to_frame('Valor Projetado')
+
+
+# --- Livro de parcelamentos (entre faturas) ---
+def installment_observations(df_fatura, statement_id):
+    """
+    The installment lines of one statement with their ledger key: normalized merchant,
+    number of parcels, parcel value in cents and implied purchase month (billing month
+    minus the parcels already billed).
+
+    Returns:
+        pd.DataFrame: OBSERVATION_COLUMNS, one row per installment line.
+    """
+    df = df_fatura[df_fatura['Categoria Nível 1'] == PARCELAMENTO_CATEGORY][['Data', 'Descricao', 'Valor']]
+    df = df.dropna(subset=['Data', 'Valor'])
+    if df.empty:
+        return pd.DataFrame(columns=OBSERVATION_COLUMNS)
+    df = add_installment_columns(df)
+    billing_month = df['Data'].to_numpy(dtype='datetime64[ns]').astype('datetime64[M]')
+    purchase_month = billing_month - (df['Parcela Atual'].to_numpy(dtype=np.int64) - 1)
+    observations = pd.DataFrame({
+        'statement_id': statement_id,
+        'Estabelecimento': normalize_merchants(df['Descricao']).to_numpy(),
+        'Total Parcelas': df['Total Parcelas'].to_numpy(dtype=np.int64),
+        'Centavos': np.round(df['Valor'].to_numpy(dtype=float) * 100).astype(np.int64),
+        'Mês da Compra': purchase_month.astype('datetime64[ns]'),
+        'Parcela': df['Parcela Atual'].to_numpy(dtype=np.int64),
+        'Data': df['Data'].to_numpy(dtype='datetime64[ns]'),
+        'Descricao': df['Descricao'].astype(str).to_numpy(),
+    })
+    # The n-th line with the same key and parcel in this statement belongs to the n-th identical purchase
+    observations['Ocorrência'] = observations.groupby(LEDGER_KEYS[:-1] + ['Parcela'], sort=False).cumcount()
+    return observations[OBSERVATION_COLUMNS]
+
+
+def merge_installment_observations(observations, statement_id, new_observations):
+    """Replaces the observations of one statement (the other statements' rows are kept as they are)."""
+    others = observations[observations['statement_id'] != statement_id]
+    if others.empty:
+        return new_observations.reset_index(drop=True)
+    if new_observations.empty:
+        return others.reset_index(drop=True)
+    return pd.concat([others, new_observations], ignore_index=True)
+
+
+def _match_parcel_values(observations):
+    """
+    Parcel values ('Centavos') that differ by less than the number of parcels, in cents (at least
+    CENTS_TOLERANCE; chained), within the same merchant, number of parcels, purchase month and
+    occurrence are set to their most frequent value, so the rounded first / last parcel joins
+    the purchase of the other parcels.
+    """
+    purchase_keys = [key for key in LEDGER_KEYS if key != 'Centavos']
+    observations = observations.sort_values(by=purchase_keys + ['Centavos'], kind='stable')
+    new_purchase = (observations[purchase_keys] != observations[purchase_keys].shift()).any(axis=1)
+    tolerance = np.maximum(observations['Total Parcelas'].to_numpy(dtype=np.int64) - 1, CENTS_TOLERANCE)
+    jump = observations['Centavos'].diff().abs() > tolerance
+    cluster = (new_purchase | jump).cumsum()
+    centavos = observations.groupby(cluster)['Centavos'].transform(lambda values: values.value_counts().idxmax())
+    return observations.assign(Centavos=centavos.astype(np.int64))
+
+
+def summarize_installment_ledger(observations):
+    """
+    One row per purchase. A parcel seen in more than one statement (overlapping exports) is
+    counted once; parcels before the last one seen are taken as paid, even when the statement
+    that billed them is not in the history ('Parcelas Não Vistas'). Parcels whose values differ
+    by a rounding leftover belong to the same purchase ('Valor da Parcela' is the usual value);
+    'Valor Total' adds the billed values of the parcels seen (100.01 = 33.35 + 33.33 + 33.33
+    stays 100.01) and the usual value for the parcels not seen.
+
+    Returns:
+        pd.DataFrame: Purchase key, parcels seen, last parcel, remaining parcels and value
+        ('Saldo Devedor'), end month and 'Status' ('Em aberto' / 'Quitado').
+    """
+    if observations.empty:
+        return pd.DataFrame()
+    observations = _match_parcel_values(observations.assign(Lancado=observations['Centavos'])) # Billed cents kept for the totals
+    observations = observations.sort_values(by='Data', kind='stable').drop_duplicates(subset=LEDGER_KEYS + ['Parcela'], keep='last')
+    ledger = observations.groupby(LEDGER_KEYS, sort=False).agg(
+        Descricao=('Descricao', 'last'),
+        Vistas=('Parcela', 'size'),
+        CentavosVistos=('Lancado', 'sum'),
+        Primeira=('Parcela', 'min'),
+        Ultima=('Parcela', 'max'),
+        Faturas=('statement_id', 'nunique'),
+        UltimoLancamento=('Data', 'max'),
+    ).reset_index()
+
+    total = ledger['Total Parcelas'].to_numpy(dtype=np.int64)
+    ultima = ledger['Ultima'].to_numpy(dtype=np.int64)
+    purchase_month = ledger['Mês da Compra'].to_numpy(dtype='datetime64[ns]').astype('datetime64[M]')
+    ledger['Valor da Parcela'] = ledger['Centavos'] / 100
+    nao_vistas_total = total - ledger['Vistas'].to_numpy(dtype=np.int64) # Parcels before and after the ones seen
+    ledger['Valor Total'] = (ledger['CentavosVistos'].to_numpy(dtype=np.int64) + nao_vistas_total * ledger['Centavos'].to_numpy(dtype=np.int64)) / 100
+    ledger['Parcelas Restantes'] = total - ultima
+    ledger['Saldo Devedor'] = ledger['Parcelas Restantes'] * ledger['Valor da Parcela']
+    ledger['Parcelas Não Vistas'] = ultima - ledger['Vistas']
+    ledger['Mês da Última Parcela Vista'] = (purchase_month + (ultima - 1)).astype('datetime64[ns]')
+    ledger['Mês Final'] = (purchase_month + (total - 1)).astype('datetime64[ns]')
+    ledger['Status'] = np.where(ledger['Parcelas Restantes'] > 0, 'Em aberto', 'Quitado')
+
+    result = ledger.rename(columns={
+        'Descricao': 'Última Descrição',
+        'Ultima': 'Última Parcela Vista',
+        'Faturas': 'Faturas',
+        'UltimoLancamento': 'Último Lançamento',
+    })
+    columns = ['Estabelecimento', 'Última Descrição', 'Status', 'Mês da Compra', 'Total Parcelas', 'Valor da Parcela',
+               'Valor Total', 'Última Parcela Vista', 'Parcelas Não Vistas', 'Parcelas Restantes', 'Saldo Devedor',
+               'Mês da Última Parcela Vista', 'Mês Final', 'Faturas', 'Último Lançamento']
+    return result[columns].sort_values(by=['Status', 'Mês Final', 'Estabelecimento']).reset_index(drop=True)
+
+
+def project_ledger(ledger, start_month=None):
+    """project_installments over the open purchases of the ledger (from their last parcel seen)."""
+    em_aberto = ledger[ledger['Parcelas Restantes'] > 0] if not ledger.empty else ledger
+    if em_aberto.empty:
+        return pd.DataFrame(columns=['Valor Projetado'], index=pd.DatetimeIndex([]))
+    df_parcelamentos = pd.DataFrame({
+        'Data': em_aberto['Mês da Última Parcela Vista'],
+        'Parcela Atual': em_aberto['Última Parcela Vista'],
+        'Parcelas Restantes': em_aberto['Parcelas Restantes'],
+        'Valor por Parcela': em_aberto['Valor da Parcela'],
+    })
+    return project_installments(df_parcelamentos, start_month)
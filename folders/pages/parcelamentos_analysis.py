@@ -1,76 +1,37 @@
 # -*- coding: utf-8 -*- # Define encoding
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 from datetime import datetime, date, timedelta
-import numpy as np
-import re
 import calendar # Import calendar for month names
+# installments.py (pandas/numpy) and plotly are imported only when there is data to show
+from session_memory import restore_session_frames
 
 # --- Configuração da Página Streamlit ---
 st.set_page_config(page_title="Análise de Parcelamentos", page_icon="💳", layout="wide")
 
-# --- Funções Auxiliares (Copied from app.py for self-containment) ---
-# Note: In a real multi-page app, you might put shared functions in a separate utility file
-# and import them. For this example, copying for simplicity.
-def limpar_valor(valor):
-    """Cleans currency strings and converts to float."""
-    if isinstance(valor, (int, float)):
-        return float(valor)
-    if isinstance(valor) is str:
-        # Remove currency symbols, spaces, and replace comma decimal separator
-        valor_limpo = re.sub(r'[R$\s]', '', valor).replace(',', '.')
-        try:
-            return float(valor_limpo)
-        except ValueError:
-            # Handle cases where comma might be used as thousands separator
-            valor_limpo_alt = valor.replace('.', '').replace(',', '.')
-            try:
-                return float(valor_limpo_alt)
-            except ValueError:
-                return np.nan # Return NaN if conversion fails
-    return np.nan # Return NaN for other types
+# Frames of an idle session may have been spilled to disk to respect the memory budget
+restore_session_frames()
 
 # We don't need load_rules_from_excel or suggest_categories_v2 here
 # as categorization is done on the main page.
+# Installment parsing/projection lives in installments.py (shared with the exports on the main page)
 
-# --- New Function to Parse Parcelamento Description ---
-def parse_parcelamento_description(description):
-    """
-    Parses a parcelamento description (e.g., 'COMPRA PARCELADA 05/10')
-    to extract current and total installments.
-
-    Args:
-        description (str): The transaction description.
-
-    Returns:
-        tuple: (current_installment, total_installments) or (None, None) if not found.
-    """
-    if not isinstance(description, str):
-        return None, None
-
-    # Look for the XX/YY pattern
-    match = re.search(r'\b(\d{1,2})/(\d{1,2})\b', description)
-    if match:
-        try:
-            current = int(match.group(1))
-            total = int(match.group(2))
-            # Basic validation: current should not be greater than total
-            if 1 <= current <= total:
-                return current, total
-        except ValueError:
-            pass # Ignore if conversion to int fails
-
-    return None, None # Return None if pattern not found or invalid
+@st.cache_data
+def carregar_livro_parcelamentos(history_dir, signature):
+    """Installment ledger of the user's history (cached while the ledger file does not change)."""
+    from history import load_installment_observations
+    from installments import summarize_installment_ledger
+    return summarize_installment_ledger(load_installment_observations(history_dir))
 
 # --- Page Content ---
 st.title("💳 Análise Detalhada de Parcelamentos")
 
 # Access the processed data from session state
 if 'df_fatura' in st.session_state and st.session_state.df_fatura is not None:
-    df_fatura = st.session_state.df_fatura.copy()
+    from installments import add_installment_columns, project_installments, project_ledger
+    from history import ledger_signature
+    from user_history import session_history_dir
+
+    df_fatura = st.session_state.df_fatura # Read-only here (the filter below makes the copy)
 
     # Filter for Parcelamento transactions
     df_parcelamentos = df_fatura[df_fatura['Categoria Nível 1'] == 'Parcelamento'].copy()
@@ -79,27 +40,12 @@ if 'df_fatura' in st.session_state and st.session_state.df_fatura is not None:
         st.info("Não há lançamentos categorizados como 'Parcelamento' para analisar.")
     else:
         # --- Extract Parcelamento Details ---
-        df_parcelamentos[['Parcela Atual', 'Total Parcelas']] = df_parcelamentos['Descricao'].apply(
-            lambda x: pd.Series(parse_parcelamento_description(x))
-        )
-
-        # Filter out rows where parcelamento info couldn't be parsed
-        df_parcelamentos = df_parcelamentos.dropna(subset=['Parcela Atual', 'Total Parcelas'])
+        # Parses 'XX/YY' and drops rows where parcelamento info couldn't be parsed
+        df_parcelamentos = add_installment_columns(df_parcelamentos)
 
         if df_parcelamentos.empty:
              st.warning("Nenhum lançamento de 'Parcelamento' encontrado com o formato 'XX/YY' na descrição.")
         else:
-            # Ensure installment columns are integers
-            df_parcelamentos['Parcela Atual'] = df_parcelamentos['Parcela Atual'].astype(int)
-            df_parcelamentos['Total Parcelas'] = df_parcelamentos['Total Parcelas'].astype(int)
-
-            # Calculate remaining installments and remaining value for each transaction
-            df_parcelamentos['Parcelas Restantes'] = df_parcelamentos['Total Parcelas'] - df_parcelamentos['Parcela Atual']
-            # Calculate the value per installment (assuming equal installments)
-            df_parcelamentos['Valor por Parcela'] = df_parcelamentos['Valor'] / df_parcelamentos['Parcela Atual']
-            df_parcelamentos['Valor Restante'] = df_parcelamentos['Parcelas Restantes'] * df_parcelamentos['Valor por Parcela']
-
-
             # --- Projection Logic ---
             st.subheader("Projeção de Parcelamentos Futuros")
 
@@ -127,60 +73,16 @@ if 'df_fatura' in st.session_state and st.session_state.df_fatura is not None:
             selected_start_month = datetime.strptime(selected_start_month_str, "%B/%Y").date().replace(day=1)
 
 
-            # Create a DataFrame for the monthly projection
-            monthly_projection = {}
-
-            # Iterate through each parcelamento transaction
-            for index, row in df_parcelamentos.iterrows():
-                current_installment = row['Parcela Atual']
-                total_installments = row['Total Parcelas']
-                value_per_installment = row['Valor por Parcela']
-                transaction_date = row['Data'].date() # Use date part for month calculation
-
-                # Project the future installments for this transaction
-                for i in range(row['Parcelas Restantes']):
-                    # Calculate the month of the future installment
-                    # Start from the month *after* the transaction month + current installment count
-                    # Example: Transaction in Jan (month 1), 1/10. Next payment is Feb (month 2).
-                    # If 5/10 in Jan, next payment is Feb (month 2).
-                    # The month of the next payment is the month of the transaction + the current installment number.
-                    # However, if the transaction date is late in the month, the *next* payment might be in the month
-                    # corresponding to the current installment + 1. Let's simplify and assume the next payment
-                    # occurs in the month after the transaction month + current installment count.
-
-                    # Calculate the month index relative to the transaction month
-                    # If transaction is in Jan (month 1) and it's 1/10, the next payment is in month 1 + 1 = month 2.
-                    # If transaction is in Jan and it's 5/10, the next payment is in month 1 + 5 = month 6.
-                    # The installment number XX corresponds to the XX-th payment, which happens in the month
-                    # corresponding to the transaction month + (XX-1).
-                    # So, the (i+1)-th remaining installment (where i starts from 0) will be in the month
-                    # corresponding to the transaction month + current_installment + i.
-
-                    # Calculate the month of the *current* installment
-                    current_installment_month = transaction_date.replace(day=1) + pd.DateOffset(months=current_installment -1)
-
-                    # Calculate the month of the *future* installment (i-th remaining installment)
-                    future_installment_month = current_installment_month + pd.DateOffset(months=i)
-
-
-                    # Only consider installments that are in or after the selected start month
-                    if future_installment_month.date() >= selected_start_month:
-                        month_key = future_installment_month.strftime("%Y-%m") # Use YYYY-MM for sorting
-                        if month_key not in monthly_projection:
-                            monthly_projection[month_key] = 0
-                        monthly_projection[month_key] += value_per_installment
-
-
-            # Convert the projection dictionary to a DataFrame
-            if monthly_projection:
-                df_monthly_projection = pd.DataFrame.from_dict(monthly_projection, orient='index', columns=['Valor Projetado'])
-                df_monthly_projection.index = pd.to_datetime(df_monthly_projection.index)
-                df_monthly_projection = df_monthly_projection.sort_index()
+            # Monthly projection of the remaining installments from the selected month on
+            df_monthly_projection = project_installments(df_parcelamentos, selected_start_month)
 
+            if not df_monthly_projection.empty:
                 # Add a column for Month/Year label for plotting
                 df_monthly_projection['Mês/Ano'] = df_monthly_projection.index.strftime("%B/%Y")
 
                 # --- Monthly Projection Chart ---
+                import plotly.express as px
+
                 st.markdown("---")
                 st.subheader("Projeção Mensal de Parcelamentos")
 
@@ -225,6 +127,53 @@ if 'df_fatura' in st.session_state and st.session_state.df_fatura is not None:
                 hide_index=True
             )
 
+    # --- Livro de Parcelamentos (todas as faturas do histórico) ---
+    st.markdown("---")
+    st.subheader("Livro de Parcelamentos (todas as faturas)")
+    st.markdown("As parcelas de uma mesma compra (mesmo estabelecimento, número de parcelas, valor da parcela e mês da compra) são ligadas entre as faturas carregadas.")
+    history_dir = session_history_dir() # Only this user's statements (None: nothing saved yet)
+    df_livro = carregar_livro_parcelamentos(history_dir, ledger_signature(history_dir)) if history_dir else None
+
+    if df_livro is None or df_livro.empty:
+        st.info("Nenhum parcelamento no histórico de faturas.")
+    else:
+        em_aberto = df_livro[df_livro['Status'] == 'Em aberto']
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric(label="💳 Saldo Devedor", value=f"R$ {em_aberto['Saldo Devedor'].sum():,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.'))
+        with col2:
+            st.metric(label="🛍️ Compras em Aberto", value=len(em_aberto))
+        with col3:
+            st.metric(label="🏁 Última Parcela", value=em_aberto['Mês Final'].max().strftime('%m/%Y') if not em_aberto.empty else "-")
+
+        df_projecao_livro = project_ledger(df_livro)
+        if not df_projecao_livro.empty:
+            import plotly.express as px
+
+            df_projecao_livro['Mês/Ano'] = df_projecao_livro.index.strftime("%m/%Y")
+            fig_livro = px.bar(
+                df_projecao_livro, x='Mês/Ano', y='Valor Projetado',
+                title="Parcelas a Vencer por Mês (todas as faturas)",
+                labels={'Valor Projetado': 'Valor (R$)', 'Mês/Ano': 'Mês/Ano'}, text_auto='.2f'
+            )
+            st.plotly_chart(fig_livro, use_container_width=True)
+
+        st.dataframe(
+            df_livro,
+            column_config={
+                "Última Descrição": st.column_config.TextColumn("Descrição"),
+                "Mês da Compra": st.column_config.DateColumn("Mês da Compra", format="MM/YYYY"),
+                "Valor da Parcela": st.column_config.NumberColumn("Valor/Parcela (R$)", format="R$ %.2f"),
+                "Valor Total": st.column_config.NumberColumn("Valor Total (R$)", format="R$ %.2f"),
+                "Saldo Devedor": st.column_config.NumberColumn("Saldo Devedor (R$)", format="R$ %.2f"),
+                "Mês da Última Parcela Vista": st.column_config.DateColumn("Última Parcela em", format="MM/YYYY"),
+                "Mês Final": st.column_config.DateColumn("Mês Final", format="MM/YYYY"),
+                "Último Lançamento": st.column_config.DateColumn("Último Lançamento", format="DD/MM/YYYY"),
+            },
+            use_container_width=True,
+            hide_index=True
+        )
+
 else:
     st.info("Por favor, carregue um arquivo na página 'Visão Geral' para analisar os parcelamentos.")
 
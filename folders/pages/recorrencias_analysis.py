@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*- # Define encoding
+import streamlit as st
+from datetime import datetime
+# pandas, plotly and the history / detector modules are imported only when there is a history to show
+from user_history import session_history_dir
+
+# --- Configuração da Página Streamlit ---
+st.set_page_config(page_title="Cobranças Recorrentes", page_icon="🔁", layout="wide")
+
+@st.cache_data
+def carregar_recorrencias(history_dir, signature, reference_date):
+    """Loads the statement history and runs the detector (cached while the history files do not change)."""
+    from history import load_history_transactions
+    from recurring import detect_recurring_charges
+    historico = load_history_transactions(history_dir)
+    return historico, detect_recurring_charges(historico, reference_date)
+
+# --- Page Content ---
+st.title("🔁 Assinaturas e Cobranças Recorrentes")
+st.markdown("Cobranças do mesmo estabelecimento em intervalos regulares (mensais ou anuais) no histórico de faturas carregadas, independentemente das regras de categorização.")
+
+history_dir = session_history_dir() # Only this user's statements (None: nothing saved yet)
+signature = ()
+if history_dir:
+    from history import history_signature
+    signature = history_signature(history_dir)
+if not signature:
+    st.info("Por favor, carregue ao menos uma fatura na página 'Visão Geral' para montar o histórico.")
+else:
+    import pandas as pd
+    import plotly.express as px
+    from recurring import recurring_charge_rows
+
+    usar_hoje = st.toggle("Considerar a data de hoje para identificar cobranças encerradas", value=False, help="Desligado: usa a data do lançamento mais recente do histórico.")
+    reference_date = pd.Timestamp(datetime.now().date()) if usar_hoje else None
+    df_historico, df_recorrentes = carregar_recorrencias(history_dir, signature, reference_date)
+
+    st.caption(f"{len(signature)} fatura(s) no histórico, {len(df_historico)} lançamentos analisados.")
+
+    if df_recorrentes.empty:
+        st.info("Nenhuma cobrança recorrente encontrada no histórico.")
+    else:
+        # --- Resumo ---
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            ativas = df_recorrentes[df_recorrentes['Status'] != 'Encerrada']
+            custo_mensal = ativas['Custo Mensal Equivalente'].sum()
+            st.metric(label="💳 Custo Mensal Recorrente", value=f"R$ {custo_mensal:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.'))
+        with col2:
+            st.metric(label="📈 Aumentos de Preço", value=int((df_recorrentes['Status'] == 'Aumento de preço').sum()))
+        with col3:
+            st.metric(label="⏹️ Encerradas", value=int((df_recorrentes['Status'] == 'Encerrada').sum()))
+
+        status_filtro = st.multiselect("Status:", options=sorted(df_recorrentes['Status'].unique()), default=sorted(df_recorrentes['Status'].unique()), key='status_recorrencia')
+        df_recorrentes_sel = df_recorrentes[df_recorrentes['Status'].isin(status_filtro)]
+
+        # --- Linha do Tempo das Cobranças ---
+        st.markdown("---")
+        st.subheader("Linha do Tempo das Cobranças")
+        df_cobrancas = recurring_charge_rows(df_historico, df_recorrentes_sel)
+        if not df_cobrancas.empty:
+            df_cobrancas = df_cobrancas.merge(df_recorrentes_sel[['Estabelecimento', 'Status']], on='Estabelecimento')
+            fig_timeline = px.scatter(
+                df_cobrancas, x='Data', y='Estabelecimento', size='Valor', color='Status',
+                hover_data={'Descricao': True, 'Valor': ':.2f'},
+                title="Cobranças por Estabelecimento", size_max=18
+            )
+            fig_timeline.update_layout(title_x=0.5, yaxis_title=None, height=max(300, 40 * df_cobrancas['Estabelecimento'].nunique()))
+            st.plotly_chart(fig_timeline, use_container_width=True)
+
+        # --- Tabela ---
+        st.markdown("---")
+        st.subheader("Cobranças Recorrentes Detectadas")
+        st.dataframe(
+            df_recorrentes_sel,
+            column_config={
+                "Intervalo (dias)": st.column_config.NumberColumn("Intervalo (dias)", format="%.0f"),
+                "Irregularidade (CV)": st.column_config.NumberColumn("Irregularidade (CV)", format="%.2f"),
+                "Valor Médio": st.column_config.NumberColumn("Valor Médio (R$)", format="R$ %.2f"),
+                "Variação do Valor (CV)": st.column_config.NumberColumn("Variação do Valor (CV)", format="%.2f"),
+                "Último Valor": st.column_config.NumberColumn("Último Valor (R$)", format="R$ %.2f"),
+                "Valor Anterior (mediana)": st.column_config.NumberColumn("Valor Anterior (R$)", format="R$ %.2f"),
+                "Aumento (%)": st.column_config.NumberColumn("Aumento (%)", format="%.1f%%"),
+                "Custo Mensal Equivalente": st.column_config.NumberColumn("Custo Mensal (R$)", format="R$ %.2f"),
+                "Primeira Cobrança": st.column_config.DateColumn("Primeira", format="DD/MM/YYYY"),
+                "Última Cobrança": st.column_config.DateColumn("Última", format="DD/MM/YYYY"),
+                "Próxima Prevista": st.column_config.DateColumn("Próxima Prevista", format="DD/MM/YYYY"),
+            },
+            use_container_width=True,
+            hide_index=True
+        )
+
+# --- Rodapé ---
+st.markdown("---")
+st.caption(f"Análise de Fatura | Página de Cobranças Recorrentes | {datetime.now().year}")
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*- # Define encoding
+import streamlit as st
+from datetime import datetime
+import os
+# pandas and the profiler are imported only when there is data to profile
+from session_memory import restore_session_frames
+from user_history import session_history_dir
+
+# --- Configuração da Página Streamlit ---
+st.set_page_config(page_title="Perfil das Regras", page_icon="🧪", layout="wide")
+
+# Frames of an idle session may have been spilled to disk to respect the memory budget
+restore_session_frames()
+
+RULES_FILE_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'regras_categorizacao.xlsx')
+
+@st.cache_resource
+def ler_regras_do_arquivo(rules_full_path):
+    """Rules of the Excel file, for sessions that did not load a statement on the main page."""
+    from categorization import read_rules_file
+    return read_rules_file(rules_full_path) if os.path.exists(rules_full_path) else {}
+
+@st.cache_data(max_entries=4, show_spinner="Analisando as regras...")
+def perfilar_regras(data_key, rules_key, _df, _rules_dict):
+    """
+    Runs the rule profiler (cached per data and ruleset: the timings are those of the first run).
+    The cache is shared by all sessions, so data_key is a hash of the profiled content.
+    """
+    from rule_profiler import profile_rules, top_uncategorized
+    profile, winner = profile_rules(_df, _rules_dict)
+    return profile, top_uncategorized(_df, winner), int(winner.isna().sum())
+
+# --- Page Content ---
+st.title("🧪 Perfil das Regras de Categorização")
+st.markdown("Quais regras de `regras_categorizacao.xlsx` categorizam lançamentos, quais nunca casam, quais são sombreadas por uma regra anterior (palavras-chave mais longas vêm primeiro) e quais só casam pela busca por substring (a regex de palavra inteira falha), com o tempo gasto em cada uma.")
+
+fatura_carregada = 'df_fatura' in st.session_state and st.session_state.df_fatura is not None
+fonte = st.radio("Lançamentos analisados:", ['Fatura atual', 'Histórico de faturas'], index=0 if fatura_carregada else 1, horizontal=True, key='fonte_perfil_regras')
+
+df_fonte = None
+if fonte == 'Fatura atual':
+    if fatura_carregada:
+        df_fonte = st.session_state.df_fatura
+    else:
+        st.info("Por favor, carregue um arquivo na página 'Visão Geral' ou escolha o histórico de faturas.")
+else:
+    history_dir = session_history_dir() # Only this user's statements (None: nothing saved yet)
+    signature = ()
+    if history_dir:
+        from history import history_signature
+        signature = history_signature(history_dir)
+    if signature:
+        from history import load_history_transactions
+        df_fonte = load_history_transactions(history_dir)
+    else:
+        st.info("O histórico está vazio: carregue ao menos uma fatura na página 'Visão Geral'.")
+
+if df_fonte is not None:
+    from categorization import rules_signature
+    from rule_profiler import profile_content_key
+
+    data_key = profile_content_key(df_fonte) # Not statement_id / data_version: those are per session
+
+    # Rules being applied in this session (may have been edited on the main page), else the file
+    regras = st.session_state.get('active_rules') or ler_regras_do_arquivo(RULES_FILE_PATH)
+    if not regras:
+        st.warning("Nenhuma regra carregada.")
+    else:
+        df_perfil, df_sem_regra, n_sem_regra = perfilar_regras(data_key, rules_signature(regras), df_fonte, regras)
+
+        # --- Resumo ---
+        contagem = df_perfil['Status'].value_counts()
+        col1, col2, col3, col4, col5 = st.columns(5)
+        with col1:
+            st.metric(label="✅ Regras Ativas", value=int(contagem.get('Ativa', 0)))
+        with col2:
+            st.metric(label="🌓 Sombreadas", value=int(contagem.get('Sombreada', 0)))
+        with col3:
+            st.metric(label="💤 Sem Uso", value=int(contagem.get('Sem uso', 0)))
+        with col4:
+            st.metric(label="❓ Lançamentos sem Regra", value=f"{n_sem_regra} de {len(df_fonte)}")
+        with col5:
+            st.metric(label="⏱️ Tempo (substring / regex)", value=f"{df_perfil['Tempo (ms)'].sum():.0f} / {df_perfil['Tempo Regex (ms)'].sum():.0f} ms")
+
+        # --- Perfil por Regra ---
+        st.markdown("---")
+        st.subheader("Perfil por Regra")
+        status_filtro = st.multiselect("Status:", options=['Ativa', 'Sombreada', 'Sem uso'], default=['Ativa', 'Sombreada', 'Sem uso'], key='status_perfil_regras')
+        st.dataframe(
+            df_perfil[df_perfil['Status'].isin(status_filtro)],
+            column_config={
+                "Posição": st.column_config.NumberColumn("Ordem", help="Ordem de avaliação (palavras-chave mais longas primeiro)"),
+                "Lançamentos": st.column_config.NumberColumn("Lançamentos", help="Lançamentos categorizados por esta regra"),
+                "Descrições": st.column_config.NumberColumn("Descrições", help="Descrições distintas categorizadas por esta regra"),
+                "Valor": st.column_config.NumberColumn("Valor (R$)", format="R$ %.2f"),
+                "Ocorrências": st.column_config.NumberColumn("Ocorrências", help="Lançamentos que contêm a palavra-chave"),
+                "Sombreados": st.column_config.NumberColumn("Sombreados", help="Lançamentos que contêm a palavra-chave mas foram categorizados por uma regra anterior"),
+                "Fallbacks Substring": st.column_config.NumberColumn("Fallbacks Substring", help="Lançamentos em que a regex de palavra inteira falha e a busca por substring decide"),
+                "Tempo (ms)": st.column_config.NumberColumn("Tempo (ms)", format="%.3f"),
+                "Tempo Regex (ms)": st.column_config.NumberColumn("Tempo Regex (ms)", format="%.3f"),
+            },
+            use_container_width=True,
+            hide_index=True
+        )
+        st.download_button(
+            "⬇️ Baixar Perfil (CSV)",
+            data=df_perfil.to_csv(index=False).encode('utf-8-sig'),
+            file_name="perfil_regras.csv",
+            mime="text/csv",
+            key='download_perfil_regras'
+        )
+
+        # --- Não Categorizados ---
+        st.markdown("---")
+        st.subheader("Lançamentos sem Regra Mais Comuns")
+        if df_sem_regra.empty:
+            st.info("Todos os lançamentos casam com alguma regra.")
+        else:
+            st.dataframe(
+                df_sem_regra,
+                column_config={
+                    "Valor": st.column_config.NumberColumn("Valor (R$)", format="R$ %.2f"),
+                    "Exemplo de Descrição": st.column_config.TextColumn("Exemplo de Descrição"),
+                },
+                use_container_width=True,
+                hide_index=True
+            )
+            st.download_button(
+                "⬇️ Baixar Não Categorizados (CSV)",
+                data=df_sem_regra.to_csv(index=False).encode('utf-8-sig'),
+                file_name="nao_categorizados.csv",
+                mime="text/csv",
+                key='download_nao_categorizados'
+            )
+
+# --- Rodapé ---
+st.markdown("---")
+st.caption(f"Análise de Fatura | Página de Perfil das Regras | {datetime.now().year}")
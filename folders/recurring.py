@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Recurring charge / subscription detector over the statement history.
+
+Charges are grouped by normalized merchant and sorted once by (merchant, date); interval
+and amount statistics per merchant are then computed with vectorized group reductions,
+so the cost is dominated by one sort (near-linear in the number of rows).
+"""
+import numpy as np
+import pandas as pd
+
+INSTALLMENT_MARKER = r'\b\d{1,2}/\d{1,2}\b' # 'XX/YY' (same as installments.PARCELAMENTO_PATTERN, without groups)
+
+# Median interval (days) accepted for each periodicity
+PERIODICITIES = {
+    'Mensal': (25, 35, 30),
+    'Anual': (330, 400, 365),
+}
+MIN_OCCURRENCES = {'Mensal': 3, 'Anual': 2}
+MAX_INTERVAL_CV = 0.25 # Interval std / mean above this is not considered regular
+PRICE_INCREASE_MIN = 0.05 # Last charge at least 5% above the previous median
+STOPPED_TOLERANCE = 1.5 # No charge for 1.5 periods after the last one => stopped
+
+
+def normalize_merchants(descriptions):
+    """
+    Normalizes descriptions to a merchant key: lowercase, without installment markers,
+    numbers, payment prefixes ('pg *', 'mp *', 'ifd*') or punctuation. Evaluated once per
+    unique description.
+    """
+    codes, uniques = pd.factorize(descriptions.astype(str))
+    normalized = (
+        pd.Series(uniques).str.lower()
+        .str.replace(INSTALLMENT_MARKER, ' ', regex=True)
+        .str.replace(r'^\s*(?:pg|mp|ifd|pag|ec|dl)\s*\*', ' ', regex=True)
+        .str.replace(r'[\d\*\.\-_/#]+', ' ', regex=True)
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.strip()
+    )
+    return pd.Series(normalized.to_numpy()[codes], index=descriptions.index)
+
+
+def detect_recurring_charges(df, reference_date=None):
+    """
+    Finds merchants charged at a regular monthly or annual interval.
+
+    Args:
+        df (pd.DataFrame): Transactions with 'Data', 'Descricao' and 'Valor' (any number of statements).
+        reference_date (pd.Timestamp): "Today" used to decide whether a charge stopped
+            (defaults to the most recent transaction).
+
+    Returns:
+        pd.DataFrame: One row per recurring merchant with periodicity, regularity, amounts,
+        next expected charge and 'Status' ('Ativa', 'Aumento de preço' or 'Encerrada').
+    """
+    df = df[['Data', 'Descricao', 'Valor']].dropna()
+    # Installment purchases ('XX/YY') repeat monthly but are not subscriptions
+    df = df[~df['Descricao'].astype(str).str.contains(INSTALLMENT_MARKER, regex=True)]
+    if df.empty:
+        return pd.DataFrame()
+
+    # One charge per merchant and day (split charges on the same day are summed)
+    merchants = normalize_merchants(df['Descricao'])
+    dias = df['Data'].to_numpy(dtype='datetime64[D]')
+    charges = pd.DataFrame({'Estabelecimento': merchants.to_numpy(), 'Dia': dias, 'Valor': df['Valor'].to_numpy(dtype=float)})
+    charges = charges[charges['Estabelecimento'] != '']
+    charges = charges.groupby(['Estabelecimento', 'Dia'], sort=True)['Valor'].sum().reset_index()
+    if charges.empty:
+        return pd.DataFrame()
+
+    # Sorted by (merchant, day): intervals are the day differences inside the same merchant
+    codes = pd.factorize(charges['Estabelecimento'])[0]
+    day_numbers = charges['Dia'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+    same_merchant = np.r_[False, codes[1:] == codes[:-1]]
+    intervals = pd.Series(np.r_[0, np.diff(day_numbers)].astype(float)).where(same_merchant)
+    charges['Intervalo'] = intervals.to_numpy()
+
+    grouped = charges.groupby('Estabelecimento', sort=False)
+    stats = grouped.agg(
+        Ocorrencias=('Valor', 'size'),
+        Primeira=('Dia', 'first'),
+        Ultima=('Dia', 'last'),
+        ValorMedio=('Valor', 'mean'),
+        ValorStd=('Valor', 'std'),
+        UltimoValor=('Valor', 'last'),
+        IntervaloMediano=('Intervalo', 'median'),
+        IntervaloMedio=('Intervalo', 'mean'),
+        IntervaloStd=('Intervalo', 'std'),
+    )
+    # Median of the amounts before the last charge (reference for price increases)
+    previous = charges[grouped.cumcount(ascending=False).to_numpy() > 0]
+    stats['ValorAnterior'] = previous.groupby('Estabelecimento', sort=False)['Valor'].median()
+
+    # Periodicity from the median interval, regularity from the interval coefficient of variation
+    stats['Periodicidade'] = None
+    stats['Periodo'] = np.nan
+    for nome, (minimo, maximo, dias_periodo) in PERIODICITIES.items():
+        match = stats['IntervaloMediano'].between(minimo, maximo) & (stats['Ocorrencias'] >= MIN_OCCURRENCES[nome])
+        stats.loc[match, 'Periodicidade'] = nome
+        stats.loc[match, 'Periodo'] = dias_periodo
+    stats['RegularidadeCV'] = (stats['IntervaloStd'].fillna(0) / stats['IntervaloMedio']).fillna(0)
+    stats = stats[stats['Periodicidade'].notna() & (stats['RegularidadeCV'] <= MAX_INTERVAL_CV)].copy()
+    if stats.empty:
+        return pd.DataFrame()
+
+    reference_date = pd.Timestamp(reference_date) if reference_date is not None else pd.Timestamp(charges['Dia'].max())
+    stats['Primeira'] = pd.to_datetime(stats['Primeira'])
+    stats['Ultima'] = pd.to_datetime(stats['Ultima'])
+    stats['ProximaPrevista'] = (stats['Ultima'] + pd.to_timedelta(stats['IntervaloMediano'], unit='D')).dt.normalize()
+    stats['VariacaoValorCV'] = (stats['ValorStd'].fillna(0) / stats['ValorMedio']).fillna(0)
+    stats['Aumento'] = (stats['UltimoValor'] / stats['ValorAnterior'] - 1) * 100
+
+    dias_sem_cobranca = (reference_date - stats['Ultima']).dt.days
+    stopped = dias_sem_cobranca > stats['Periodo'] * STOPPED_TOLERANCE
+    increased = stats['Aumento'] >= PRICE_INCREASE_MIN * 100
+    stats['Status'] = np.select([stopped, increased], ['Encerrada', 'Aumento de preço'], default='Ativa')
+
+    # Monthly-equivalent cost of the active charges (annual ones divided by 12)
+    stats['Custo Mensal Equivalente'] = np.where(stats['Periodicidade'] == 'Anual', stats['UltimoValor'] / 12, stats['UltimoValor'])
+    stats.loc[stopped, 'Custo Mensal Equivalente'] = 0.0
+
+    result = stats.reset_index().rename(columns={
+        'Ocorrencias': 'Ocorrências',
+        'Primeira': 'Primeira Cobrança',
+        'Ultima': 'Última Cobrança',
+        'ValorMedio': 'Valor Médio',
+        'UltimoValor': 'Último Valor',
+        'ValorAnterior': 'Valor Anterior (mediana)',
+        'IntervaloMediano': 'Intervalo (dias)',
+        'RegularidadeCV': 'Irregularidade (CV)',
+        'VariacaoValorCV': 'Variação do Valor (CV)',
+        'Aumento': 'Aumento (%)',
+        'ProximaPrevista': 'Próxima Prevista',
+    })
+    columns = ['Estabelecimento', 'Periodicidade', 'Status', 'Ocorrências', 'Intervalo (dias)', 'Irregularidade (CV)',
+               'Valor Médio', 'Variação do Valor (CV)', 'Último Valor', 'Valor Anterior (mediana)', 'Aumento (%)',
+               'Custo Mensal Equivalente', 'Primeira Cobrança', 'Última Cobrança', 'Próxima Prevista']
+    return result[columns].sort_values(by=['Status', 'Custo Mensal Equivalente'], ascending=[True, False]).reset_index(drop=True)
+
+
+def recurring_charge_rows(df, recurring):
+    """The individual transactions of the detected merchants (for the timeline chart)."""
+    merchants = normalize_merchants(df['Descricao'])
+    mask = merchants.isin(set(recurring['Estabelecimento']))
+    rows = df.loc[mask, ['Data', 'Descricao', 'Valor']].copy()
+    rows['Estabelecimento'] = merchants[mask]
+    return rows
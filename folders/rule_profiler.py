@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Profiler for the categorization ruleset: which rules fire, which never match, which are
+shadowed by a rule that comes first in rules_dict order (longer keywords first), which
+only match through the substring fallback of suggest_categories_v2 (the word-boundary
+regex misses) and how long each rule takes. Also lists the most common descriptions that
+no rule matches, to guide new rules.
+
+Descriptions are evaluated once per unique value (counts and values are per row), with
+the same first-hit-wins scan as categorization._winning_rule_positions.
+
+Usage:
+    python folders/rule_profiler.py fatura.xlsx [outra_fatura.csv ...] --csv perfil_regras.csv
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from categorization import read_rules_file
+from recurring import normalize_merchants
+
+STATUS_ACTIVE = 'Ativa'
+STATUS_SHADOWED = 'Sombreada' # Matches descriptions, but always after another rule
+STATUS_DEAD = 'Sem uso' # Matches no description
+TOP_UNCATEGORIZED = 30
+
+PROFILE_COLUMNS = [
+    'Posição', 'Palavra-Chave', 'Categoria Nível 1', 'Categoria Nível 2', 'Status',
+    'Lançamentos', 'Descrições', 'Valor', 'Ocorrências', 'Sombreados', 'Sombreada Por',
+    'Fallbacks Substring', 'Erros Regex', 'Tempo (ms)', 'Tempo Regex (ms)'
+]
+
+
+def profile_content_key(df):
+    """
+    Hash of the columns the profile reads ('Descricao', 'Valor'), in row order: the cache key
+    of a profile, since equal data version numbers of two sessions say nothing about equal data.
+    """
+    hashes = pd.util.hash_pandas_object(df[['Descricao', 'Valor']], index=False).to_numpy()
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+
+def profile_rules(df, rules_dict):
+    """
+    Per-rule statistics over the rows of df.
+
+    Args:
+        df (pd.DataFrame): Rows with 'Descricao' and 'Valor' (one statement or the history).
+        rules_dict (dict): Rules in evaluation order.
+
+    Returns:
+        tuple: (profile, winner) where profile has PROFILE_COLUMNS in rule order:
+            'Lançamentos' / 'Descrições' / 'Valor': rows, unique descriptions and value won by the rule,
+            'Ocorrências': rows containing the keyword,
+            'Sombreados': of those, rows won by an earlier rule ('Sombreada Por': the most frequent one),
+            'Fallbacks Substring': rows matched only by the substring check (word-boundary regex misses),
+            'Erros Regex': rows where the regex could not be compiled (substring check used),
+            'Tempo (ms)': substring scan used by the app, 'Tempo Regex (ms)': word-boundary regex scan
+            of suggest_categories_v2, both over the unique descriptions;
+        and winner, a Series with the winning keyword (or None) of each row of df.
+    """
+    descriptions = df['Descricao'].astype(str)
+    codes, uniques = pd.factorize(descriptions)
+    row_counts = np.bincount(codes, minlength=len(uniques))
+    row_values = np.bincount(codes, weights=pd.to_numeric(df['Valor'], errors='coerce').fillna(0).to_numpy(), minlength=len(uniques))
+    uniques_lower = pd.Series(uniques).str.lower()
+    keywords = list(rules_dict)
+
+    winner = np.full(len(uniques), -1)
+    records = []
+    for position, keyword in enumerate(keywords):
+        start = time.perf_counter()
+        hits = uniques_lower.str.contains(keyword, regex=False).to_numpy()
+        substring_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        regex_errors = 0
+        try:
+            pattern = re.compile(r'\b' + re.escape(keyword) + r'\b')
+            word_hits = uniques_lower.str.contains(pattern).to_numpy()
+        except re.error:
+            word_hits = np.zeros(len(uniques), dtype=bool)
+            regex_errors = int(row_counts[hits].sum())
+        regex_ms = (time.perf_counter() - start) * 1000
+
+        wins = hits & (winner < 0)
+        shadowed = hits & (winner >= 0)
+        shadowed_by = None
+        if shadowed.any():
+            # Earlier rule that takes most of the rows this one would match
+            shadowing = np.bincount(winner[shadowed], weights=row_counts[shadowed])
+            shadowed_by = keywords[int(np.argmax(shadowing))]
+        winner[wins] = position
+
+        categories = rules_dict[keyword]
+        records.append({
+            'Posição': position + 1,
+            'Palavra-Chave': keyword,
+            'Categoria Nível 1': categories.get('Nivel1'),
+            'Categoria Nível 2': categories.get('Nivel2'),
+            'Lançamentos': int(row_counts[wins].sum()),
+            'Descrições': int(wins.sum()),
+            'Valor': float(row_values[wins].sum()),
+            'Ocorrências': int(row_counts[hits].sum()),
+            'Sombreados': int(row_counts[shadowed].sum()),
+            'Sombreada Por': shadowed_by,
+            'Fallbacks Substring': int(row_counts[hits & ~word_hits].sum()) - regex_errors,
+            'Erros Regex': regex_errors,
+            'Tempo (ms)': substring_ms,
+            'Tempo Regex (ms)': regex_ms,
+        })
+
+    profile = pd.DataFrame(records, columns=[col for col in PROFILE_COLUMNS if col != 'Status'])
+    profile['Status'] = np.select(
+        [profile['Lançamentos'] > 0, profile['Ocorrências'] > 0],
+        [STATUS_ACTIVE, STATUS_SHADOWED], default=STATUS_DEAD
+    ) if not profile.empty else pd.Series(dtype=object)
+    keyword_array = np.array(keywords + [None], dtype=object) # winner -1 -> None
+    return profile[PROFILE_COLUMNS], pd.Series(keyword_array[winner[codes]], index=df.index)
+
+
+def top_uncategorized(df, winner, limit=TOP_UNCATEGORIZED):
+    """
+    The most common rows that no rule matches, grouped by normalized merchant.
+
+    Returns:
+        pd.DataFrame: 'Estabelecimento', 'Lançamentos', 'Valor' and the most frequent
+        'Exemplo de Descrição', by number of rows.
+    """
+    rows = df[winner.isna()]
+    if rows.empty:
+        return pd.DataFrame(columns=['Estabelecimento', 'Lançamentos', 'Valor', 'Exemplo de Descrição'])
+    rows = pd.DataFrame({
+        'Estabelecimento': normalize_merchants(rows['Descricao']).to_numpy(),
+        'Descricao': rows['Descricao'].astype(str).to_numpy(),
+        'Valor': pd.to_numeric(rows['Valor'], errors='coerce').fillna(0).to_numpy(),
+    })
+    grouped = rows.groupby('Estabelecimento', sort=False).agg(Lançamentos=('Valor', 'size'), Valor=('Valor', 'sum'))
+    grouped['Exemplo de Descrição'] = rows.groupby('Estabelecimento', sort=False)['Descricao'].agg(lambda values: values.value_counts().index[0])
+    return grouped.sort_values(by=['Lançamentos', 'Valor'], ascending=False).head(limit).reset_index()
+
+
+def main():
+    from statement_loader import StatementError, parse_statement
+
+    parser = argparse.ArgumentParser(description="Rule hit-rate and cost profile of the categorization rules.")
+    parser.add_argument('statements', nargs='+', help="Statement files (.xls, .xlsx or .csv)")
+    parser.add_argument('--rules', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'regras_categorizacao.xlsx'))
+    parser.add_argument('--csv', default='perfil_regras.csv', help="Per-rule profile (CSV)")
+    parser.add_argument('--uncategorized-csv', default='nao_categorizados.csv', help="Most common uncategorized descriptions (CSV)")
+    args = parser.parse_args()
+
+    frames = []
+    for path in args.statements:
+        try:
+            with open(path, 'rb') as file_obj:
+                frames.append(parse_statement(file_obj, path))
+        except StatementError as e:
+            sys.exit(f"{path}: {e}")
+    df = pd.concat(frames, ignore_index=True)
+    profile, winner = profile_rules(df, read_rules_file(args.rules))
+    profile.to_csv(args.csv, index=False, encoding='utf-8-sig')
+    top_uncategorized(df, winner).to_csv(args.uncategorized_csv, index=False, encoding='utf-8-sig')
+
+    print(f"{len(df)} lançamentos, {len(profile)} regras: " + ", ".join(f"{count} {status}" for status, count in profile['Status'].value_counts().items()))
+    print(f"Sem regra: {int(winner.isna().sum())} lançamentos | tempo total {profile['Tempo (ms)'].sum():.1f} ms (regex {profile['Tempo Regex (ms)'].sum():.1f} ms)")
+    print(f"Perfil: {args.csv} | Não categorizados: {args.uncategorized_csv}")
+
+
+if __name__ == '__main__':
+    main()
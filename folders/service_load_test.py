@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Load test for categorization_service.py: N concurrent clients send /categorize requests
+and the script reports throughput and latency percentiles (p50 / p95 / p99).
+
+Descriptions are generated offline from the rules file keywords (plus unmatched and
+installment-style ones), so no real statement is needed.
+
+Usage:
+    python folders/service_load_test.py --spawn --concurrency 32 --requests 2000
+    python folders/service_load_test.py --spawn --concurrency 32 --requests 2000 --no-batching
+    python folders/service_load_test.py --url http://127.0.0.1:8765 --batch-size 50
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+from categorization import read_rules_file
+from categorization_service import BATCH_MAX_DESCRIPTIONS, BATCH_MAX_WAIT_MS, DEFAULT_PORT, DEFAULT_RULES_FILE
+
+
+def sample_descriptions(rules_file, count, seed=0):
+    """Statement-like descriptions: keywords with prefixes/suffixes, installments and unknown merchants."""
+    rng = random.Random(seed)
+    keywords = list(read_rules_file(rules_file)) if os.path.exists(rules_file) else []
+    keywords = keywords or ['mercado', 'uber', 'farmacia']
+    descriptions = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.6:
+            desc = rng.choice(['', 'PG *', 'IFD*', 'MP *']) + rng.choice(keywords).upper() + rng.choice(['', ' SAO PAULO', ' BR'])
+        elif kind < 0.8:
+            desc = f"{rng.choice(keywords).upper()} {rng.randint(1, 9):02d}/{rng.randint(10, 12):02d}"
+        else:
+            desc = f"ESTABELECIMENTO {rng.randint(1, 5000)}"
+        descriptions.append(desc)
+    return descriptions
+
+
+def wait_until_ready(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=1)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def run_load_test(host, port, concurrency, total_requests, batch_size, descriptions):
+    """
+    Sends total_requests /categorize requests (batch_size descriptions each) from
+    `concurrency` keep-alive connections.
+
+    Returns:
+        dict: requests, errors, elapsed seconds and per-request latencies (seconds).
+    """
+    latencies, errors = [], []
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+
+    def client(client_number):
+        conn = http.client.HTTPConnection(host, port, timeout=60)
+        rng = random.Random(client_number)
+        local_latencies, local_errors = [], 0
+        while True:
+            with lock:
+                request_number = next(counter, None)
+            if request_number is None:
+                break
+            body = json.dumps({'descriptions': rng.sample(descriptions, batch_size)}).encode('utf-8') # bytes: sent with the headers
+            start = time.perf_counter()
+            try:
+                conn.request('POST', '/categorize', body=body, headers={'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                payload = response.read()
+                if response.status != 200 or len(json.loads(payload)['categories']) != batch_size:
+                    local_errors += 1
+            except (OSError, http.client.HTTPException, ValueError, KeyError):
+                local_errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=60)
+            local_latencies.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {'requests': len(latencies), 'errors': sum(errors), 'elapsed': elapsed, 'latencies': latencies}
+
+
+def print_report(result, batch_size, concurrency):
+    latencies_ms = np.array(result['latencies']) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99]) if len(latencies_ms) else (0, 0, 0)
+    print(f"Requisições: {result['requests']} ({result['errors']} erros), concorrência {concurrency}, {batch_size} descrições/requisição")
+    print(f"Tempo total: {result['elapsed']:.2f} s")
+    print(f"Vazão: {result['requests'] / result['elapsed']:.1f} req/s | {result['requests'] * batch_size / result['elapsed']:.0f} descrições/s")
+    print(f"Latência: p50 {p50:.1f} ms | p95 {p95:.1f} ms | p99 {p99:.1f} ms | máx {latencies_ms.max() if len(latencies_ms) else 0:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the local categorization service.")
+    parser.add_argument('--url', default=f"http://127.0.0.1:{DEFAULT_PORT}")
+    parser.add_argument('--spawn', action='store_true', help="Start the service for the test and stop it afterwards")
+    parser.add_argument('--workers', type=int, default=None, help="Workers of the spawned service")
+    parser.add_argument('--max-batch', type=int, default=BATCH_MAX_DESCRIPTIONS, help="Descriptions per batch of the spawned service")
+    parser.add_argument('--max-wait-ms', type=float, default=BATCH_MAX_WAIT_MS, help="Max wait to fill a batch of the spawned service")
+    parser.add_argument('--no-batching', action='store_true', help="Spawned service sends every request alone (--max-batch 1 --max-wait-ms 0)")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=20, help="Descriptions per request")
+    parser.add_argument('--rules', default=DEFAULT_RULES_FILE)
+    args = parser.parse_args()
+
+    url = urlparse(args.url)
+    host, port = url.hostname, url.port or DEFAULT_PORT
+    service = None
+    if args.spawn:
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'categorization_service.py'),
+                   '--host', host, '--port', str(port), '--rules', args.rules]
+        if args.workers:
+            command += ['--workers', str(args.workers)]
+        if args.no_batching:
+            args.max_batch, args.max_wait_ms = 1, 0
+        command += ['--max-batch', str(args.max_batch), '--max-wait-ms', str(args.max_wait_ms)]
+        service = subprocess.Popen(command)
+    try:
+        if not wait_until_ready(host, port):
+            sys.exit(f"Serviço não respondeu em {args.url}")
+        descriptions = sample_descriptions(args.rules, 5000)
+        run_load_test(host, port, min(args.concurrency, 4), min(args.requests, 50), args.batch_size, descriptions) # Warm-up
+        result = run_load_test(host, port, args.concurrency, args.requests, args.batch_size, descriptions)
+        print_report(result, args.batch_size, args.concurrency)
+        if result['errors']:
+            sys.exit(1)
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Per-session memory accounting and eviction for a shared deployment.
+
+Every session reports the size of its frames (df_fatura / df_for_plot) at the end of a run.
+A frame object is counted once in the total, however many sessions reference it (sessions
+that loaded the same file share the frame of the load cache). When the total exceeds
+SESSION_MEMORY_BUDGET_MB, the private frames of the sessions idle for longer than
+SESSION_IDLE_SECONDS are spilled to disk (least recently used first) and replaced by None in
+their session state; the owning session loads them back at the top of its next run
+(restore_session_frames), before anything reads them. Frames still held by a cache
+(mark_shared_frame) or by another session in memory are never spilled: dropping one
+reference frees nothing, and restoring it would make a private copy.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+
+import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+SESSION_MEMORY_BUDGET_MB = float(os.environ.get('FATURA_SESSION_MEMORY_BUDGET_MB', 1024)) # All sessions together
+SESSION_IDLE_SECONDS = float(os.environ.get('FATURA_SESSION_IDLE_SECONDS', 300)) # Only sessions idle this long are spilled
+SPILL_DIR = os.path.join(tempfile.gettempdir(), 'analise_fatura_sessoes')
+
+SPILLABLE_FRAMES = ['df_fatura', 'df_for_plot']
+SPILLED_KEY = 'spilled_frames' # {frame name: pickle path}; frames that were the same object share a path
+
+_shared_frames = weakref.WeakValueDictionary() # id -> frame held by a process-wide cache (while it lives)
+
+
+def _is_frame(obj):
+    # pandas is imported lazily by the pages, so no frame can exist before it is loaded
+    pd = sys.modules.get('pandas')
+    return pd is not None and isinstance(obj, pd.DataFrame)
+
+
+def mark_shared_frame(df):
+    """Call on frames held by a process-wide cache (st.cache_resource): they are never spilled."""
+    _shared_frames[id(df)] = df
+    return df
+
+
+def is_shared_frame(df):
+    return _shared_frames.get(id(df)) is df
+
+
+def session_frames(state):
+    """{id: bytes} of the session's frames (a frame referenced twice is one entry)."""
+    frames = {}
+    for name in SPILLABLE_FRAMES:
+        df = state[name] if name in state else None
+        if _is_frame(df) and id(df) not in frames:
+            frames[id(df)] = int(df.memory_usage(index=True, deep=True).sum())
+    return frames
+
+
+def frames_nbytes(state):
+    """Memory of the session's frames (a frame referenced twice is counted once)."""
+    return sum(session_frames(state).values())
+
+
+def spill_frames(state, session_id, spill_dir=SPILL_DIR, frame_ids=None):
+    """
+    Writes the session's frames (only those in frame_ids, when given) to disk and drops them
+    (and its export cache) from memory.
+    """
+    os.makedirs(spill_dir, exist_ok=True)
+    spilled, paths_by_id = {}, {}
+    for name in SPILLABLE_FRAMES:
+        df = state[name] if name in state else None
+        if not _is_frame(df) or (frame_ids is not None and id(df) not in frame_ids):
+            continue
+        if id(df) in paths_by_id:
+            spilled[name] = paths_by_id[id(df)] # Same object as an already spilled frame
+            continue
+        path = os.path.join(spill_dir, f"{session_id}_{name}_{uuid.uuid4().hex[:8]}.pkl")
+        df.to_pickle(path)
+        spilled[name] = paths_by_id[id(df)] = path
+    for name in spilled:
+        state[name] = None
+    if 'export_cache' in state:
+        state['export_cache'] = {} # Generated files are rebuilt on the next click
+    state[SPILLED_KEY] = spilled
+    return spilled
+
+
+def restore_frames(state):
+    """Loads spilled frames back (frames that were the same object are restored as one)."""
+    spilled = state[SPILLED_KEY] if SPILLED_KEY in state else None
+    if not spilled:
+        return False
+    import pandas as pd
+
+    loaded = {}
+    for name, path in spilled.items():
+        if path not in loaded:
+            loaded[path] = pd.read_pickle(path)
+        state[name] = loaded[path]
+    state[SPILLED_KEY] = None
+    for path in loaded:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return True
+
+
+class SessionMemoryRegistry:
+    """
+    Process-wide table {session_id: usage}. Each entry keeps the session state of the
+    session's latest run; entries of closed sessions are dropped (and their spill files
+    removed) on the next accounting pass.
+    """
+
+    def __init__(self, spill_dir=SPILL_DIR):
+        self.spill_dir = spill_dir
+        self._lock = threading.Lock()
+        self._sessions = {} # session_id -> {'state', 'frames' ({id: bytes}), 'last_access', 'spilled'}
+
+    def _drop_closed_sessions(self):
+        if not runtime.exists():
+            return
+        active = runtime.get_instance().is_active_session
+        for session_id in [sid for sid in self._sessions if not active(sid)]:
+            for path in set(self._sessions.pop(session_id).get('spilled_paths', ())):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def begin_run(self, session_id, state):
+        """Marks the session as active and restores its frames if they were spilled."""
+        with self._lock:
+            entry = self._sessions.setdefault(session_id, {'frames': {}, 'spilled': False})
+            entry['state'] = state
+            entry['last_access'] = time.monotonic()
+            restored = restore_frames(state)
+            entry['spilled'] = False
+            entry.pop('spilled_paths', None)
+            return restored
+
+    def _private_frames(self, session_id):
+        """Frames of a session that spilling would free: not cached and not used by another session in memory."""
+        entry = self._sessions[session_id]
+        others = set()
+        for sid, e in self._sessions.items():
+            if sid != session_id:
+                others.update(e['frames'])
+        state = entry['state']
+        private = {}
+        for name in SPILLABLE_FRAMES:
+            df = state[name] if name in state else None
+            if _is_frame(df) and id(df) in entry['frames'] and id(df) not in others and not is_shared_frame(df):
+                private[id(df)] = entry['frames'][id(df)]
+        return private
+
+    def end_run(self, session_id, state, frames, budget_bytes, idle_seconds):
+        """
+        Records the session's frames ({id: bytes}) and, over budget, spills the private frames
+        of idle sessions (LRU first) until the total fits. Returns the ids of the spilled sessions.
+        """
+        with self._lock:
+            self._drop_closed_sessions()
+            entry = self._sessions.setdefault(session_id, {'spilled': False})
+            entry.update(state=state, frames=dict(frames), last_access=time.monotonic())
+
+            spilled_ids = []
+            total = self.total_bytes(locked=True)
+            if total <= budget_bytes:
+                return spilled_ids
+            now = time.monotonic()
+            idle = sorted(
+                (sid for sid, e in self._sessions.items()
+                 if sid != session_id and not e['spilled'] and e['frames'] and now - e['last_access'] >= idle_seconds),
+                key=lambda sid: self._sessions[sid]['last_access']
+            )
+            for sid in idle:
+                if total <= budget_bytes:
+                    break
+                private = self._private_frames(sid)
+                if not private:
+                    continue # Only shared frames: spilling would free nothing
+                other = self._sessions[sid]
+                other['spilled_paths'] = list(spill_frames(other['state'], sid, self.spill_dir, frame_ids=private).values())
+                other['spilled'] = True
+                other['frames'] = {fid: nbytes for fid, nbytes in other['frames'].items() if fid not in private} # Shared frames stay in memory
+                total = self.total_bytes(locked=True)
+                spilled_ids.append(sid)
+            return spilled_ids
+
+    def total_bytes(self, locked=False):
+        """Bytes of the frames held in memory by the registered sessions (each frame object counted once)."""
+        if not locked:
+            with self._lock:
+                return self.total_bytes(locked=True)
+        frames = {}
+        for entry in self._sessions.values():
+            frames.update(entry['frames'])
+        return sum(frames.values())
+
+    def usage(self):
+        """(sessions in memory, spilled sessions, bytes in memory)."""
+        with self._lock:
+            in_memory = sum(1 for entry in self._sessions.values() if not entry['spilled'])
+            return in_memory, len(self._sessions) - in_memory, self.total_bytes(locked=True)
+
+
+@st.cache_resource
+def get_session_registry():
+    """The registry shared by all sessions of this process."""
+    return SessionMemoryRegistry()
+
+
+def restore_session_frames():
+    """Call at the top of every page that reads df_fatura / df_for_plot."""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return False
+    return get_session_registry().begin_run(ctx.session_id, ctx.session_state)
+
+
+def account_session_memory(data_version):
+    """
+    Call at the end of the main page: measures this session's frames (only when the data
+    version or the frame objects changed) and applies the eviction policy.
+
+    Returns:
+        tuple: (bytes of this session, bytes of all sessions in memory)
+    """
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return 0, 0
+    state = ctx.session_state
+    key = (data_version,) + tuple(id(state[name]) if name in state else None for name in SPILLABLE_FRAMES)
+    measured = state['memory_account'] if 'memory_account' in state else None
+    if measured is None or measured[0] != key:
+        measured = (key, session_frames(state))
+        state['memory_account'] = measured
+    registry = get_session_registry()
+    registry.end_run(ctx.session_id, state, measured[1], SESSION_MEMORY_BUDGET_MB * 1024 ** 2, SESSION_IDLE_SECONDS)
+    return sum(measured[1].values()), registry.total_bytes()
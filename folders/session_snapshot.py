@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Snapshots of a session's working set on local disk, so a session can be resumed after a
+server restart or an expired session without uploading and categorizing the file again.
+
+A snapshot is a directory named by its id (kept in the page URL as ?snapshot=<id>) under
+the SNAPSHOTS_DIR of the user's history directory (user_history.session_history_dir), so a
+snapshot id only restores in the session of the user who saved it:
+    base_<n>.arrow      df_fatura as an uncompressed Arrow IPC (Feather v2) file
+    delta_<n>.arrow     rows changed by table edits after the base (full rows, by RowId)
+    state.json          manual categories, filters / view state and the list of files above
+
+Table edits only append a delta with the edited rows; any other change of df_fatura (a new
+file, rule changes) or too many deltas rewrite the base (compaction). Restores memory-map
+the Arrow files, so only the columns are converted, nothing is parsed.
+
+A snapshot directory has a single writer: a session restored from a URL first forks the
+snapshot to a new id (hard links of the Arrow files, which are never modified in place), so
+two tabs opened with the same URL never overwrite or compact each other's files.
+
+pyarrow is imported only when a snapshot is written or restored.
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import date
+
+from user_history import HISTORY_ROOT, USER_HISTORIES_DIR, session_history_dir
+
+SNAPSHOTS_DIR = 'sessoes' # Inside each history directory
+SNAPSHOT_QUERY_PARAM = 'snapshot'
+SNAPSHOT_MAX_AGE_DAYS = float(os.environ.get('FATURA_SNAPSHOT_MAX_AGE_DAYS', 30)) # Older snapshots are removed
+MAX_DELTAS = 50 # Compaction after this many delta files ...
+MAX_DELTA_FRACTION = 0.25 # ... or when the deltas hold more rows than this fraction of the base
+STATE_FILE = 'state.json'
+SNAPSHOT_FORMAT = 1
+
+# Session keys saved with the snapshot (besides df_fatura); widget keys are restored before the widgets exist
+VIEW_KEYS = [
+    'uploaded_file_name', 'statement_id', 'show_charts', 'selected_cat_nv1', 'selected_cat_nv2',
+    'nivel_grafico_radio', 'table_search', 'table_sort_col', 'table_sort_order', 'table_page_size', 'table_page',
+    'start_date_evol_flex', 'end_date_evol_flex', 'resolucao_evol', 'categorias_tendencia', 'janela_media_tendencia',
+    'export_dataset', 'export_format', 'history_id',
+]
+_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+
+def _to_json(value):
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    return value
+
+
+def _from_json(value):
+    if isinstance(value, dict) and '__date__' in value:
+        return date.fromisoformat(value['__date__'])
+    return value
+
+
+def _write_atomic(path, write):
+    """
+    Writes to a temporary file and renames it, so a reader never sees half a file. The
+    temporary name is unique per call (sessions are threads of the same process).
+    """
+    directory, name = os.path.split(path)
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=f"{name}.", suffix='.tmp', delete=False) as tmp_file:
+        tmp_path = tmp_file.name
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_text(path, content):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def _write_arrow(df, path):
+    from pyarrow import feather
+
+    # Uncompressed, so restores can memory-map the columns; RowId is a column (index == RowId)
+    _write_atomic(path, lambda tmp_path: feather.write_feather(df.reset_index(drop=True), tmp_path, compression='uncompressed'))
+
+
+def _read_arrow(path):
+    from pyarrow import feather
+
+    return feather.read_table(path, memory_map=True).to_pandas()
+
+
+def snapshot_path(snapshot_id, snapshot_dir):
+    """Directory of a snapshot, or None when the id is not a valid snapshot id."""
+    if not isinstance(snapshot_id, str) or not _ID_PATTERN.fullmatch(snapshot_id):
+        return None
+    return os.path.join(snapshot_dir, snapshot_id)
+
+
+def record_edited_rows(state, row_ids):
+    """Call when table edits change these RowIds (and bump data_version once): the next snapshot is a delta."""
+    pending = state['snapshot_pending_rows'] if 'snapshot_pending_rows' in state else None
+    state['snapshot_pending_rows'] = (pending or set()) | set(row_ids)
+    state['snapshot_pending_edits'] = (state['snapshot_pending_edits'] if 'snapshot_pending_edits' in state else 0) + 1
+
+
+def save_snapshot(state, snapshot_id, snapshot_dir):
+    """
+    Writes what changed since the last snapshot of this session: a delta with the edited rows,
+    a new base when df_fatura changed otherwise, and state.json when the view state changed.
+
+    Returns:
+        str: 'base', 'delta' or None (frame unchanged).
+    """
+    df_fatura = state['df_fatura'] if 'df_fatura' in state else None
+    if df_fatura is None:
+        return None
+    directory = snapshot_path(snapshot_id, snapshot_dir)
+    os.makedirs(directory, exist_ok=True)
+    meta = state['snapshot_meta'] if 'snapshot_meta' in state else None
+    data_version = state['data_version']
+    pending_rows = state['snapshot_pending_rows'] if 'snapshot_pending_rows' in state else None
+    pending_edits = state['snapshot_pending_edits'] if 'snapshot_pending_edits' in state else 0
+
+    written = None
+    if meta is None or meta['statement_id'] != state['statement_id'] or not os.path.exists(os.path.join(directory, meta['base'])):
+        written = 'base'
+    elif meta['data_version'] != data_version:
+        # A delta only if every change since the last snapshot was a recorded table edit
+        only_edits = pending_rows and data_version - meta['data_version'] == pending_edits
+        too_many = len(meta['deltas']) >= MAX_DELTAS or meta['delta_rows'] + len(pending_rows or ()) > MAX_DELTA_FRACTION * len(df_fatura)
+        written = 'delta' if only_edits and not too_many else 'base'
+
+    old_files = []
+    if written == 'base':
+        generation = meta['generation'] + 1 if meta is not None else 1
+        old_files = [meta['base']] + meta['deltas'] if meta is not None else []
+        meta = {'statement_id': state['statement_id'], 'generation': generation, 'base': f"base_{generation}.arrow", 'deltas': [], 'delta_rows': 0}
+        _write_arrow(df_fatura, os.path.join(directory, meta['base']))
+    elif written == 'delta':
+        rows = sorted(pending_rows)
+        delta_name = f"delta_{meta['generation']}_{len(meta['deltas']) + 1}.arrow"
+        _write_arrow(df_fatura.loc[rows], os.path.join(directory, delta_name))
+        meta = dict(meta, deltas=meta['deltas'] + [delta_name], delta_rows=meta['delta_rows'] + len(rows))
+    if written is not None:
+        meta['data_version'] = data_version
+        state['snapshot_meta'] = meta
+    state['snapshot_pending_rows'] = None
+    state['snapshot_pending_edits'] = 0
+
+    # state.json is tiny: rewritten whenever the overrides or the view state change
+    snapshot_state = {
+        'format': SNAPSHOT_FORMAT,
+        'meta': meta,
+        'categorias_mapeadas': state['categorias_mapeadas'] if 'categorias_mapeadas' in state else {},
+        'view': {key: _to_json(state[key]) for key in VIEW_KEYS if key in state},
+    }
+    content = json.dumps(snapshot_state, ensure_ascii=False, default=str)
+    if written is not None or (state['snapshot_state_json'] if 'snapshot_state_json' in state else None) != content:
+        _write_atomic(os.path.join(directory, STATE_FILE), lambda tmp_path: _write_text(tmp_path, content))
+        state['snapshot_state_json'] = content
+    # Files of the previous base are removed only after state.json stopped pointing to them
+    for name in old_files:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+    return written
+
+
+def fork_snapshot(snapshot_id, snapshot_dir, attempts=3):
+    """
+    Copies a snapshot to a new id: hard links of its Arrow files (a copy where links are not
+    supported) and its state.json. If the owner compacts the snapshot meanwhile (a listed file
+    is gone), state.json is read again.
+
+    Returns:
+        str: The new snapshot id, or None if there is no valid snapshot.
+    """
+    source = snapshot_path(snapshot_id, snapshot_dir)
+    state_path = os.path.join(source, STATE_FILE) if source else None
+    for _ in range(attempts):
+        if state_path is None or not os.path.exists(state_path):
+            return None
+        with open(state_path, encoding='utf-8') as f:
+            content = f.read()
+        snapshot_state = json.loads(content)
+        meta = snapshot_state.get('meta')
+        if snapshot_state.get('format') != SNAPSHOT_FORMAT or meta is None:
+            return None
+        new_id = uuid.uuid4().hex
+        target = snapshot_path(new_id, snapshot_dir)
+        os.makedirs(target)
+        try:
+            for name in [meta['base']] + meta['deltas']:
+                try:
+                    os.link(os.path.join(source, name), os.path.join(target, name))
+                except FileNotFoundError:
+                    raise
+                except OSError:
+                    shutil.copy2(os.path.join(source, name), os.path.join(target, name))
+        except FileNotFoundError:
+            shutil.rmtree(target, ignore_errors=True)
+            continue
+        _write_atomic(os.path.join(target, STATE_FILE), lambda tmp_path: _write_text(tmp_path, content))
+        return new_id
+    return None
+
+
+def load_snapshot(snapshot_id, snapshot_dir):
+    """
+    Reads a snapshot: the memory-mapped base with the deltas applied in order.
+
+    Returns:
+        tuple: (df_fatura, snapshot state dict) or (None, None) if there is no valid snapshot.
+    """
+    directory = snapshot_path(snapshot_id, snapshot_dir)
+    state_path = os.path.join(directory, STATE_FILE) if directory else None
+    if state_path is None or not os.path.exists(state_path):
+        return None, None
+    with open(state_path, encoding='utf-8') as f:
+        snapshot_state = json.load(f)
+    meta = snapshot_state.get('meta')
+    if snapshot_state.get('format') != SNAPSHOT_FORMAT or meta is None:
+        return None, None
+
+    df_fatura = _read_arrow(os.path.join(directory, meta['base']))
+    if meta['deltas']:
+        import pandas as pd
+
+        deltas = pd.concat([_read_arrow(os.path.join(directory, name)) for name in meta['deltas']], ignore_index=True)
+        deltas = deltas.drop_duplicates(subset='RowId', keep='last') # Latest edit of each row wins
+        rows = deltas['RowId'].to_numpy()
+        for col in df_fatura.columns:
+            df_fatura.loc[rows, col] = deltas[col].to_numpy()
+    snapshot_state['view'] = {key: _from_json(value) for key, value in snapshot_state.get('view', {}).items()}
+    return df_fatura, snapshot_state
+
+
+def all_snapshot_dirs(history_root=HISTORY_ROOT):
+    """Snapshot directories of every history (each user's and the shared one) that exist."""
+    history_dirs = [history_root]
+    users_dir = os.path.join(history_root, USER_HISTORIES_DIR)
+    if os.path.isdir(users_dir):
+        history_dirs += [entry.path for entry in os.scandir(users_dir) if entry.is_dir()]
+    snapshot_dirs = [os.path.join(history_dir, SNAPSHOTS_DIR) for history_dir in history_dirs]
+    return [snapshot_dir for snapshot_dir in snapshot_dirs if os.path.isdir(snapshot_dir)]
+
+
+def prune_snapshots(max_age_days=SNAPSHOT_MAX_AGE_DAYS, snapshot_dirs=None):
+    """Removes the snapshots not written for max_age_days (of every user by default)."""
+    limit = time.time() - max_age_days * 86400
+    for snapshot_dir in all_snapshot_dirs() if snapshot_dirs is None else snapshot_dirs:
+        if not os.path.isdir(snapshot_dir):
+            continue
+        for entry in os.scandir(snapshot_dir):
+            state_path = os.path.join(entry.path, STATE_FILE)
+            if entry.is_dir() and _ID_PATTERN.fullmatch(entry.name):
+                modified = os.path.getmtime(state_path) if os.path.exists(state_path) else entry.stat().st_mtime
+                if modified < limit:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+
+# --- Streamlit (session state and page URL) ---
+def session_snapshot_dir(create=False):
+    """Snapshot directory of the current session's history (None when the session has no history yet)."""
+    history_dir = session_history_dir(create=create)
+    return os.path.join(history_dir, SNAPSHOTS_DIR) if history_dir is not None else None
+
+
+def restore_session_snapshot():
+    """
+    Call at the top of the main page, before the session state defaults: when this session
+    has no data and the URL has ?snapshot=<id>, loads that snapshot into the session. Only
+    the snapshots of the session's own history are looked up: an id saved by another user
+    is not found. The session continues in a fork of the snapshot (new id in the URL), so
+    another session opened with the same URL keeps its own files.
+
+    Returns:
+        bool: True if a snapshot was restored.
+    """
+    import streamlit as st
+
+    snapshot_id = st.query_params.get(SNAPSHOT_QUERY_PARAM)
+    if st.session_state.get('df_fatura') is not None:
+        return False
+    snapshot_dir = session_snapshot_dir()
+    if snapshot_dir is None or snapshot_path(snapshot_id, snapshot_dir) is None:
+        return False
+    try:
+        snapshot_id = fork_snapshot(snapshot_id, snapshot_dir)
+        df_fatura, snapshot_state = load_snapshot(snapshot_id, snapshot_dir) if snapshot_id else (None, None)
+    except Exception as e:
+        st.warning(f"Não foi possível restaurar a sessão salva: {e}")
+        return False
+    if df_fatura is None:
+        return False
+
+    for key, value in snapshot_state['view'].items():
+        if key != 'history_id': # The snapshot was found in this session's history
+            st.session_state[key] = value
+    st.session_state.df_fatura = df_fatura
+    st.session_state.df_for_plot = df_fatura
+    st.session_state.df_fatura_shared = True # Columns may be memory-mapped: copied before the first edit
+    st.session_state.categorias_mapeadas = snapshot_state['categorias_mapeadas']
+    st.session_state.data_version = snapshot_state['meta']['data_version']
+    st.session_state.snapshot_id = snapshot_id
+    st.query_params[SNAPSHOT_QUERY_PARAM] = snapshot_id
+    st.session_state.snapshot_meta = snapshot_state['meta']
+    st.session_state.snapshot_state_json = None # Rewritten on the next save
+    st.session_state.snapshot_restored = True
+    return True
+
+
+def save_session_snapshot():
+    """Call at the end of the main page: snapshots this session's working set and puts its id in the URL."""
+    import streamlit as st
+
+    if st.session_state.get('df_fatura') is None:
+        return None
+    snapshot_dir = session_snapshot_dir(create=True)
+    if st.session_state.get('snapshot_id') is None:
+        st.session_state.snapshot_id = uuid.uuid4().hex
+        prune_snapshots()
+    if st.query_params.get(SNAPSHOT_QUERY_PARAM) != st.session_state.snapshot_id:
+        st.query_params[SNAPSHOT_QUERY_PARAM] = st.session_state.snapshot_id
+    try:
+        return save_snapshot(st.session_state, st.session_state.snapshot_id, snapshot_dir)
+    except Exception as e:
+        st.warning(f"Não foi possível salvar o snapshot da sessão: {e}")
+        return None
+
+
+def discard_session_snapshot():
+    """Deletes this session's snapshot and its data, and removes the snapshot id from the URL."""
+    import streamlit as st
+
+    snapshot_dir = session_snapshot_dir()
+    directory = snapshot_path(st.session_state.get('snapshot_id'), snapshot_dir) if snapshot_dir else None
+    if directory is not None:
+        shutil.rmtree(directory, ignore_errors=True)
+    if SNAPSHOT_QUERY_PARAM in st.query_params:
+        del st.query_params[SNAPSHOT_QUERY_PARAM]
+    for key in ['df_fatura', 'df_for_plot', 'uploaded_file_name', 'statement_id', 'snapshot_id', 'snapshot_meta', 'snapshot_state_json']:
+        st.session_state[key] = None
+    st.session_state.categorias_mapeadas = {}
+    st.session_state.show_charts = False
+    st.session_state.snapshot_restored = False
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Statement file parsing without Streamlit, shared by the app (load_data) and the local
+categorization service. Problems with the file are raised as StatementError with the
+message shown to the user.
+"""
+import os
+import re
+from array import array
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from table_paging import add_row_ids
+from xlsx_reader import iter_xlsx_rows
+
+SUPPORTED_EXTENSIONS = ['.xls', '.xlsx', '.csv']
+
+# Expected columns (case-insensitive matching) -> standard names
+COLUNAS_NECESSARIAS = {'data': 'Data', 'lançamento': 'Descricao', 'valor': 'Valor'}
+DATE_FORMATS = ['%d/%m/%Y', '%Y-%m-%d', '%m/%d/%Y', '%d-%m-%Y'] # Added %d-%m-%Y
+
+# A date cell given as text (e.g. '05/01/2025', '2025-01-05'); other rows after the header are summaries
+DATE_TEXT_PATTERN = re.compile(r'^\s*\d{1,4}[/-]\d{1,2}[/-]\d{1,4}\s*$')
+
+
+class StatementError(ValueError):
+    """The file could not be read as a statement (message is user-facing, in Portuguese)."""
+
+
+def limpar_valor(valor):
+    """Cleans currency strings and converts to float."""
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    if isinstance(valor, str):
+        # Remove currency symbols, spaces, and replace comma decimal separator
+        valor_limpo = re.sub(r'[R$\s]', '', valor).replace(',', '.')
+        try:
+            return float(valor_limpo)
+        except ValueError:
+            # Handle cases where comma might be used as thousands separator
+            valor_limpo_alt = valor.replace('.', '').replace(',', '.')
+            try:
+                return float(valor_limpo_alt)
+            except ValueError:
+                return np.nan # Return NaN if conversion fails
+    return np.nan # Return NaN for other types
+
+
+def _read_csv(file_obj):
+    """Tries UTF-8 / ISO-8859-1 with ',' and ';' separators."""
+    errors = []
+    for encoding, sep in (('utf-8', ','), ('ISO-8859-1', ','), ('utf-8', ';'), ('ISO-8859-1', ';')):
+        file_obj.seek(0) # Reset file pointer for next read attempt
+        try:
+            df = pd.read_csv(file_obj, encoding=encoding, encoding_errors='replace', sep=sep)
+        except Exception as e:
+            errors.append(f"{encoding}({sep}): {e}")
+            continue
+        # Handle potential issues with CSV headers/footers by checking for expected columns
+        if not df.empty and len(df.columns) >= 3:
+            return df
+    if errors:
+        raise StatementError(f"Não foi possível ler o arquivo CSV. Tente salvar como UTF-8 com separador ','. Erros: {'; '.join(errors)}")
+    raise StatementError("Não foi possível ler o arquivo CSV. Verifique o formato, codificação e separador.")
+
+
+def _header_positions(row):
+    """Positions of the 'data' / 'lançamento' / 'valor' cells if this row is the header, else None."""
+    positions = {}
+    for position, cell in enumerate(row):
+        if isinstance(cell, str):
+            name = cell.strip().lower()
+            if name in COLUNAS_NECESSARIAS and name not in positions:
+                positions[name] = position
+    if len(positions) < len(COLUNAS_NECESSARIAS):
+        return None
+    return [positions[name] for name in COLUNAS_NECESSARIAS]
+
+
+def _stream_statement_rows(rows):
+    """
+    Scans the rows of a sheet once: rows before the header (bank preamble) are skipped,
+    the header row gives the column positions, and after it only rows whose date cell is a
+    date (or date-like text) are kept; section titles, repeated headers and totals are skipped.
+    Only the three columns are kept, with the values in a float array.
+
+    Returns:
+        pd.DataFrame with 'data', 'lançamento' and 'valor', or None if no header row was found.
+    """
+    positions = None
+    datas, descricoes, valores = [], [], array('d')
+    for row in rows:
+        if positions is None:
+            positions = _header_positions(row)
+            if positions is not None:
+                pos_data, pos_descricao, pos_valor = positions
+                width = max(positions) + 1
+            continue
+        if len(row) < width:
+            row = list(row) + [None] * (width - len(row))
+        data = row[pos_data]
+        if isinstance(data, str):
+            if not DATE_TEXT_PATTERN.match(data):
+                continue
+        elif not isinstance(data, (datetime, date)):
+            continue
+        valor = row[pos_valor]
+        datas.append(data)
+        descricoes.append(row[pos_descricao] if row[pos_descricao] is not None else '') # Empty ones are dropped later
+        valores.append(float(valor) if isinstance(valor, (int, float)) and not isinstance(valor, bool) else limpar_valor(valor))
+    if positions is None:
+        return None
+
+    # Date cells typed as dates become a datetime64 column directly; text dates are parsed later
+    if datas and all(isinstance(data, (datetime, date)) for data in datas):
+        datas = pd.to_datetime(pd.Series(datas, dtype=object))
+    else:
+        datas = pd.Series([data.strftime('%d/%m/%Y') if isinstance(data, (datetime, date)) else data for data in datas], dtype=object)
+    return pd.DataFrame({
+        'data': datas,
+        'lançamento': pd.Series(descricoes, dtype=object),
+        'valor': np.frombuffer(valores, dtype=np.float64) if valores else np.array([], dtype=np.float64),
+    })
+
+
+def _openpyxl_rows(file_obj):
+    """Row values of the first sheet, streamed by openpyxl in read-only mode."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_obj, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _xls_rows(file_obj):
+    """Row values of the first sheet of a legacy .xls (xlrd), with date cells as datetime."""
+    import xlrd
+
+    book = xlrd.open_workbook(file_contents=file_obj.read(), on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        for i in range(sheet.nrows):
+            # Row slices of xlrd's value/type arrays (no Cell object per cell); empty cells are ''
+            values, types = sheet.row_values(i), sheet.row_types(i)
+            if xlrd.XL_CELL_DATE in types:
+                values = [xlrd.xldate_as_datetime(value, book.datemode) if cell_type == xlrd.XL_CELL_DATE else value
+                          for value, cell_type in zip(values, types)]
+            yield values
+    finally:
+        book.release_resources()
+
+
+def read_excel_fast(file_obj, file_extension):
+    """
+    Streaming read of the first sheet (see _stream_statement_rows). For .xlsx the minimal
+    reader of xlsx_reader.py is tried first and openpyxl read-only is the fallback.
+    Returns None when no header row was found, so the caller can fall back to pd.read_excel.
+    """
+    if file_extension == '.xls':
+        return _stream_statement_rows(_xls_rows(file_obj))
+    try:
+        df = _stream_statement_rows(iter_xlsx_rows(file_obj))
+    except Exception:
+        df = None # Unusual package layout: let openpyxl read it
+    if df is not None:
+        return df
+    file_obj.seek(0)
+    return _stream_statement_rows(_openpyxl_rows(file_obj))
+
+
+def read_statement_table(file_obj, file_name):
+    """Reads the first sheet (Excel) or the CSV content as it is in the file."""
+    file_extension = os.path.splitext(file_name)[1].lower()
+    if file_extension in ['.xls', '.xlsx']:
+        df = read_excel_fast(file_obj, file_extension)
+        if df is not None:
+            return df
+        # No 'data' / 'lançamento' / 'valor' header found: full read (reports the missing columns)
+        file_obj.seek(0)
+        engine = 'openpyxl' if file_extension == '.xlsx' else 'xlrd'
+        return pd.read_excel(file_obj, engine=engine, sheet_name=0)
+    if file_extension == '.csv':
+        return _read_csv(file_obj)
+    raise StatementError("Formato de arquivo não suportado. Carregue um arquivo .xls, .xlsx ou .csv.")
+
+
+def normalize_statement(df):
+    """
+    Renames the 'data' / 'lançamento' / 'valor' columns, converts dates and values, drops
+    negative values and empty descriptions, adds the category columns, 'MesAno' and 'RowId'.
+    """
+    # Find the actual column names in the DataFrame (case-insensitive search)
+    df_cols_lower = {str(col).lower(): col for col in df.columns}
+    colunas_encontradas = {}
+    colunas_faltando = []
+    for col_padrao, col_final in COLUNAS_NECESSARIAS.items():
+        if col_padrao in df_cols_lower:
+            colunas_encontradas[df_cols_lower[col_padrao]] = col_final
+        else:
+            colunas_faltando.append(col_padrao)
+    if colunas_faltando:
+        raise StatementError(f"Colunas essenciais não encontradas no arquivo: {', '.join(colunas_faltando)}. Certifique-se de que o arquivo contenha as colunas 'data', 'lançamento' e 'valor'.")
+
+    # Rename columns to standard names and select only the final required columns
+    df = df.rename(columns=colunas_encontradas)[list(COLUNAS_NECESSARIAS.values())]
+
+    # Process 'Data' column (already datetime when the sheet has date cells)
+    try:
+        if pd.api.types.is_datetime64_any_dtype(df['Data']):
+            data_convertida = df['Data']
+        else:
+            data_limpada = df['Data'].astype(str).str.strip()
+            # Try multiple date formats; stop at the first one that converts at least some dates
+            for fmt in DATE_FORMATS:
+                data_convertida = pd.to_datetime(data_limpada, format=fmt, errors='coerce')
+                if not data_convertida.isnull().all():
+                    break
+    except Exception as e:
+        raise StatementError(f"Erro CRÍTICO durante a conversão da coluna 'data': {e}. Verifique o formato.")
+    if len(df) > 0 and data_convertida.isnull().all():
+        raise StatementError("Falha ao converter TODAS as datas. Verifique se a coluna 'data' está em um formato reconhecido (ex: DD/MM/YYYY, YYYY-MM-DD, DD-MM-YYYY).")
+    df = df.assign(Data=data_convertida)
+
+    # Process 'Valor' column (the streaming Excel reader already returns floats)
+    if not pd.api.types.is_float_dtype(df['Valor']):
+        df['Valor'] = df['Valor'].apply(limpar_valor)
+
+    # --- Exclude rows with negative 'Valor' ---
+    df = df[df['Valor'] >= 0].copy() # Keep only non-negative values
+
+    # Filter out rows with empty or NaN descriptions (after excluding negative values)
+    df['Descricao'] = df['Descricao'].astype(str)
+    df = df[(df['Descricao'].str.strip() != '') & (df['Descricao'].str.lower() != 'nan')].copy()
+
+    # Initialize category columns
+    df['Categoria Nível 1'] = 'Não categorizado'
+    df['Categoria Nível 2'] = None
+
+    # Add 'MesAno' column and sort by date if data is valid (otherwise keep file order)
+    if pd.api.types.is_datetime64_any_dtype(df['Data']) and not df['Data'].isnull().all():
+        df['MesAno'] = df['Data'].dt.to_period('M').astype(str)
+        df = df.sort_values(by='Data').reset_index(drop=True)
+    else:
+        df['MesAno'] = 'N/A'
+        df = df.reset_index(drop=True)
+
+    # Stable row id (equal to the index) used to map table edits back to this frame
+    return add_row_ids(df)
+
+
+def parse_statement(file_obj, file_name):
+    """
+    Reads and normalizes a statement file (.xls, .xlsx or .csv).
+
+    Args:
+        file_obj: Binary file-like object (an uploaded file, BytesIO, open file).
+        file_name (str): Name used to pick the reader by extension.
+
+    Returns:
+        pd.DataFrame: Columns 'Data', 'Descricao', 'Valor', 'Categoria Nível 1',
+        'Categoria Nível 2', 'MesAno' and 'RowId' (categories not applied yet).
+
+    Raises:
+        StatementError: The file is not a readable statement.
+    """
+    return normalize_statement(read_statement_table(file_obj, file_name))
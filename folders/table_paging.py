@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Server-side pagination, search and sorting for the transaction tables.
+
+Only the rows of the visible page are handed to Streamlit, so the payload sent to
+the browser depends on the page size and not on the size of the statement.
+Rows are identified by the stable 'RowId' column created in load_data.
+"""
+import numpy as np
+import pandas as pd
+
+ROW_ID_COL = 'RowId'
+PAGE_SIZE_OPTIONS = [25, 50, 100, 250, 500]
+DEFAULT_PAGE_SIZE = 50
+
+
+def add_row_ids(df):
+    """Adds a stable 'RowId' column (0..n-1) used to map edits back to the source rows."""
+    df[ROW_ID_COL] = np.arange(len(df), dtype=np.int64)
+    return df
+
+
+def compute_row_order(df, search_text='', sort_col=None, ascending=True):
+    """
+    Returns the positions (iloc) of the rows matching the search, in display order.
+
+    Args:
+        df (pd.DataFrame): Full transaction frame.
+        search_text (str): Case-insensitive text searched in 'Descricao' (plain substring).
+        sort_col (str): Column to sort by, or None to keep the current order.
+        ascending (bool): Sort direction.
+
+    Returns:
+        np.ndarray: Row positions to display.
+    """
+    positions = np.arange(len(df))
+
+    search_text = (search_text or '').strip().lower()
+    if search_text:
+        mask = df['Descricao'].astype(str).str.lower().str.contains(search_text, regex=False, na=False).to_numpy()
+        positions = positions[mask]
+
+    if sort_col and sort_col in df.columns and len(positions) > 0:
+        sort_values = df[sort_col].iloc[positions]
+        # Stable sort keeps the original (date) order for ties; NaN/None always go last
+        order = sort_values.reset_index(drop=True).sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+        positions = positions[order]
+
+    return positions
+
+
+def get_page(df, positions, page, page_size):
+    """
+    Slices one page out of the ordered positions.
+
+    Returns:
+        tuple: (df_page indexed by RowId, current page clamped to a valid value, total pages)
+    """
+    total_pages = max(1, int(np.ceil(len(positions) / page_size)))
+    page = min(max(1, int(page)), total_pages)
+    start = (page - 1) * page_size
+    page_positions = positions[start:start + page_size]
+    df_page = df.iloc[page_positions].set_index(ROW_ID_COL)
+    return df_page, page, total_pages
+
+
+def diff_page_edits(df_page_original, df_page_edited, columns):
+    """
+    Finds the cells changed in the editor for the given columns.
+
+    Returns:
+        dict: {column: pd.Series of new values indexed by RowId} for columns with changes.
+    """
+    changes = {}
+    for col in columns:
+        if col not in df_page_edited.columns:
+            continue
+        before = df_page_original[col]
+        after = df_page_edited[col].reindex(before.index)
+        both_missing = before.isna() & after.isna()
+        changed = (before != after) & ~both_missing
+        if changed.any():
+            changes[col] = after[changed]
+    return changes
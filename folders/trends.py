@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Month-over-month category trends computed from the per-month aggregates of history.py
+(a months x categories matrix), never from the raw transactions.
+"""
+import pandas as pd
+
+ROLLING_WINDOWS = [3, 6, 12]
+
+
+def monthly_category_matrix(aggregates, nivel_col):
+    """
+    Months x categories matrix of totals, with every month of the range present (zeros
+    where a category had no spending) so shifts and rolling windows are in real months.
+
+    Args:
+        aggregates (pd.DataFrame): Output of history.load_monthly_aggregates/update_monthly_aggregates.
+        nivel_col (str): 'Categoria Nível 1' or 'Categoria Nível 2'.
+    """
+    if aggregates.empty:
+        return pd.DataFrame()
+    matrix = aggregates.pivot_table(index='MesAno', columns=nivel_col, values='Valor', aggfunc='sum', fill_value=0.0)
+    matrix.index = pd.PeriodIndex(matrix.index, freq='M')
+    full_range = pd.period_range(matrix.index.min(), matrix.index.max(), freq='M')
+    return matrix.reindex(full_range, fill_value=0.0).sort_index()
+
+
+def category_trends(matrix):
+    """
+    Trend indicators per month and category.
+
+    Returns:
+        pd.DataFrame: Long format with 'MesAno', 'Categoria', 'Valor', 'Variação MoM',
+        'Variação MoM (%)', 'Média 3m', 'Média 6m', 'Média 12m', 'Valor Ano Anterior'
+        and 'Variação YoY'.
+    """
+    if matrix.empty:
+        return pd.DataFrame()
+    indicadores = {
+        'Valor': matrix,
+        'Variação MoM': matrix.diff(),
+        'Variação MoM (%)': matrix.pct_change(fill_method=None).replace([float('inf'), float('-inf')], pd.NA) * 100,
+    }
+    for window in ROLLING_WINDOWS:
+        indicadores[f'Média {window}m'] = matrix.rolling(window, min_periods=1).mean()
+    anterior = matrix.shift(12)
+    indicadores['Valor Ano Anterior'] = anterior
+    indicadores['Variação YoY'] = matrix - anterior
+
+    trends = pd.concat({nome: df.stack() for nome, df in indicadores.items()}, axis=1)
+    trends.index.names = ['MesAno', 'Categoria']
+    trends = trends.reset_index()
+    trends['MesAno'] = trends['MesAno'].dt.to_timestamp()
+    return trends
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Which statement history a session reads and writes.
+
+By default every user has a private history under historico/usuarios/<id>/, identified by
+an id kept in the session and in the page URL (?historico=<id>), so the transactions of one
+user are never shown to another on a shared deployment. Single-user installations can keep
+one history for every session with FATURA_HISTORY_SCOPE=shared (historico/ itself).
+
+No pandas here: the pages call this before deciding whether to load any data.
+"""
+import os
+import re
+import uuid
+
+HISTORY_ROOT = os.path.join(os.path.dirname(__file__), '..', 'historico') # Same as history.HISTORY_DIR
+USER_HISTORIES_DIR = 'usuarios'
+HISTORY_SCOPE = os.environ.get('FATURA_HISTORY_SCOPE', 'user') # 'user' (one history per id) or 'shared'
+HISTORY_QUERY_PARAM = 'historico'
+_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+
+def user_history_dir(history_id, history_root=HISTORY_ROOT):
+    """History directory of an id, or None when the id is not a valid history id."""
+    if not isinstance(history_id, str) or not _ID_PATTERN.fullmatch(history_id):
+        return None
+    return os.path.join(history_root, USER_HISTORIES_DIR, history_id)
+
+
+def session_history_dir(create=False):
+    """
+    History directory of the current Streamlit session: the shared one, or the one of the
+    id in the session / URL. With create=True a new id is made when there is none yet
+    (the main page, when it saves a statement).
+
+    Returns:
+        str: Directory for history.py's history_dir arguments, or None (no history yet).
+    """
+    import streamlit as st
+
+    if HISTORY_SCOPE == 'shared':
+        return HISTORY_ROOT
+    history_id = st.session_state.get('history_id')
+    if user_history_dir(history_id) is None:
+        history_id = st.query_params.get(HISTORY_QUERY_PARAM)
+    if user_history_dir(history_id) is None:
+        if not create:
+            return None
+        history_id = uuid.uuid4().hex
+    st.session_state.history_id = history_id
+    if st.query_params.get(HISTORY_QUERY_PARAM) != history_id:
+        st.query_params[HISTORY_QUERY_PARAM] = history_id # Bookmark / reopen to keep using this history
+    return user_history_dir(history_id)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*- # Define encoding
+"""
+Minimal streaming reader for the first sheet of an .xlsx file (values only).
+
+The sheet XML is decompressed in chunks and scanned with a few byte regexes, one row at a
+time, instead of building a cell object per cell as openpyxl does. Shared strings and the
+date number formats (to turn date cells into datetime) are read once, up front. Formulas,
+styles other than dates, merged cells etc. are ignored: this is only meant for reading
+tabular exports such as bank statements. Anything it does not understand raises, and the
+caller falls back to openpyxl.
+"""
+import posixpath
+import re
+import zipfile
+from datetime import datetime, timedelta
+from html import unescape
+from xml.etree.ElementTree import iterparse
+
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PKG = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+CHUNK_BYTES = 1 << 20
+# Built-in number formats that display dates/times (ECMA-376, 18.8.30)
+BUILTIN_DATE_FORMATS = set(range(14, 23)) | set(range(27, 37)) | {45, 46, 47} | set(range(50, 59))
+
+CELL_RE = re.compile(rb'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+REF_RE = re.compile(rb'\br="([A-Z]+)')
+TYPE_RE = re.compile(rb'\bt="(\w+)"')
+STYLE_RE = re.compile(rb'\bs="(\d+)"')
+VALUE_RE = re.compile(rb'<v>([^<]*)</v>')
+TEXT_RE = re.compile(rb'<t\b[^>]*>([^<]*)</t>')
+
+
+def _first_sheet(zf):
+    """Path of the first sheet in the package and whether the workbook uses the 1904 date system."""
+    sheet_rel_id, date1904 = None, False
+    for _, element in iterparse(zf.open('xl/workbook.xml')):
+        if element.tag == NS_MAIN + 'workbookPr':
+            date1904 = element.get('date1904') in ('1', 'true')
+        elif element.tag == NS_MAIN + 'sheet' and sheet_rel_id is None:
+            sheet_rel_id = element.get(NS_REL + 'id')
+    for _, element in iterparse(zf.open('xl/_rels/workbook.xml.rels')):
+        if element.tag == NS_PKG + 'Relationship' and element.get('Id') == sheet_rel_id:
+            target = element.get('Target')
+            if target.startswith('/'):
+                return target.lstrip('/'), date1904
+            return posixpath.normpath(posixpath.join('xl', target)), date1904
+    raise KeyError('First worksheet not found in workbook.xml')
+
+
+def _shared_strings(zf):
+    if 'xl/sharedStrings.xml' not in zf.namelist():
+        return []
+    strings = []
+    for _, element in iterparse(zf.open('xl/sharedStrings.xml')):
+        if element.tag == NS_MAIN + 'si':
+            strings.append(''.join(text.text or '' for text in element.iter(NS_MAIN + 't')))
+            element.clear()
+    return strings
+
+
+def _date_style_ids(zf):
+    """Indexes of the cell formats (the 's' attribute) whose number format is a date."""
+    if 'xl/styles.xml' not in zf.namelist():
+        return set()
+    custom_is_date, cell_formats, in_cell_xfs = {}, [], False
+    for event, element in iterparse(zf.open('xl/styles.xml'), events=('start', 'end')):
+        if element.tag == NS_MAIN + 'cellXfs':
+            in_cell_xfs = event == 'start'
+        elif event == 'end' and element.tag == NS_MAIN + 'numFmt':
+            # Date if it has d/m/y/h/s outside quoted text, [colors/locales] and escaped chars
+            code = re.sub(r'"[^"]*"|\[[^\]]*\]|\\.', '', element.get('formatCode', ''))
+            custom_is_date[int(element.get('numFmtId'))] = bool(re.search(r'[dmyhs]', code, re.I))
+        elif event == 'end' and element.tag == NS_MAIN + 'xf' and in_cell_xfs:
+            fmt_id = int(element.get('numFmtId', 0))
+            cell_formats.append(custom_is_date.get(fmt_id, fmt_id in BUILTIN_DATE_FORMATS))
+    return {style_id for style_id, is_date in enumerate(cell_formats) if is_date}
+
+
+def _column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + letter - 64 # bytes iterate as ints ('A' == 65)
+    return index - 1
+
+
+def _text(raw):
+    text = raw.decode('utf-8')
+    return unescape(text) if '&' in text else text
+
+
+def iter_xlsx_rows(file_obj):
+    """
+    Yields the values of each row of the first sheet as a tuple (None for empty cells).
+    Numbers come as float, date-formatted numbers as datetime, text as str.
+    """
+    with zipfile.ZipFile(file_obj) as zf:
+        sheet_path, date1904 = _first_sheet(zf)
+        strings = _shared_strings(zf)
+        date_styles = _date_style_ids(zf)
+        epoch = datetime(1904, 1, 1) if date1904 else datetime(1899, 12, 30)
+        columns = {} # Column letters -> index (few distinct values)
+
+        def parse_row(row_xml):
+            row = {}
+            for match in CELL_RE.finditer(row_xml):
+                attrs, inner = match.group(1), match.group(2)
+                ref = REF_RE.search(attrs)
+                if ref is None:
+                    col = len(row)
+                else:
+                    col = columns.get(ref.group(1))
+                    if col is None:
+                        col = columns[ref.group(1)] = _column_index(ref.group(1))
+                value = None
+                if inner:
+                    cell_type = TYPE_RE.search(attrs)
+                    cell_type = cell_type.group(1) if cell_type else b'n'
+                    if cell_type == b'inlineStr':
+                        value = _text(b''.join(TEXT_RE.findall(inner)))
+                    else:
+                        raw = VALUE_RE.search(inner)
+                        if raw is not None:
+                            raw = raw.group(1)
+                            if cell_type == b's':
+                                value = strings[int(raw)]
+                            elif cell_type == b'b':
+                                value = raw == b'1'
+                            elif cell_type in (b'str', b'e', b'd'):
+                                value = _text(raw)
+                            else:
+                                value = float(raw)
+                                style = STYLE_RE.search(attrs)
+                                if style is not None and int(style.group(1)) in date_styles:
+                                    # Whole days plus the fraction rounded to ms (same as openpyxl)
+                                    days, fraction = divmod(value, 1)
+                                    value = epoch + timedelta(days=days, milliseconds=round(fraction * 86_400_000))
+                row[col] = value
+            return tuple(row.get(i) for i in range(max(row) + 1)) if row else ()
+
+        # Rows are cut at '</row>'; an incomplete row stays in the buffer for the next chunk
+        pending = b''
+        with zf.open(sheet_path) as sheet:
+            while True:
+                chunk = sheet.read(CHUNK_BYTES)
+                pending += chunk
+                end = pending.rfind(b'</row>') if chunk else len(pending)
+                if end < 0:
+                    continue
+                block, pending = pending[:end], pending[end + len(b'</row>'):]
+                for row_xml in block.split(b'</row>'):
+                    start = row_xml.find(b'<row')
+                    if start >= 0:
+                        yield parse_row(row_xml[start:])
+                if not chunk:
+                    break
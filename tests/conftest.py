@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*- # Define encoding
+import os
+import sys
+
+# The app runs with folders/ on the path (streamlit run folders/app.py); the tests import its modules the same way
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'folders'))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*- # Define encoding
+import pandas as pd
+
+from history import load_history_transactions, load_monthly_aggregates, save_statement_transactions, update_monthly_aggregates
+from trends import monthly_category_matrix
+
+
+def make_statement(rows):
+    """A categorized statement as the app keeps it (index == RowId)."""
+    df = pd.DataFrame(rows, columns=['Data', 'Descricao', 'Valor', 'Categoria Nível 1', 'Categoria Nível 2'])
+    df['Data'] = pd.to_datetime(df['Data'])
+    df['MesAno'] = df['Data'].dt.to_period('M').astype(str)
+    df.insert(0, 'RowId', range(len(df)))
+    return df
+
+
+STATEMENT = make_statement([
+    ('2026-01-05', 'UBER TRIP', 20.0, 'Uber', None),
+    ('2026-01-05', 'UBER TRIP', 20.0, 'Uber', None), # Two equal rides on the same day
+    ('2026-01-12', 'NETFLIX.COM', 39.9, 'Assinaturas', 'Streaming'),
+    ('2026-02-03', 'PADARIA', 15.5, 'Alimentação', None),
+])
+
+
+def test_same_statement_under_two_ids_counts_once(tmp_path):
+    save_statement_transactions('a' * 16, STATEMENT, history_dir=str(tmp_path))
+    save_statement_transactions('b' * 16, STATEMENT, history_dir=str(tmp_path)) # Same statement, re-exported file
+
+    history = load_history_transactions(str(tmp_path))
+
+    assert len(history) == len(STATEMENT)
+    assert history['Valor'].sum() == STATEMENT['Valor'].sum()
+    assert (history['Descricao'] == 'UBER TRIP').sum() == 2 # Identical charges of one statement are kept
+
+
+def test_overlapping_statements_count_shared_rows_once(tmp_path):
+    save_statement_transactions('a' * 16, STATEMENT, history_dir=str(tmp_path))
+    later = make_statement([
+        ('2026-02-03', 'PADARIA', 15.5, 'Alimentação', None), # Also in the first statement
+        ('2026-02-10', 'UBER TRIP', 20.0, 'Uber', None),
+    ])
+    save_statement_transactions('c' * 16, later, history_dir=str(tmp_path))
+
+    history = load_history_transactions(str(tmp_path))
+
+    assert len(history) == len(STATEMENT) + 1
+    assert (history['Descricao'] == 'PADARIA').sum() == 1
+
+
+def test_same_statement_under_two_ids_leaves_trends_unchanged(tmp_path):
+    update_monthly_aggregates('a' * 16, STATEMENT, history_dir=str(tmp_path))
+    before = monthly_category_matrix(load_monthly_aggregates(str(tmp_path)), 'Categoria Nível 1')
+
+    update_monthly_aggregates('b' * 16, STATEMENT, history_dir=str(tmp_path)) # Same statement, re-exported file
+    after = monthly_category_matrix(load_monthly_aggregates(str(tmp_path)), 'Categoria Nível 1')
+
+    pd.testing.assert_frame_equal(after, before)
+    assert after.loc[pd.Period('2026-01', freq='M'), 'Uber'] == 40.0
+
+
+def test_overlapping_statements_count_shared_month_once(tmp_path):
+    update_monthly_aggregates('a' * 16, STATEMENT, history_dir=str(tmp_path))
+    later = make_statement([
+        ('2026-02-03', 'PADARIA', 15.5, 'Alimentação', None), # Also in the first statement
+        ('2026-03-10', 'UBER TRIP', 20.0, 'Uber', None),
+    ])
+    aggregates = update_monthly_aggregates('c' * 16, later, history_dir=str(tmp_path))
+
+    matrix = monthly_category_matrix(aggregates, 'Categoria Nível 1')
+    assert matrix.loc[pd.Period('2026-02', freq='M'), 'Alimentação'] == 15.5
+    assert matrix.loc[pd.Period('2026-03', freq='M'), 'Uber'] == 20.0
+    assert matrix.loc[pd.Period('2026-01', freq='M'), 'Uber'] == 40.0 # Untouched month kept
+
+
+def test_edited_statement_regroups_the_months_it_left(tmp_path):
+    update_monthly_aggregates('a' * 16, STATEMENT, history_dir=str(tmp_path))
+    edited = STATEMENT.copy()
+    edited.loc[3, 'Data'] = pd.Timestamp('2026-01-30') # Date fixed in the table: February is now empty
+    edited.loc[2, 'Categoria Nível 1'] = 'Streaming'
+
+    aggregates = update_monthly_aggregates('a' * 16, edited, history_dir=str(tmp_path))
+
+    assert set(aggregates['MesAno']) == {'2026-01'}
+    assert aggregates['Valor'].sum() == STATEMENT['Valor'].sum()
+    assert 'Assinaturas' not in set(aggregates['Categoria Nível 1'])
+
+
+def test_per_statement_aggregates_are_rebuilt(tmp_path):
+    save_statement_transactions('a' * 16, STATEMENT, history_dir=str(tmp_path))
+    save_statement_transactions('b' * 16, STATEMENT, history_dir=str(tmp_path))
+    old = pd.DataFrame({'statement_id': ['a' * 16, 'b' * 16], 'MesAno': ['2026-01', '2026-01'], 'Categoria Nível 1': ['Uber', 'Uber'],
+                        'Categoria Nível 2': ['N/A ou Geral'] * 2, 'Valor': [40.0, 40.0], 'Quantidade': [2, 2]})
+    old.to_parquet(tmp_path / 'agregados_mensais.parquet', index=False) # Format of older versions (keyed by statement)
+
+    aggregates = update_monthly_aggregates('a' * 16, STATEMENT, history_dir=str(tmp_path))
+
+    assert 'statement_id' not in aggregates.columns
+    assert aggregates['Valor'].sum() == STATEMENT['Valor'].sum()